@@ -0,0 +1,56 @@
+import numpy as np
+
+from .bitboard import symmetry_permutations
+
+# Indexes into `symmetry_permutations`, in `Board.rotations` order
+SQUARE_SYMMETRIES = (0, 1, 2, 3, 4, 5, 6, 7)
+# A rectangle keeps its shape under the half turn and the two reflections only
+RECTANGLE_SYMMETRIES = (0, 1, 4, 5)
+REFLECTION_SYMMETRIES = (0, 1)
+
+
+class SymmetryAugmenter:
+    """
+    Moves batches of (state bits, action) pairs through board symmetries with precomputed index permutations.
+    States are boolean or numeric matrices indexed by edge position (as `VectorDotsAndBoxes.edges`) and actions are
+    edge positions. symmetries selects which of the 8 `symmetry_permutations` to use, the identity first.
+    """
+
+    def __init__(self, size, symmetries=SQUARE_SYMMETRIES):
+        self.size = size
+        self.symmetries = tuple(symmetries)
+        self.permutations = np.array(symmetry_permutations(size), dtype=np.intp)[list(self.symmetries)]
+        # Permuted states gather position p from the position that moves to p
+        self.inverse = np.argsort(self.permutations, axis=1)
+
+    def __len__(self):
+        return len(self.symmetries)
+
+    def transform_states(self, states, symmetries):
+        """
+        Row i of states moved by symmetries[i], an index into self.symmetries.
+        """
+        return np.take_along_axis(states, self.inverse[np.asarray(symmetries, dtype=np.intp)], axis=1)
+
+    def transform(self, states, actions, symmetries):
+        """
+        Row i of states and actions moved by symmetries[i], an index into self.symmetries.
+        """
+        symmetries = np.asarray(symmetries, dtype=np.intp)
+        return self.transform_states(states, symmetries), self.permutations[symmetries, actions]
+
+    def augment(self, states, actions):
+        """
+        Every symmetric copy of each pair: len(self) * n rows, grouped by symmetry, the original rows first.
+        """
+        states = np.asarray(states)
+        actions = np.asarray(actions, dtype=np.intp)
+        augmented_states = states[:, self.inverse].transpose(1, 0, 2).reshape(-1, states.shape[1])
+        augmented_actions = self.permutations[:, actions].reshape(-1)
+        return augmented_states, augmented_actions
+
+    def random_transform(self, states, actions, rng):
+        """
+        Each row moved by a symmetry drawn uniformly from rng.
+        """
+        return self.transform(states, actions, rng.integers(0, len(self), size=len(states)))
@@ -0,0 +1,273 @@
+import argparse
+import json
+import logging
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from .bitboard import board_tables
+from .dots_boxes import DotsAndBoxes, DotsAndBoxesCloseBoxesPolicy, DotsAndBoxesState
+from .learning_player import Board, BoardSaver, Canonicalizer, Rotator
+from .main import q_learning
+
+SIZES = (2, 3, 4, 5, 6)
+ENGINES = (
+    (DotsAndBoxes.ENGINE_GRAPH, DotsAndBoxes.OBSERVATION_EDGES),
+    (DotsAndBoxes.ENGINE_BITBOARD, DotsAndBoxes.OBSERVATION_MASK),
+)
+STORAGES = (BoardSaver.STORAGE_DICT, BoardSaver.STORAGE_DENSE)
+
+
+def _result(benchmark, size, operations, seconds, **parameters):
+    return {
+        "benchmark": benchmark,
+        "size": size,
+        **parameters,
+        "operations": operations,
+        "seconds": seconds,
+        "per_second": operations / seconds if seconds else float("inf"),
+    }
+
+
+def _timed(function, *args):
+    started = time.perf_counter()
+    value = function(*args)
+    return value, time.perf_counter() - started
+
+
+def random_states(size, count, seed):
+    """
+    count (state, free actions) pairs of games played at random, states with a mask observation.
+    """
+    rng = random.Random(seed)
+    tables = board_tables(size)
+    states = []
+    while len(states) < count:
+        mask, free = 0, list(tables.positions)
+        rng.shuffle(free)
+        player_points = 0
+        while free and len(states) < count:
+            states.append((DotsAndBoxesState(mask, player_points), [tables.edges[p] for p in free]))
+            mask |= 1 << free.pop()
+            player_points = min(size * size, player_points + rng.randint(0, 1))
+    return states
+
+
+def bench_env(size, engine, observation, steps, seed):
+    """
+    Steps per second of random moves against the greedy policy, resets included, and resets per second.
+    """
+    random.seed(seed)
+    rng = random.Random(seed)
+    env = DotsAndBoxes(size, DotsAndBoxesCloseBoxesPolicy(None), engine=engine, observation=observation)
+
+    def play():
+        env.reset()
+        for _ in range(steps):
+            _, info = env.step(env.free_actions[rng.randrange(len(env.free_actions))])
+            if info["done"]:
+                env.reset()
+
+    def resets():
+        for _ in range(steps // 10):
+            env.reset()
+
+    _, step_seconds = _timed(play)
+    _, reset_seconds = _timed(resets)
+    return [
+        _result("env_step", size, steps, step_seconds, engine=engine, observation=observation),
+        _result("env_reset", size, steps // 10, reset_seconds, engine=engine, observation=observation),
+    ]
+
+
+def bench_board_saver(size, storage, operations, seed):
+    """
+    contains, define and get calls per second over the states of random games, each state defined once. The
+    canonicalization cache is on, as in training, so contains pays for the misses and define and get mostly hit.
+    """
+    states = random_states(size, operations, seed)
+    Q = BoardSaver(size, storage=storage)
+
+    def define():
+        for state, actions in states:
+            Q.define(state, actions[0], 1.0)
+
+    def contains():
+        for state, _ in states:
+            Q.contains(state)
+
+    def get():
+        for state, actions in states:
+            Q.get(state, actions[0])
+
+    results = []
+    for name, function in (("contains", contains), ("define", define), ("get", get)):
+        _, seconds = _timed(function)
+        results.append(_result("board_saver_" + name, size, len(states), seconds, storage=storage))
+    return results
+
+
+def bench_canonicalization(size, boards, seed):
+    """
+    Canonical boards per second, the `Board.rotations` minimum and the `Canonicalizer`, uncached. Board.rotations
+    is a couple of orders of magnitude slower, it only gets the first hundredth of the boards.
+    """
+    states = random_states(size, boards, seed)
+    tables = board_tables(size)
+    edge_lists = [
+        [tables.edges[p] for p in tables.positions if state.state >> p & 1]
+        for state, _ in states[: max(1, boards // 100)]
+    ]
+    rotator = Rotator(size)
+    canonicalizer = Canonicalizer(size, cache_size=0)
+
+    # hash() folds masks wider than 61 bits, call Board.__hash__ itself
+    def rotations():
+        return [min(b.__hash__() for b in Board(rotator, size, edges).rotations()) for edges in edge_lists]
+
+    def canonical():
+        return [canonicalizer.canonical(state.state)[0] for state, _ in states]
+
+    _rotations, rotations_seconds = _timed(rotations)
+    _canonical, canonical_seconds = _timed(canonical)
+    assert _rotations == _canonical[: len(_rotations)], "Canonicalizer disagrees with Board.rotations"
+    return [
+        _result("canonical_rotations", size, len(edge_lists), rotations_seconds),
+        _result("canonical_canonicalizer", size, len(states), canonical_seconds),
+    ]
+
+
+def bench_q_learning(size, episodes, seed):
+    """
+    Episodes per second of tabular `q_learning` on the bitboard engine against the greedy policy. Exploration is
+    kept at 1, epsilon_greedy computes the argmax anyway, so every run of a size plays the same kind of games.
+    """
+    random.seed(seed)
+    env = DotsAndBoxes(
+        size,
+        DotsAndBoxesCloseBoxesPolicy(None),
+        engine=DotsAndBoxes.ENGINE_BITBOARD,
+        observation=DotsAndBoxes.OBSERVATION_MASK,
+    )
+    logger = logging.getLogger()
+    level = logger.level
+    logger.setLevel(logging.WARNING)
+    try:
+        Q, seconds = _timed(q_learning, env, episodes, 0.05, 0.95, 1.0, 1.0)
+    finally:
+        logger.setLevel(level)
+    return [_result("q_learning", size, episodes, seconds, states=len(Q.boards))]
+
+
+def bench_memory(size, storage, entries, seed):
+    """
+    Peak traced memory of a BoardSaver holding entries Q values, scaled to 1M entries.
+    """
+    states = random_states(size, entries, seed)
+    tracemalloc.start()
+    try:
+        Q = BoardSaver(size, cache_size=0, storage=storage)
+        for state, actions in states:
+            Q.define(state, actions[0], 1.0)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    result = _result("memory", size, len(states), 0.0, storage=storage)
+    del result["seconds"], result["per_second"]
+    result["peak_bytes_per_million"] = peak * 1_000_000 // len(states)
+    return [result]
+
+
+def _key(result):
+    return tuple(
+        (k, v)
+        for k, v in result.items()
+        if k not in ("operations", "seconds", "per_second", "states", "peak_bytes_per_million")
+    )
+
+
+def _best(benchmark, repeats, *args):
+    """
+    Results of the fastest of repeats calls of benchmark, per result.
+    """
+    best = {}
+    for _ in range(repeats):
+        for result in benchmark(*args):
+            _previous = best.get(_key(result))
+            if _previous is None or result.get("per_second", 0) > _previous.get("per_second", 0):
+                best[_key(result)] = result
+    return list(best.values())
+
+
+def run(sizes=SIZES, scale=1.0, seed=0, repeats=3):
+    """
+    Every benchmark on every size, keeping the fastest of repeats runs. Work is fixed per size, shrinking on larger
+    boards, and multiplied by scale.
+    """
+    results = []
+    for size in sizes:
+        # Games get longer and states larger with the board, keep each size in the same ballpark of time
+        work = max(1, int(scale * 20_000 * 4 / (size + 2)))
+        for engine, observation in ENGINES:
+            results += _best(bench_env, repeats, size, engine, observation, work, seed)
+        for storage in STORAGES:
+            results += _best(bench_board_saver, repeats, size, storage, 5 * work, seed)
+        results += _best(bench_canonicalization, repeats, size, 5 * work, seed)
+        results += _best(bench_q_learning, repeats, size, max(1, work // (size * size)), seed)
+        for storage in STORAGES:
+            results += bench_memory(size, storage, work, seed)
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "seed": seed,
+        "scale": scale,
+        "repeats": repeats,
+        "results": results,
+    }
+
+
+def compare(baseline, current):
+    """
+    Ratio of current to baseline per benchmark present in both: throughput for timed ones, bytes for memory.
+    Above 1 is faster, or larger.
+    """
+    metrics = {}
+    for result in baseline["results"]:
+        metrics[_key(result)] = result.get("per_second", result.get("peak_bytes_per_million"))
+    ratios = []
+    for result in current["results"]:
+        _baseline = metrics.get(_key(result))
+        if _baseline:
+            _current = result.get("per_second", result.get("peak_bytes_per_million"))
+            ratios.append((dict(_key(result)), _current / _baseline))
+    return ratios
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throughput benchmarks, written as JSON")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplier of the work of every benchmark")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeats", type=int, default=3, help="runs of each benchmark, the fastest is kept")
+    parser.add_argument("--output", help="JSON file to write, stdout by default")
+    parser.add_argument("--compare", help="JSON file of a previous run to print ratios against")
+    args = parser.parse_args()
+
+    report = run(args.sizes, args.scale, args.seed, args.repeats)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        for key, ratio in compare(previous, report):
+            print(" ".join(f"{k}={v}" for k, v in key.items()), f"{ratio:.3f}", file=sys.stderr)
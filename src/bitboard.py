@@ -0,0 +1,233 @@
+import functools
+from typing import NamedTuple
+
+import numpy as np
+
+
+class BoardTables(NamedTuple):
+    """
+    Precomputed geometry of a size x size board whose edges are packed into the bits of an integer.
+    Bit positions follow `Board.get_board_position`, so every node (i, j) owns two consecutive bits: the edge to
+    (i, j + 1) and the edge to (i + 1, j). Positions for edges that would leave the board are never set.
+    """
+
+    size: int
+    slots: int
+    edges: tuple
+    positions: tuple
+    edge_index: dict
+    edge_boxes: tuple
+    box_positions: tuple
+    box_edges: tuple
+    box_masks: tuple
+    full_mask: int
+
+
+def edge_position(size, first_coordinate, second_coordinate):
+    """
+    Bit position of the edge between two adjacent coordinates, given in any order.
+    """
+    if second_coordinate[0] < first_coordinate[0] or second_coordinate[1] < first_coordinate[1]:
+        first_coordinate, second_coordinate = second_coordinate, first_coordinate
+    _share_row = first_coordinate[1] + 1 == second_coordinate[1]
+    return 2 * (first_coordinate[0] * (size + 1) + first_coordinate[1]) + (0 if _share_row else 1)
+
+
+@functools.lru_cache(maxsize=None)
+def board_tables(size):
+    slots = 2 * (size + 1) * (size + 1)
+    edges = [None] * slots
+    edge_index = {}
+    for i in range(size + 1):
+        for j in range(size + 1):
+            for other in ((i, j + 1), (i + 1, j)):
+                if other[0] > size or other[1] > size:
+                    continue
+                position = edge_position(size, (i, j), other)
+                edges[position] = ((i, j), other)
+                edge_index[((i, j), other)] = position
+                edge_index[(other, (i, j))] = position
+
+    edge_boxes = [[] for _ in range(slots)]
+    box_positions = []
+    box_edges = []
+    box_masks = []
+    for i in range(size):
+        for j in range(size):
+            box = len(box_positions)
+            sides = [
+                edge_position(size, (i, j), (i, j + 1)),
+                edge_position(size, (i, j), (i + 1, j)),
+                edge_position(size, (i + 1, j), (i + 1, j + 1)),
+                edge_position(size, (i, j + 1), (i + 1, j + 1)),
+            ]
+            for position in sides:
+                edge_boxes[position].append(box)
+            box_positions.append((i, j))
+            box_edges.append(tuple(sides))
+            box_masks.append(sum(1 << p for p in sides))
+
+    positions = tuple(p for p, e in enumerate(edges) if e is not None)
+    return BoardTables(
+        size=size,
+        slots=slots,
+        edges=tuple(edges),
+        positions=positions,
+        edge_index=edge_index,
+        edge_boxes=tuple(map(tuple, edge_boxes)),
+        box_positions=tuple(box_positions),
+        box_edges=tuple(box_edges),
+        box_masks=tuple(box_masks),
+        full_mask=sum(1 << p for p in positions),
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def edge_columns(size):
+    """
+    Column of every bit position when only real edges get one, in position order, -1 for positions that are not
+    edges. Indexing it with positions gives columns, indexing `positions` with columns gives positions back.
+    """
+    tables = board_tables(size)
+    columns = np.full(tables.slots, -1, dtype=np.intp)
+    columns[list(tables.positions)] = np.arange(len(tables.positions))
+    columns.flags.writeable = False
+    return columns
+
+
+def mask_from_edges(size, edges):
+    """
+    Pack a list of edges into an integer mask.
+    """
+    edge_index = board_tables(size).edge_index
+    mask = 0
+    for edge in edges:
+        mask |= 1 << edge_index[edge]
+    return mask
+
+
+def state_mask(size, state):
+    """
+    Mask of a `DotsAndBoxesState.state`, either a collection of taken edges or already a mask.
+    """
+    return state if isinstance(state, int) else mask_from_edges(size, state)
+
+
+def edges_from_mask(size, mask):
+    """
+    Unpack an integer mask into the list of taken edges, ordered by bit position.
+    """
+    edges = board_tables(size).edges
+    return [edges[p] for p in board_tables(size).positions if mask >> p & 1]
+
+
+def closed_boxes(tables, mask, position):
+    """
+    Boxes closed by taking position on mask, tables being the `board_tables` of the board.
+    """
+    mask |= 1 << position
+    box_masks = tables.box_masks
+    return sum(1 for box in tables.edge_boxes[position] if mask & box_masks[box] == box_masks[box])
+
+
+def mask_array(size, mask):
+    """
+    Unpack an integer mask into a bool array indexed by bit position, `board_tables(size).slots` long.
+    """
+    slots = board_tables(size).slots
+    _bytes = np.frombuffer(mask.to_bytes(-(-slots // 8), "little"), dtype=np.uint8)
+    return np.unpackbits(_bytes, count=slots, bitorder="little").astype(bool)
+
+
+def free_positions(size, mask):
+    """
+    Bit positions of the edges not taken in mask.
+    """
+    return [p for p in board_tables(size).positions if not mask >> p & 1]
+
+
+def _reflect_coordinate(size, coordinate):
+    return size - coordinate[0], coordinate[1]
+
+
+def _rotate_coordinate(size, coordinate):
+    return size - coordinate[1], coordinate[0]
+
+
+@functools.lru_cache(maxsize=None)
+def symmetry_permutations(size):
+    """
+    Bit position permutations for the 8 symmetries of the board, in the order `Board.rotations` yields them:
+    identity, reflection, then each of the three rotations followed by its reflection.
+    """
+    tables = board_tables(size)
+
+    def permutation(transform):
+        _permutation = list(range(tables.slots))
+        for position in tables.positions:
+            u, v = tables.edges[position]
+            _permutation[position] = edge_position(size, transform(u), transform(v))
+        return tuple(_permutation)
+
+    def rotate(times):
+        def transform(coordinate):
+            for _ in range(times):
+                coordinate = _rotate_coordinate(size, coordinate)
+            return coordinate
+
+        return transform
+
+    permutations = []
+    for times in range(4):
+        _rotate = rotate(times)
+        permutations.append(permutation(_rotate))
+        permutations.append(permutation(lambda c, _rotate=_rotate: _reflect_coordinate(size, _rotate(c))))
+    return tuple(permutations)
+
+
+@functools.lru_cache(maxsize=None)
+def inverse_symmetry_permutations(size):
+    """
+    Inverses of `symmetry_permutations`: for every symmetry, the original position of each moved position.
+    """
+    inverses = []
+    for _permutation in symmetry_permutations(size):
+        _inverse = [0] * len(_permutation)
+        for position, moved in enumerate(_permutation):
+            _inverse[moved] = position
+        inverses.append(tuple(_inverse))
+    return tuple(inverses)
+
+
+@functools.lru_cache(maxsize=None)
+def symmetry_byte_tables(size):
+    """
+    For every symmetry and every byte of a mask, the 256 possible byte values already moved to their permuted bit
+    positions. Permuting a mask is then one lookup per byte.
+    """
+    slots = board_tables(size).slots
+    byte_tables = []
+    for _permutation in symmetry_permutations(size):
+        chunks = []
+        for chunk in range(0, slots, 8):
+            table = []
+            for value in range(256):
+                permuted = 0
+                for bit in range(8):
+                    if value >> bit & 1 and chunk + bit < slots:
+                        permuted |= 1 << _permutation[chunk + bit]
+                table.append(permuted)
+            chunks.append(tuple(table))
+        byte_tables.append(tuple(chunks))
+    return tuple(byte_tables)
+
+
+def permute_mask(chunks, mask):
+    """
+    Apply one symmetry, given as its entry of `symmetry_byte_tables`, to a mask.
+    """
+    permuted = 0
+    for table in chunks:
+        permuted |= table[mask & 255]
+        mask >>= 8
+    return permuted
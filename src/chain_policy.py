@@ -0,0 +1,243 @@
+import random
+from collections import deque
+from typing import NamedTuple
+
+from .bitboard import board_tables, state_mask
+from .dots_boxes import DotsAndBoxes, DotsAndBoxesPolicy
+
+
+class Chain(NamedTuple):
+    """
+    A maximal group of boxes with exactly 2 sides linked through their free edges. It is a loop when the boxes
+    close a cycle.
+    """
+
+    boxes: tuple
+    loop: bool
+
+
+class ChainAnalysis:
+    """
+    Incremental view of a board in strings-and-coins terms: safe edges (taking them gives no box a third side),
+    capturable boxes (3 sides) and chains/loops of 2-sided boxes.
+    Edges are only ever added, so safe edges and capturable boxes are updated in O(1) per box touched. Chains are
+    relabelled lazily, only for the boxes a new edge touched and the components they belonged to.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.tables = board_tables(size)
+        self.reset()
+
+    def reset(self):
+        self.mask = 0
+        self.box_sides = [0] * len(self.tables.box_positions)
+        self.safe = set(self.tables.positions)
+        self._capturable = deque()
+        self._component = [-1] * len(self.tables.box_positions)
+        self._members = {}
+        self._dirty = set()
+        self._next_component = 0
+
+    def sync(self, mask):
+        """
+        Bring the analysis to mask, adding only the new edges when mask extends the current board.
+        """
+        if mask & self.mask != self.mask:
+            self.reset()
+        new_edges = mask & ~self.mask
+        while new_edges:
+            _bit = new_edges & -new_edges
+            self.add_edge(_bit.bit_length() - 1)
+            new_edges ^= _bit
+
+    def add_edge(self, position):
+        self.mask |= 1 << position
+        self.safe.discard(position)
+        for box in self.tables.edge_boxes[position]:
+            self.box_sides[box] += 1
+            if self.box_sides[box] == 2:
+                # Any other free side would now give this box a third side
+                self.safe.difference_update(self.tables.box_edges[box])
+            elif self.box_sides[box] == 3:
+                self._capturable.append(box)
+            self._dirty.add(box)
+
+    def free_edges(self, box):
+        return [p for p in self.tables.box_edges[box] if not self.mask >> p & 1]
+
+    def neighbour(self, box, position):
+        """
+        The box on the other side of the edge at position, None if it is the border of the board.
+        """
+        for other in self.tables.edge_boxes[position]:
+            if other != box:
+                return other
+        return None
+
+    def capturable_box(self):
+        while self._capturable:
+            if self.box_sides[self._capturable[0]] == 3:
+                return self._capturable[0]
+            self._capturable.popleft()
+        return None
+
+    def capture_path(self, box):
+        """
+        Boxes that capturing from box will take one after the other, the edges that capture them and the box that
+        stops the run (None for the border of the board).
+        """
+        boxes = [box]
+        edges = self.free_edges(box)[:1]
+        end = self.neighbour(box, edges[0])
+        while end is not None and self.box_sides[end] == 2 and end not in boxes:
+            boxes.append(end)
+            edges.append(next(p for p in self.free_edges(end) if p != edges[-1]))
+            end = self.neighbour(end, edges[-1])
+        return boxes, edges, end
+
+    def chains(self):
+        self._flush()
+        chains = []
+        for boxes in self._members.values():
+            links = sum(
+                1
+                for box in boxes
+                for p in self.free_edges(box)
+                if (other := self.neighbour(box, p)) is not None and self._component[other] == self._component[box]
+            )
+            chains.append(Chain(tuple(boxes), links // 2 == len(boxes)))
+        return chains
+
+    def component_of(self, box):
+        self._flush()
+        return self._component[box]
+
+    def _flush(self):
+        seeds = set()
+        for box in self._dirty:
+            seeds.add(box)
+            seeds.update(self._members.pop(self._component[box], ()))
+        self._dirty.clear()
+        for box in seeds:
+            self._component[box] = -1
+
+        for box in seeds:
+            if self._component[box] >= 0 or self.box_sides[box] != 2:
+                continue
+            component = self._next_component
+            self._next_component += 1
+            members = []
+            self._component[box] = component
+            stack = [box]
+            while stack:
+                current = stack.pop()
+                members.append(current)
+                for p in self.free_edges(current):
+                    other = self.neighbour(current, p)
+                    if other is None or self.box_sides[other] != 2 or self._component[other] == component:
+                        continue
+                    # Reaching an untouched component means the two merged
+                    self._members.pop(self._component[other], None)
+                    self._component[other] = component
+                    stack.append(other)
+            self._members[component] = members
+
+
+class DotsAndBoxesChainPolicy(DotsAndBoxesPolicy):
+    """
+    Plays from a `ChainAnalysis` of the board:
+    - Captures every box it can, except that once no safe edges remain it declines the last 2 boxes of a chain (4 of
+      a loop) with a double-dealing move while another long chain or loop is left, to keep control.
+    - Otherwise plays a safe edge, preferring one that leaves an even number of safe edges so the opponent runs
+      out of them first (the long chain rule played on safe-move parity).
+    - Otherwise opens the smallest chain, playing the middle of a 2-chain so it cannot be double-dealt back.
+    """
+
+    def __init__(self, q_value_function=None):
+        super().__init__(q_value_function)
+        self._analysis = {}
+
+    def _board(self, state, action_space):
+        if self._attached(action_space) and self._env.engine == DotsAndBoxes.ENGINE_BITBOARD:
+            size, mask = self._env.size, self._env.edges
+        else:
+            size = self._board_size(state, action_space)
+            mask = state_mask(size, state.state)
+
+        if size not in self._analysis:
+            self._analysis[size] = ChainAnalysis(size)
+        analysis = self._analysis[size]
+        analysis.sync(mask)
+        return analysis
+
+    def next_action(self, state, action_space):
+        analysis = self._board(state, action_space)
+        edges = analysis.tables.edges
+
+        box = analysis.capturable_box()
+        if box is not None:
+            return edges[self._capture(analysis, box)]
+
+        if analysis.safe:
+            return edges[self._safe_move(analysis)]
+
+        return edges[self._handout(analysis)]
+
+    def _capture(self, analysis: ChainAnalysis, box):
+        boxes, path_edges, end = analysis.capture_path(box)
+        if analysis.safe or not self._keep_control(analysis, boxes, end):
+            return path_edges[0]
+
+        loop_end = end is not None and analysis.box_sides[end] == 3
+        if not loop_end and len(boxes) == 2:
+            # Leave both boxes as a domino: the opponent takes them and has to move again
+            return path_edges[1]
+        if loop_end and len(boxes) == 3:
+            # Last 4 boxes of a loop: split them into two dominoes
+            return path_edges[1]
+        return path_edges[0]
+
+    @staticmethod
+    def _keep_control(analysis: ChainAnalysis, boxes, end):
+        running = set(boxes)
+        if end is not None:
+            running.add(end)
+        return any(
+            chain.loop or len(chain.boxes) >= 3
+            for chain in analysis.chains()
+            if running.isdisjoint(chain.boxes)
+        )
+
+    @staticmethod
+    def _safe_move(analysis: ChainAnalysis):
+        even = []
+        for position in analysis.safe:
+            lost = {position}
+            for box in analysis.tables.edge_boxes[position]:
+                if analysis.box_sides[box] == 1:
+                    lost.update(p for p in analysis.tables.box_edges[box] if p in analysis.safe)
+            if (len(analysis.safe) - len(lost)) % 2 == 0:
+                even.append(position)
+        return random.choice(sorted(even or analysis.safe))
+
+    @staticmethod
+    def _handout(analysis: ChainAnalysis):
+        chains = sorted(analysis.chains(), key=lambda c: (len(c.boxes) + 2 * c.loop, c.boxes))
+        if not chains:
+            free = [p for p in analysis.tables.positions if not analysis.mask >> p & 1]
+            return min(free, key=lambda p: sum(analysis.box_sides[b] for b in analysis.tables.edge_boxes[p]))
+
+        chain = chains[0]
+        if len(chain.boxes) == 2 and not chain.loop:
+            first, second = chain.boxes
+            return (set(analysis.free_edges(first)) & set(analysis.free_edges(second))).pop()
+
+        # Open a chain at one of its ends, a loop anywhere
+        component = analysis.component_of(chain.boxes[0])
+        for box in chain.boxes:
+            for position in analysis.free_edges(box):
+                other = analysis.neighbour(box, position)
+                if chain.loop or other is None or analysis.component_of(other) != component:
+                    return position
+        return analysis.free_edges(chain.boxes[0])[0]
@@ -0,0 +1,228 @@
+import logging
+import os
+import re
+import threading
+import traceback
+
+from .learning_player import BoardSaver
+from .qtable_io import apply_qtable, read_qtable, sorted_states, write_qtable, write_states
+
+SNAPSHOT_FORK = "fork"
+SNAPSHOT_COPY = "copy"
+
+
+class CheckpointManager:
+    """
+    Writes `BoardSaver` checkpoints in the background as directory/prefix.NNNNNN.qtable, numbered on from the last
+    one found, and keeps only the last keep of them.
+    snapshot selects how the table is frozen while it is written. "fork" forks a child process that writes it and
+    exits: the child sees the table as it was at the fork, and pages are only copied when training writes them.
+    "copy" copies the table on the calling thread and writes the copy from a thread. Fork is used where available,
+    and only while the calling thread is the only one: the child would inherit the locks other threads hold, such
+    as a `MetricsRecorder` writer's, held forever, so saves fall back to copy while other threads are alive. Save
+    within `MetricsRecorder.paused` to fork while training records metrics.
+    Files are written through `write_qtable`, next to their path and renamed into place, so a checkpoint is either
+    complete or not there. Only one checkpoint is written at a time: save logs and skips the checkpoint while the
+    previous one is still being written, unless told to block. wait blocks until it is done and raises if it failed.
+    With compact_every > 0 a checkpoint is a base table followed by delta segments, prefix.NNNNNN.MMMMMM.delta,
+    holding the states written since the previous checkpoint, as `BoardSaver.take_changes` tracks them. A full
+    base is written first and again after compact_every deltas, or after a failed write, so checkpoint cost follows
+    the changes rather than the table. load replays the latest base and its deltas; latest is the base alone.
+    """
+
+    def __init__(self, directory, prefix="qtable", keep=3, snapshot=None, compact_every=0):
+        assert keep > 0, "keep at least one checkpoint"
+        if snapshot is None:
+            snapshot = SNAPSHOT_FORK if hasattr(os, "fork") else SNAPSHOT_COPY
+        assert snapshot in (SNAPSHOT_FORK, SNAPSHOT_COPY), "Unknown snapshot {}".format(snapshot)
+        self.directory = directory
+        self.prefix = prefix
+        self.keep = keep
+        self.snapshot = snapshot
+        self.compact_every = compact_every
+        self._pattern = re.compile(r"{}\.(\d+)\.qtable$".format(re.escape(prefix)))
+        self._delta_pattern = re.compile(r"{}\.(\d+)\.(\d+)\.delta$".format(re.escape(prefix)))
+        os.makedirs(directory, exist_ok=True)
+        numbers = [number for number, _ in self._checkpoints()]
+        self._next = max(numbers) + 1 if numbers else 0
+        # Base the next delta goes on and deltas written on it; the first save always writes a base
+        self._base = None
+        self._deltas = 0
+        self._pid = None
+        self._thread = None
+        self._error = None
+
+    def _checkpoints(self):
+        """
+        (number, path) of every complete checkpoint, oldest first.
+        """
+        checkpoints = []
+        for name in os.listdir(self.directory):
+            match = self._pattern.match(name)
+            if match:
+                checkpoints.append((int(match.group(1)), os.path.join(self.directory, name)))
+        return sorted(checkpoints)
+
+    def checkpoints(self):
+        return [path for _, path in self._checkpoints()]
+
+    def deltas(self, base):
+        """
+        Paths of the delta segments of base number, oldest first.
+        """
+        deltas = []
+        for name in os.listdir(self.directory):
+            match = self._delta_pattern.match(name)
+            if match and int(match.group(1)) == base:
+                deltas.append((int(match.group(2)), os.path.join(self.directory, name)))
+        return [path for _, path in sorted(deltas)]
+
+    def latest(self):
+        """
+        Path of the newest complete checkpoint, None if there is none.
+        """
+        checkpoints = self._checkpoints()
+        return checkpoints[-1][1] if checkpoints else None
+
+    def _write(self, saver, path):
+        write_qtable(path, saver)
+        self._prune()
+
+    def _prune(self):
+        kept = {number for number, _ in self._checkpoints()[-self.keep :]}
+        stale = [path for number, path in self._checkpoints() if number not in kept]
+        for name in os.listdir(self.directory):
+            match = self._delta_pattern.match(name)
+            if match and int(match.group(1)) not in kept:
+                stale.append(os.path.join(self.directory, name))
+        for _path in stale:
+            try:
+                os.remove(_path)
+            except OSError:
+                # Still open elsewhere on some platforms, it goes with the next checkpoint
+                pass
+
+    def _write_in_thread(self, write, *args):
+        try:
+            write(*args)
+        except Exception as error:
+            self._error = error
+
+    def busy(self):
+        """
+        Whether a checkpoint is being written.
+        """
+        if self._pid is not None:
+            pid, status = os.waitpid(self._pid, os.WNOHANG)
+            if pid == 0:
+                return True
+            self._reap(status)
+        if self._thread is not None:
+            if self._thread.is_alive():
+                return True
+            self._thread = None
+        return False
+
+    def _reap(self, status):
+        self._pid = None
+        if os.waitstatus_to_exitcode(status) != 0:
+            self._error = Exception("Checkpoint process failed with status {}".format(status))
+
+    def _fork(self, write, *args):
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                write(*args)
+                status = 0
+            except Exception:
+                traceback.print_exc()
+            finally:
+                os._exit(status)
+        self._pid = pid
+
+    def _start(self, write, *args):
+        self._thread = threading.Thread(target=self._write_in_thread, args=(write, *args), name="checkpoint-writer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _fork_snapshot(self):
+        return self.snapshot == SNAPSHOT_FORK and threading.active_count() == 1
+
+    def save(self, saver: BoardSaver, block=False, base=False):
+        """
+        Start writing a checkpoint of saver. Returns whether it was started: while the previous checkpoint is still
+        being written it is skipped, with a warning, or with block waited for first. With base it is a full base
+        even when a delta is due, so `latest` is saver once it is written.
+        """
+        if block:
+            self.wait()
+        elif self.busy():
+            logging.warning("Checkpoint still being written, skipping this one")
+            return False
+        self._raise_error()
+
+        fork = self._fork_snapshot()
+        if self.compact_every and not base and self._base is not None and self._deltas < self.compact_every:
+            self._deltas += 1
+            path = os.path.join(self.directory, "{}.{:06d}.{:06d}.delta".format(self.prefix, self._base, self._deltas))
+            keys = saver.take_changes()
+            if fork:
+                self._fork(write_qtable, path, saver, keys)
+            else:
+                self._start(write_states, path, saver.size, *sorted_states(saver, keys))
+            return True
+
+        if self.compact_every:
+            saver.track_changes()
+            self._base, self._deltas = self._next, 0
+        path = os.path.join(self.directory, "{}.{:06d}.qtable".format(self.prefix, self._next))
+        self._next += 1
+        if fork:
+            self._fork(self._write, saver, path)
+        else:
+            self._start(self._write, saver.copy(), path)
+        return True
+
+    def _raise_error(self):
+        if self._error is not None:
+            # The changes of a failed delta are lost, only a new base is complete again
+            self._base = None
+            error, self._error = self._error, None
+            raise error
+
+    def load(self, cache_size=2**16):
+        """
+        `BoardSaver` of the latest base with its deltas replayed, None if there is no checkpoint.
+        """
+        checkpoints = self._checkpoints()
+        if not checkpoints:
+            return None
+        number, path = checkpoints[-1]
+        saver = read_qtable(path, cache_size)
+        for _path in self.deltas(number):
+            apply_qtable(_path, saver)
+        return saver
+
+    def compact(self):
+        """
+        Merge the latest base and its deltas into a new base, written on the calling thread.
+        """
+        self.wait()
+        saver = self.load()
+        if saver is not None:
+            path = os.path.join(self.directory, "{}.{:06d}.qtable".format(self.prefix, self._next))
+            self._next += 1
+            self._base = None
+            self._write(saver, path)
+
+    def wait(self):
+        """
+        Block until the checkpoint being written, if any, is complete.
+        """
+        if self._pid is not None:
+            self._reap(os.waitpid(self._pid, 0)[1])
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._raise_error()
@@ -2,38 +2,64 @@ import pygame
 import gym
 import itertools
 import random
+import numpy as np
+from collections import deque
 from typing import NamedTuple
 
+from .bitboard import board_tables, mask_array
+from .profiling import DISABLED, PHASE_OPPONENT
+
 
 class DotsAndBoxesPolicy:
     def __init__(self, q_value_function):
         self._q_value_function = q_value_function
+        self._env = None
+
+    def attach(self, env):
+        """
+        Called by the `DotsAndBoxes` this policy plays in, so it can read the env incremental bookkeeping.
+        """
+        self._env = env
+
+    def _attached(self, action_space):
+        """
+        Whether action_space is the live action space of the attached env, so its bookkeeping describes the board.
+        """
+        return self._env is not None and self._env.action_spaces is action_space
+
+    def _board_size(self, state, action_space):
+        """
+        Size of the board state is on: the attached env's or the Q value function's, else read from the edges of an
+        edge-list state, as taken and free edges together always reach the last row and column.
+        """
+        if self._env is not None:
+            return self._env.size
+        if getattr(self._q_value_function, "size", None) is not None:
+            return self._q_value_function.size
+        assert not isinstance(state.state, int), "Board size of a mask state is unknown, attach the policy to its env"
+        return max(max(u + v) for u, v in itertools.chain(action_space, state.state))
 
     def next_action(self, state, action_space):
         raise NotImplementedError()
 
+    def next_actions(self, env, indexes):
+        """
+        Batched next_action for the boards indexes of a `VectorDotsAndBoxes`, returns an edge position per board.
+        Policies without a batched implementation fall back to calling next_action on each board.
+        """
+        actions = np.empty(len(indexes), dtype=np.intp)
+        for _ith, index in enumerate(indexes):
+            state, action_space = env.state(index)
+            actions[_ith] = env.tables.edge_index[tuple(self.next_action(state, action_space))]
+        return actions
+
 
-class DotsAndBoxesCloseBoxesPolicy(DotsAndBoxesPolicy):
+def _random_legal_actions(env, indexes):
     """
-    Closes a box if possible, if not, returns a random choice of action space
+    A uniformly random free edge position for each board indexes of a `VectorDotsAndBoxes`.
     """
-
-    def next_action(self, state, action_space):
-        max_width = max(map(lambda x: x[1][1], action_space))
-        max_height = max(map(lambda x: x[1][0], action_space))
-        for i in range(max_height):
-            for j in range(max_width):
-                borders = [
-                    ((i, j), (i, j + 1)),
-                    ((i, j), (i + 1, j)),
-                    ((i + 1, j), (i + 1, j + 1)),
-                    ((i, j + 1), (i + 1, j + 1)),
-                ]
-                # If there is a box with 3 sides closed, close the last one
-                if sum(1 for b in borders if b not in action_space) == 3:
-                    return next(b for b in borders if b in action_space)
-
-        return random.sample(sorted(action_space), 1)[0]
+    legal = env.legal_actions()[indexes]
+    return np.argmax(np.where(legal, env.rng.random(legal.shape), -1.0), axis=1)
 
 
 class DotsAndBoxesRandomPolicy(DotsAndBoxesPolicy):
@@ -43,6 +69,9 @@ class DotsAndBoxesRandomPolicy(DotsAndBoxesPolicy):
     def next_action(self, state, action_space):
         return random.sample(sorted(action_space), 1)[0]
 
+    def next_actions(self, env, indexes):
+        return _random_legal_actions(env, indexes)
+
 
 class DotsAndBoxesCloseBoxesPolicy(DotsAndBoxesPolicy):
     """
@@ -50,6 +79,10 @@ class DotsAndBoxesCloseBoxesPolicy(DotsAndBoxesPolicy):
     """
 
     def next_action(self, state, action_space):
+        if self._attached(action_space):
+            action = self._env.closing_move()
+            return action if action is not None else self._env.random_action()
+
         max_width = max(map(lambda x: x[1][1], action_space))
         max_height = max(map(lambda x: x[1][0], action_space))
         for i in range(max_height):
@@ -66,6 +99,17 @@ class DotsAndBoxesCloseBoxesPolicy(DotsAndBoxesPolicy):
 
         return random.sample(sorted(action_space), 1)[0]
 
+    def next_actions(self, env, indexes):
+        actions = _random_legal_actions(env, indexes)
+
+        # Boards with a box with 3 sides closed take the missing side of the first one
+        three_sided = env.box_sides[indexes] == 3
+        rows = np.flatnonzero(three_sided.any(axis=1))
+        sides = env.box_edges[np.argmax(three_sided[rows], axis=1)]
+        free = ~env.edges[indexes[rows][:, None], sides]
+        actions[rows] = sides[np.arange(len(rows)), np.argmax(free, axis=1)]
+        return actions
+
 
 class DotsAndBoxesMaxIfKnownPolicy(DotsAndBoxesPolicy):
     """
@@ -74,7 +118,7 @@ class DotsAndBoxesMaxIfKnownPolicy(DotsAndBoxesPolicy):
     """
     def next_action(self, state, action_space):
         if self._q_value_function.contains(state):
-            action = max(action_space, key=lambda a: self._q_value_function.get(state, a))
+            action = self._q_value_function.argmax(state, action_space)
         else:
             action = random.sample(sorted(action_space), 1)[0]
         return action
@@ -88,10 +132,14 @@ class DotsAndBoxesMixerPolicy(DotsAndBoxesPolicy):
         super().__init__(q_value_function)
         self._greedy = DotsAndBoxesCloseBoxesPolicy(q_value_function=q_value_function)
 
+    def attach(self, env):
+        super().attach(env)
+        self._greedy.attach(env)
+
     def next_action(self, state, action_space):
         
         if self._q_value_function.contains(state):
-            action = max(action_space, key=lambda a: self._q_value_function.get(state, a))
+            action = self._q_value_function.argmax(state, action_space)
         else:
             action = self._greedy.next_action(state, action_space)
         return action
@@ -104,7 +152,8 @@ class DotsAndBoxesState(NamedTuple):
     player_points: int
 
     def __hash__(self):
-        return hash(tuple(self.state) + tuple(self.player_points))
+        _state = self.state if isinstance(self.state, int) else tuple(self.state)
+        return hash((_state, self.player_points))
 
     def __eq__(self, other):
         return self.state == other.state and self.player_points == other.player_points
@@ -119,26 +168,29 @@ class DotsAndBoxes(gym.Env):
         A Box is the object you want to capture more of to win the game. It has four corners (Nodes) and four sides
         which connect the Nodes.
         Whenever the four sides of the box are filled its "control" is handed to the last player to introduce a new
-        side.
+        side, and on_close is called with the box and that player.
         """
 
-        def __init__(self, position, corners):
+        def __init__(self, position, corners, on_close=None):
             assert len(corners) == 4, "Each box has 4 corners"
             self.position = position
             self.corners = corners
             self.sides = set()
             self.controller = 0
+            self.on_close = on_close
             for c in corners:
                 c.corner_to(self)
 
         def new_side(self, u, v, player):
-            if u.index > v.index:
-                self.sides.add((u, v))
-            else:
-                self.sides.add((v, u))
+            side = (u, v) if u.index > v.index else (v, u)
+            if side in self.sides:
+                return
+            self.sides.add(side)
 
             if len(self.sides) == 4:
                 self.controller = player
+                if self.on_close is not None:
+                    self.on_close(self, player)
 
         def get_controller(self):
             return self.controller
@@ -174,15 +226,76 @@ class DotsAndBoxes(gym.Env):
 
     metadata = {"render.modes": ["human", "rgb_array"], "video.frames_per_second": 50}
 
-    def __init__(self, size=3, policy: DotsAndBoxesPolicy | None = None):
+    ENGINE_GRAPH = "graph"
+    ENGINE_BITBOARD = "bitboard"
+
+    OBSERVATION_EDGES = "edges"
+    OBSERVATION_MASK = "mask"
+
+    ACTIONS_EDGES = "edges"
+    ACTIONS_INDEX = "index"
+
+    def __init__(
+        self,
+        size=3,
+        policy: DotsAndBoxesPolicy | None = None,
+        engine: str = ENGINE_GRAPH,
+        observation: str = OBSERVATION_EDGES,
+        actions: str = ACTIONS_EDGES,
+    ):
+        """
+        engine selects the board representation. "graph" builds Node and Box objects, "bitboard" keeps the taken
+        edges as the bits of an integer plus a side counter per box, using the tables from `board_tables`.
+        observation selects the state of `DotsAndBoxesState`: "edges" a list of taken edges, "mask" the taken edges
+        as an integer laid out as `Board.__hash__`, which `BoardSaver` takes as is.
+        actions selects what step takes: "edges" a pair of node positions, "index" an edge position of the
+        `action_space`, a `gym.spaces.Discrete` in `Board.get_board_position` order. Positions that are no edge are
+        never legal. In "index" mode step also returns the free positions in info, as an integer "legal_mask" and
+        as a gym style "action_mask" array, and reset returns (observation, info) with the same two entries.
+        """
+        assert engine in (self.ENGINE_GRAPH, self.ENGINE_BITBOARD), "Unknown engine {}".format(engine)
+        assert observation in (self.OBSERVATION_EDGES, self.OBSERVATION_MASK), "Unknown observation {}".format(
+            observation
+        )
+        assert actions in (self.ACTIONS_EDGES, self.ACTIONS_INDEX), "Unknown actions {}".format(actions)
 
         self.n = (size + 1) * (size + 1)
         self.size = size
+        self.engine = engine
+        self.observation = observation
+        self.actions = actions
         self.nodes = []
         self.boxes = []
         self.done = False
         self.action_spaces = set()
         self.policy = policy
+        # Opponent moves are charged to the "opponent" phase of profiler, see `PhaseProfiler`
+        self.profiler = DISABLED
+
+        # Free edges in a list for O(1) random picks, and boxes that got a third side, oldest first. Entries are
+        # dropped lazily once the box is closed.
+        self.free_actions = []
+        self._free_index = {}
+        self.three_sided = deque()
+
+        # Taken edges as mask bits, kept by both engines
+        self._tables = board_tables(size)
+        self.edges = 0
+        self.action_space = gym.spaces.Discrete(self._tables.slots)
+        # Free positions as an int8 array kept up to date move by move, "index" actions mode only
+        self._action_mask = np.zeros(self._tables.slots, dtype=np.int8) if actions == self.ACTIONS_INDEX else None
+
+        # Bitboard engine state
+        self._no_boxes = bytes(size * size)
+        self.box_sides = bytearray(size * size)
+        self.box_owner = bytearray(size * size)
+
+        # Boxes captured by each player, indexed by player number, and (player, box position) per captured box
+        self.points = [0, 0, 0]
+        self.completed_boxes = []
+
+        if policy is not None:
+            policy.attach(self)
         self.reset()
 
         # Rendering variables
@@ -204,7 +317,7 @@ class DotsAndBoxes(gym.Env):
 
         Args:
             action: A tuple of positions. A position is a tuple indicating the node by position, (x, y) indicating
-            the nodes to connect
+            the nodes to connect. An edge position instead in "index" actions mode
         Returns:
             observation (object): Agent's observation of the current environment.
             reward (float) : amount of reward returned after previous action
@@ -214,7 +327,12 @@ class DotsAndBoxes(gym.Env):
         player_1_old_points = self._player_points(1)
         player_2_old_points = self._player_points(2)
 
-        if not self._player_pick(1, action):
+        if self.actions == self.ACTIONS_INDEX:
+            assert 0 <= action < self._tables.slots and self._tables.edges[action] is not None, "Not an edge position"
+            closed = self._position_pick(1, action)
+        else:
+            closed = self._player_pick(1, action)
+        if not closed:
             self._player2()
 
         player_1_points = self._player_points(1)
@@ -244,50 +362,155 @@ class DotsAndBoxes(gym.Env):
             "reward": reward,
             "done": self.done,
         }
+        if self.actions == self.ACTIONS_INDEX:
+            self._add_legal_actions(info)
 
         return self._get_current_observation(), info
 
+    def _add_legal_actions(self, info):
+        info["legal_mask"] = self.legal_mask()
+        info["action_mask"] = np.zeros_like(self._action_mask) if self.done else self._action_mask.copy()
+
     def _player2(self):
         new_point = True
         while new_point and len(self.action_spaces) > 0:
             state = self._get_current_observation()
+            _phase = self.profiler.enter(PHASE_OPPONENT)
             action = self.policy.next_action(state, self.action_spaces)
+            self.profiler.resume(_phase)
             new_point = self._player_pick(2, action)
 
     def _player_pick(self, player, action):
-        old_player_points = self._player_points(player)
-        assert not self.done
         pos_i = action[0]
         pos_j = action[1]
 
         assert abs(pos_i[0] - pos_j[0]) + abs(pos_i[1] - pos_j[1]) == 1, "Nodes are not adjacent"
 
+        return self._position_pick(player, self._tables.edge_index[(pos_i, pos_j)])
+
+    def _position_pick(self, player, position):
+        """
+        Takes the edge at bit position and returns whether it closed at least one box.
+        """
+        assert not self.done
+        if self.engine == self.ENGINE_BITBOARD:
+            return self._bitboard_pick(player, position)
+
+        pos_i, pos_j = self._tables.edges[position]
+        old_player_points = self.points[player]
         node_i = self.nodes[pos_i[0]][pos_i[1]]
         node_j = self.nodes[pos_j[0]][pos_j[1]]
 
         assert not node_i.is_connected(node_j), "The edge already exists"
 
         node_i.connect_to(node_j, player)
-        if node_j.index > node_i.index:
-            self.action_spaces.remove((node_i.position, node_j.position))
-        else:
-            self.action_spaces.remove((node_j.position, node_i.position))
+        self.edges |= 1 << position
+        self._remove_action(position)
+        for box in self._tables.edge_boxes[position]:
+            if self._box_side_count(box) == 3:
+                self.three_sided.append(box)
+
+        return old_player_points < self.points[player]
+
+    def _remove_action(self, position):
+        action = self._tables.edges[position]
+        self.action_spaces.remove(action)
+        if self._action_mask is not None:
+            self._action_mask[position] = 0
+
+        _last = self.free_actions.pop()
+        if _last != action:
+            _index = self._free_index[action]
+            self.free_actions[_index] = _last
+            self._free_index[_last] = _index
+        del self._free_index[action]
+
+    def _box_side_count(self, box):
+        if self.engine == self.ENGINE_BITBOARD:
+            return self.box_sides[box]
+        i, j = self._tables.box_positions[box]
+        return len(self.boxes[i][j].sides)
+
+    def closing_move(self):
+        """
+        An action that closes a box with 3 sides, or None if there is no such box. Amortized O(1).
+        """
+        while self.three_sided:
+            box = self.three_sided[0]
+            if self._box_side_count(box) == 3:
+                edges = self._tables.edges
+                return next(edges[p] for p in self._tables.box_edges[box] if edges[p] in self.action_spaces)
+            self.three_sided.popleft()
+        return None
+
+    def random_action(self):
+        """
+        A uniformly random free action, without sorting the action space.
+        """
+        return self.free_actions[random.randrange(len(self.free_actions))]
 
-        new_player_points = self._player_points(player)
-        return old_player_points < new_player_points
+    def _bitboard_pick(self, player, position):
+        """
+        Takes the edge at bit position and returns whether it closed at least one box.
+        """
+        bit = 1 << position
+        assert not self.edges & bit, "The edge already exists"
+
+        self.edges |= bit
+        self._remove_action(position)
+
+        closed = False
+        for box in self._tables.edge_boxes[position]:
+            self.box_sides[box] += 1
+            if self.box_sides[box] == 3:
+                self.three_sided.append(box)
+            elif self.box_sides[box] == 4:
+                self.box_owner[box] = player
+                self.points[player] += 1
+                self.completed_boxes.append((player, self._tables.box_positions[box]))
+                closed = True
+        return closed
+
+    def _box_closed(self, box, player):
+        self.points[player] += 1
+        self.completed_boxes.append((player, box.position))
 
     def _player_points(self, player):
-        return len([1 for b in itertools.chain.from_iterable(self.boxes) if b.get_controller() == player])
+        return self.points[player]
+
+    def _taken_edges(self):
+        if self.engine == self.ENGINE_BITBOARD:
+            edges = self._tables.edges
+            return [edges[p] for p in self._tables.positions if self.edges >> p & 1]
 
-    def _get_current_observation(self):
         def get_edges(u):
             return ((u.position, v.position) for v in u.connected_nodes if v.index > u.index)
 
+        return list(itertools.chain.from_iterable(map(get_edges, itertools.chain.from_iterable(self.nodes))))
+
+    def _box_controllers(self):
+        if self.engine == self.ENGINE_BITBOARD:
+            return zip(self._tables.box_positions, self.box_owner)
+        return ((b.position, b.get_controller()) for b in itertools.chain.from_iterable(self.boxes))
+
+    def _get_current_observation(self):
         return DotsAndBoxesState(
-            state=list(itertools.chain.from_iterable(map(get_edges, itertools.chain.from_iterable(self.nodes)))),
+            state=self.edges if self.observation == self.OBSERVATION_MASK else self._taken_edges(),
             player_points=self._player_points(1),
         )
 
+    def legal_mask(self):
+        """
+        Free edges as mask bits, the legal actions in "index" actions mode.
+        """
+        return 0 if self.done else self._tables.full_mask & ~self.edges
+
+    def edge_array(self):
+        """
+        Taken edges as a NumPy bool array indexed by edge position.
+        """
+        return mask_array(self.size, self.edges)
+
     def render(self, mode="human"):
 
         # PyGame screen
@@ -309,24 +532,53 @@ class DotsAndBoxes(gym.Env):
         self.screen.fill(BLACK)
 
 
-        for node in itertools.chain.from_iterable(self.nodes):
-            n_s_pos = self._get_node_screen_position(node.position)
-            for other_node in node.connected_nodes:
-                if other_node.index < node.index:
-                    pass
-                on_s_pos = self._get_node_screen_position(other_node.position)
-                pygame.draw.line(self.screen, GREEN, n_s_pos, on_s_pos, width=1)
+        for edge in self._taken_edges():
+            u_s_pos = self._get_node_screen_position(edge[0])
+            v_s_pos = self._get_node_screen_position(edge[1])
+            pygame.draw.line(self.screen, GREEN, u_s_pos, v_s_pos, width=1)
 
+        for position in itertools.product(range(self.size + 1), repeat=2):
+            n_s_pos = self._get_node_screen_position(position)
             pygame.draw.circle(self.screen, RED, n_s_pos, 5, width=5)
-            text = self.font.render("({},{})".format(node.position[0], node.position[1]), True, WHITE, BLACK)
+            text = self.font.render("({},{})".format(position[0], position[1]), True, WHITE, BLACK)
             self.screen.blit(text, (n_s_pos[0] - 16, n_s_pos[1] + 10))
 
-        for box in itertools.chain.from_iterable(self.boxes):
-            text = self.font.render(str(box.get_controller()), True, WHITE, BLACK)
-            self.screen.blit(text, self._get_box_screen_position(box.position))
+        for position, controller in self._box_controllers():
+            text = self.font.render(str(controller), True, WHITE, BLACK)
+            self.screen.blit(text, self._get_box_screen_position(position))
         pygame.display.update()
 
     def reset(self):
+        self.done = False
+        self.points[1] = self.points[2] = 0
+        self.completed_boxes = []
+        self.three_sided.clear()
+        self.edges = 0
+        if self.engine == self.ENGINE_BITBOARD:
+            self._reset_bitboard()
+        else:
+            self._reset_graph()
+
+        self.free_actions = [self._tables.edges[p] for p in self._tables.positions]
+        self._free_index = {action: _index for _index, action in enumerate(self.free_actions)}
+        if self._action_mask is not None:
+            self._action_mask[list(self._tables.positions)] = 1
+
+        if random.choice([True, False]):
+            self._player2()
+
+        if self.actions == self.ACTIONS_INDEX:
+            info = {}
+            self._add_legal_actions(info)
+            return self._get_current_observation(), info
+        return self._get_current_observation()
+
+    def _reset_bitboard(self):
+        self.box_sides[:] = self._no_boxes
+        self.box_owner[:] = self._no_boxes
+        self.action_spaces = set(self._tables.edges[p] for p in self._tables.positions)
+
+    def _reset_graph(self):
         self.nodes = [
             [DotsAndBoxes.Node((i, j), i + j * self.size) for j in range(self.size + 1)] for i in range(self.size + 1)
         ]
@@ -338,9 +590,8 @@ class DotsAndBoxes(gym.Env):
                 corners.add(self.nodes[i][j + 1])
                 corners.add(self.nodes[i + 1][j])
                 corners.add(self.nodes[i + 1][j + 1])
-                self.boxes[i][j] = DotsAndBoxes.Box((i, j), corners)
+                self.boxes[i][j] = DotsAndBoxes.Box((i, j), corners, on_close=self._box_closed)
 
-        self.done = False
         self.action_spaces = set()
         for u in itertools.chain.from_iterable(self.nodes):
             if u.position[1] < self.size:
@@ -348,11 +599,6 @@ class DotsAndBoxes(gym.Env):
             if u.position[0] < self.size:
                 self.action_spaces.add((u.position, (u.position[0] + 1, u.position[1])))
 
-        if random.choice([True, False]):
-            self._player2()
-
-        return self._get_current_observation()
-
     def _get_box_screen_position(self, pos):
         corner_position = self._get_node_screen_position(pos)
         box_position = (corner_position[0] + self.box_step // 2, corner_position[1] + self.box_step // 2)
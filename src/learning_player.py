@@ -1,6 +1,18 @@
 import bitstring as bitstring
 import itertools
-
+import numpy as np
+from collections import OrderedDict
+from typing import NamedTuple
+
+from .bitboard import (
+    board_tables,
+    edge_columns,
+    free_positions,
+    permute_mask,
+    state_mask,
+    symmetry_byte_tables,
+    symmetry_permutations,
+)
 from .dots_boxes import DotsAndBoxesState
 
 
@@ -215,41 +227,355 @@ class Action:
         return
 
 
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+class Canonicalizer:
+    """
+    Maps an edge mask, laid out as `Board.__hash__`, to the smallest mask among its 8 symmetric boards.
+    Ties are broken in favour of the first symmetry in `Board.rotations` order, as `min` over the boards does.
+    The last cache_size results are kept in an LRU cache; a cache_size of 0 disables it.
+    """
+
+    def __init__(self, size, cache_size=2**16):
+        self.size = size
+        self.cache_size = cache_size
+        self._byte_tables = symmetry_byte_tables(size)
+        self._permutations = symmetry_permutations(size)
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self):
+        # Tables and cache are rebuilt on load, they are not worth pickling
+        return {"size": self.size, "cache_size": self.cache_size}
+
+    def __setstate__(self, state):
+        self.__init__(state["size"], state["cache_size"])
+
+    def cache_info(self):
+        return CacheInfo(self.hits, self.misses, self.cache_size, len(self._cache))
+
+    def canonical(self, mask):
+        """
+        Return the canonical mask and the index of the symmetry that produces it.
+        """
+        _cached = self._cache.get(mask)
+        if _cached is not None:
+            self.hits += 1
+            self._cache.move_to_end(mask)
+            return _cached
+
+        self.misses += 1
+        _cached = self._canonical(mask)
+        if self.cache_size:
+            self._cache[mask] = _cached
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return _cached
+
+    def _canonical(self, mask):
+        _canonical, _symmetry = mask, 0
+        for _ith, _chunks in enumerate(self._byte_tables):
+            _permuted = permute_mask(_chunks, mask)
+            if _permuted < _canonical:
+                _canonical, _symmetry = _permuted, _ith
+        return _canonical, _symmetry
+
+    def transform_position(self, symmetry, position):
+        """
+        Bit position an edge moves to under symmetry.
+        """
+        return self._permutations[symmetry][position]
+
+    def permutation(self, symmetry):
+        """
+        Bit position permutation of symmetry, indexed by the original position.
+        """
+        return self._permutations[symmetry]
+
+
+# Storage keys pack a state as board << POINTS_BITS | player points, points as wide as Q-table files store them
+POINTS_BITS = 16
+POINTS_MASK = (1 << POINTS_BITS) - 1
+
+
+def state_key(board, player_points):
+    return board << POINTS_BITS | player_points
+
+
+def split_state_key(key):
+    """
+    Board and player points of a `state_key`.
+    """
+    return key >> POINTS_BITS, key & POINTS_MASK
+
+
+class _ChangeTracking:
+    """
+    Keys (`state_key`) of the states written since the last take_changes, once track_changes is called; changes is
+    None while not tracking, so writes only pay for one attribute check.
+    """
+
+    changes = None
+
+    def track_changes(self):
+        self.changes = set()
+
+    def take_changes(self):
+        changes, self.changes = self.changes, set()
+        return changes
+
+
+class DictStorage(_ChangeTracking, dict):
+    """
+    Q values as nested dicts: canonical board -> player points -> action position -> value. len counts (board,
+    player points) states, as for every storage, not boards.
+    """
+
+    _states = 0
+
+    def __len__(self):
+        return self._states
+
+    def contains(self, board, player_points):
+        return board in self and player_points in self[board]
+
+    def value(self, board, player_points, action):
+        return self[board][player_points][action]
+
+    def action_values(self, board, player_points, actions):
+        _values = self[board][player_points]
+        return np.array([_values[a] for a in actions], dtype=np.float64)
+
+    def set_value(self, board, player_points, action, value):
+        if self.changes is not None:
+            self.changes.add(state_key(board, player_points))
+        if board not in self:
+            self[board] = {}
+
+        if player_points not in self[board]:
+            self[board][player_points] = {}
+            self._states += 1
+
+        self[board][player_points][action] = value
+
+    def set_action_values(self, board, player_points, actions, values):
+        for _action, _value in zip(actions, values):
+            self.set_value(board, player_points, int(_action), float(_value))
+
+    def items_by_state(self):
+        """
+        Yield (board, player points, {action: value}) for every stored state.
+        """
+        for _board, _by_points in self.items():
+            for _player_points, _values in _by_points.items():
+                yield _board, _player_points, _values
+
+    def copy(self):
+        storage = DictStorage()
+        for _board, _by_points in self.items():
+            storage[_board] = {p: dict(v) for p, v in _by_points.items()}
+        storage._states = self._states
+        return storage
+
+
+class DenseStorage(_ChangeTracking):
+    """
+    Q values as rows of a growable NumPy matrix with one column per edge of a size board, in bit position order;
+    actions are bit positions, mapped to their column through `edge_columns`. Each (board, player points) pair owns
+    a row, found by its `state_key`; values never defined are NaN.
+    """
+
+    def __init__(self, size, dtype=np.float64, capacity=1024):
+        self.size = size
+        self._columns = edge_columns(size)
+        self.positions = np.array(board_tables(size).positions, dtype=np.intp)
+        self.columns = len(self.positions)
+        self.rows = {}
+        self.values = np.full((capacity, self.columns), np.nan, dtype=dtype)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getstate__(self):
+        return {"size": self.size, "rows": self.rows, "values": self.values[: len(self.rows)]}
+
+    def __setstate__(self, state):
+        self.__init__(state["size"], state["values"].dtype, capacity=0)
+        self.rows = state["rows"]
+        self.values = state["values"]
+
+    def _new_row(self, key):
+        _row = len(self.rows)
+        if _row == len(self.values):
+            _grown = np.full((max(2 * len(self.values), 1024), self.columns), np.nan, dtype=self.values.dtype)
+            _grown[:_row] = self.values[:_row]
+            self.values = _grown
+        self.rows[key] = _row
+        return _row
+
+    def contains(self, board, player_points):
+        return state_key(board, player_points) in self.rows
+
+    def value(self, board, player_points, action):
+        _value = self.values[self.rows[state_key(board, player_points)], self._columns[action]]
+        if np.isnan(_value):
+            raise KeyError(action)
+        return float(_value)
+
+    def action_values(self, board, player_points, actions):
+        _values = self.values[self.rows[state_key(board, player_points)], self._columns[actions]]
+        if np.isnan(_values).any():
+            raise KeyError(actions[int(np.flatnonzero(np.isnan(_values))[0])])
+        return _values.astype(np.float64)
+
+    def set_value(self, board, player_points, action, value):
+        _key = state_key(board, player_points)
+        if self.changes is not None:
+            self.changes.add(_key)
+        _row = self.rows.get(_key)
+        if _row is None:
+            _row = self._new_row(_key)
+        self.values[_row, self._columns[action]] = value
+
+    def set_action_values(self, board, player_points, actions, values):
+        _key = state_key(board, player_points)
+        if self.changes is not None:
+            self.changes.add(_key)
+        _row = self.rows.get(_key)
+        if _row is None:
+            _row = self._new_row(_key)
+        self.values[_row, self._columns[actions]] = values
+
+    def set_row(self, board, player_points, values):
+        """
+        Overwrite every value of a state with values, one per edge column, NaN where undefined.
+        """
+        _key = state_key(board, player_points)
+        if self.changes is not None:
+            self.changes.add(_key)
+        _row = self.rows.get(_key)
+        if _row is None:
+            _row = self._new_row(_key)
+        self.values[_row] = values
+
+    def items_by_state(self):
+        """
+        Yield (board, player points, {action: value}) for every stored state.
+        """
+        for _key, _row in self.rows.items():
+            _defined = np.flatnonzero(~np.isnan(self.values[_row]))
+            _values = {int(p): float(v) for p, v in zip(self.positions[_defined], self.values[_row, _defined])}
+            _board, _player_points = split_state_key(_key)
+            yield _board, _player_points, _values
+
+    def copy(self):
+        storage = DenseStorage(self.size, self.values.dtype, capacity=0)
+        storage.rows = dict(self.rows)
+        storage.values = self.values[: len(self.rows)].copy()
+        return storage
+
+
 class BoardSaver:
+    """
+    Q value function over canonical boards. Boards and actions are stored as ints: the canonical edge mask and the
+    bit position of the action once moved by the same symmetry.
+    storage selects where values live: "dict" keeps nested dicts, "dense" a NumPy matrix with a row per state.
+    """
 
-    def __init__(self, size):
+    STORAGE_DICT = "dict"
+    STORAGE_DENSE = "dense"
+
+    def __init__(self, size, cache_size=2**16, storage=STORAGE_DICT):
+        assert storage in (self.STORAGE_DICT, self.STORAGE_DENSE), "Unknown storage {}".format(storage)
         self.size = size
-        self.boards = {}
-        self.rotator = Rotator(self.size)
+        self.storage = storage
+        self.boards = DenseStorage(size) if storage == self.STORAGE_DENSE else DictStorage()
+        self.canonicalizer = Canonicalizer(self.size, cache_size)
+
+    def cache_info(self):
+        """
+        Hits and misses of the canonicalization cache.
+        """
+        return self.canonicalizer.cache_info()
+
+    def _state_mask(self, state):
+        return state_mask(self.size, state)
 
     def _equivalent_board(self, state):
-        _board = Board(self.rotator, self.size, state)
-        return min(_board.rotations(), key=lambda x: x.__hash__())
+        return self.canonicalizer.canonical(self._state_mask(state))[0]
 
     def _equivalent_board_action(self, state, action):
-        _board = Board(self.rotator, self.size, state)
-        _action = Action(self.rotator, action)
-        return min(zip(_board.rotations(), _action.rotations()), key=lambda x: x[0].__hash__())
+        _board, _symmetry = self.canonicalizer.canonical(self._state_mask(state))
+        _action = board_tables(self.size).edge_index[action]
+        return _board, self.canonicalizer.transform_position(_symmetry, _action)
+
+    def canonical(self, state: DotsAndBoxesState):
+        """
+        Return the canonical board of a state and the index of the symmetry that produces it.
+        """
+        return self.canonicalizer.canonical(self._state_mask(state.state))
+
+    def canonical_action(self, symmetry, action):
+        """
+        Bit position of action once moved by symmetry, as stored in boards.
+        """
+        return self.canonicalizer.transform_position(symmetry, board_tables(self.size).edge_index[action])
+
+    def _equivalent_board_actions(self, state, actions):
+        _board, _symmetry = self.canonicalizer.canonical(self._state_mask(state))
+        _permutation = self.canonicalizer.permutation(_symmetry)
+        _edge_index = board_tables(self.size).edge_index
+        return _board, [_permutation[_edge_index[a]] for a in actions]
 
     def copy(self):
-        saver = BoardSaver(self.size)
-        saver.boards = dict(self.boards)
+        saver = BoardSaver(self.size, self.canonicalizer.cache_size)
+        saver.storage = self.storage
+        saver.boards = self.boards.copy()
         return saver
 
     def contains(self, state: DotsAndBoxesState):
         """
         Return whether any equivalent board is contained.
         """
-        _board = self._equivalent_board(state.state)
-        if _board not in self.boards:
-            return False
-
-        return state.player_points in self.boards[_board]
+        return self.boards.contains(self._equivalent_board(state.state), state.player_points)
 
     def get(self, state: DotsAndBoxesState, action):
         _board, _action = self._equivalent_board_action(state.state, action)
 
-        return self.boards[_board][state.player_points][_action]
+        return self.boards.value(_board, state.player_points, _action)
+
+    def get_all(self, state: DotsAndBoxesState, actions):
+        """
+        Values of every action in actions, in the same order, canonicalizing the board only once.
+        """
+        _board, _actions = self._equivalent_board_actions(state.state, actions)
+
+        return self.boards.action_values(_board, state.player_points, _actions)
+
+    def argmax(self, state: DotsAndBoxesState, actions):
+        """
+        The first action of actions with the maximum value, as `max(actions, key=lambda a: self.get(state, a))`.
+        """
+        actions = list(actions)
+        return actions[int(np.argmax(self.get_all(state, actions)))]
+
+    def track_changes(self):
+        """
+        Start recording which canonical states are written, for `take_changes`.
+        """
+        self.boards.track_changes()
+
+    def take_changes(self):
+        """
+        `state_key` of the canonical states written since the previous call or track_changes.
+        """
+        return self.boards.take_changes()
 
     def define(self, state: DotsAndBoxesState, action, value):
         """
@@ -261,14 +587,18 @@ class BoardSaver:
         value
         """
         _board, _action = self._equivalent_board_action(state.state, action)
-        if _board not in self.boards:
-            self.boards[_board] = {}
+        self.boards.set_value(_board, state.player_points, _action, value)
+        return
 
-        if state.player_points not in self.boards[_board]:
-            self.boards[_board][state.player_points] = {}
 
-        self.boards[_board][state.player_points][_action] = value
-        return
+
+def define_unknown(Q: BoardSaver, board, player_points, init_value):
+    """
+    Define every free edge of the canonical board with init_value, unless the state is already stored.
+    """
+    if not Q.boards.contains(board, player_points):
+        for position in free_positions(Q.size, board):
+            Q.boards.set_value(board, player_points, position, init_value)
 
 
 # example
@@ -1,13 +1,27 @@
 import sys
+import contextlib
 import logging
 import numpy as np
 import random
-import pickle
 import os.path
-from collections import defaultdict
 
-from learning_player import BoardSaver
-from dots_boxes import (
+from .checkpoint import CheckpointManager
+from .learning_player import BoardSaver
+from .metrics import EpisodeMetrics, LoggingSink, MetricsRecorder, episode_outcome
+from .parallel_training import parallel_q_learning
+from .qtable_io import convert_pickle, open_mapped_qtable, read_qtable, write_qtable
+from .profiling import (
+    DISABLED,
+    PHASE_CANONICALIZE,
+    PHASE_ENV_STEP,
+    PHASE_OTHER,
+    PHASE_PERSISTENCE,
+    PHASE_Q_LOOKUP,
+    PHASE_Q_UPDATE,
+    PhaseProfiler,
+)
+from .replay_buffer import ReplayBuffer, Transition
+from .dots_boxes import (
     DotsAndBoxes,
     DotsAndBoxesMaxIfKnownPolicy,
     DotsAndBoxesRandomPolicy,
@@ -24,7 +38,7 @@ def epsilon_greedy(Q, board: DotsAndBoxesState | None, action_spaces, epsilon):
     if board is None:
         return None
 
-    max_action = max(action_spaces, key=lambda a: Q.get(board, a))
+    max_action = Q.argmax(board, action_spaces)
     probs = list(
         map(
             lambda x: 1 - epsilon + epsilon / len(action_spaces) if max_action == x else epsilon / len(action_spaces),
@@ -43,72 +57,143 @@ def q_learning(
     eps_decay: float = 0.9999,
     epsmin: float = 0.01,
     Q: BoardSaver = None,
+    replay: ReplayBuffer = None,
+    batch_size: int = 32,
+    profiler: PhaseProfiler = None,
+    metrics: MetricsRecorder = None,
+    checkpoints: CheckpointManager = None,
 ):
+    """
+    Tabular Q-learning against env. With a replay buffer, transitions are stored in canonical form and every step
+    applies a sampled minibatch of batch_size transitions instead of the transition just played.
+    With a profiler, time is split into env stepping, opponent moves, canonicalization, Q lookups, Q updates and
+    persistence, and every 100 episodes the window is logged as a structured record and kept in profiler.windows.
+    With a metrics recorder, the `EpisodeMetrics` of every episode is recorded; it is flushed, not closed, at the end.
+    Progress is then reported through it, a `LoggingSink` logs a summary of every window of episodes; without a
+    recorder, the reward rate, epsilon and win rate of every 100 episodes are logged.
+    With checkpoints, Q is checkpointed in the background whenever a window is won more than 65% of the time. The
+    metrics recorder is paused meanwhile, so its writer thread does not keep the checkpoint from being forked.
+    """
     if Q is None:
         Q = BoardSaver(env.size)
-    rw = 0
-    won = 0
-    new_states = defaultdict(int)
-    amount_of_turns = defaultdict(int)
-    for e in range(num_episodes):
-        state = env.reset()
-        turn = 0
-        if not Q.contains(state):
-            for a in env.action_spaces:
-                Q.define(state, a, env.size)
-            new_states[turn] += 1
-
-        action = epsilon_greedy(Q, state, env.action_spaces, eps)
-        done = False
-        
-        while not done:
-            next_state, info = env.step(action)
-            turn += 1
-            reward = info.get("reward")
-            done = info.get("done")
-            rw += reward
-
-            if done:
-                next_state = None
-                won += info.get("player_1_points") > info.get("player_2_points")
-
-            elif not Q.contains(next_state):
+    profiler = profiler or DISABLED
+    # Canonicalization happens inside Q, so it is timed by wrapping the canonicalizer, when Q has one
+    canonicalizer = getattr(Q, "canonicalizer", None) if profiler.enabled else None
+    if profiler.enabled:
+        env.profiler = profiler
+        if canonicalizer is not None:
+            canonicalizer.canonical = profiler.timed(PHASE_CANONICALIZE, canonicalizer.canonical)
+        profiler.start()
+    try:
+        rw = 0
+        won = 0
+        for e in range(num_episodes):
+            profiler.enter(PHASE_ENV_STEP)
+            state = env.reset()
+            turn = 0
+            episode_rw = 0
+            profiler.enter(PHASE_Q_LOOKUP)
+            if not Q.contains(state):
+                profiler.enter(PHASE_Q_UPDATE)
                 for a in env.action_spaces:
-                    Q.define(next_state, a, env.size)
-                new_states[turn] += 1
-            next_action = epsilon_greedy(Q, next_state, env.action_spaces, eps)
-
-            eps = max(epsmin, eps * eps_decay)
-
-            old_q_value = Q.get(state, action)
-            next_expected_value = (
-                max(map(lambda a: Q.get(next_state, a), env.action_spaces)) if next_state is not None else 0
-            )
-            new_q_value = old_q_value + alpha * (reward + gamma * next_expected_value - old_q_value)
-            Q.define(state, action, new_q_value)
-
-            state = next_state
-            action = next_action
-        amount_of_turns[turn] += 1
-        if e % 100 == 0:
-            avg_rw = rw / 100
-            avg_won = won / 100
-            average_new_states = sum((key*value for key, value in new_states.items())) / sum(new_states.values())
-            average_amount_of_turns = sum((key*value for key, value in amount_of_turns.items())) / sum(amount_of_turns.values())
-            logging.info(
-                f"episode: {e}, reward rate: {avg_rw}, new states: {sum(new_states.values())}, epsilon: {eps}, avg_won: {avg_won}. avg_pd_ns {average_new_states}, avg_pd_aot {average_amount_of_turns}"
-            )
-            
-            rw = 0
-            won = 0
-            if avg_won > 0.65:
-                logging.info(f"Update q value function: episode: {e}, reward rate: {avg_rw}, new states: {sum(new_states.values())}, epsilon: {eps}, avg_won: {avg_won}. avg_pd_ns {average_new_states}, avg_pd_aot {average_amount_of_turns}")
-                env.update_q_value_function(q_value_function=Q)
-                q_file = f"q_value_function_{board_size}x{board_size}_epoch{e}.pickle"
-                save_value_function(q_file, Q)
-            new_states = defaultdict(int)
-            amount_of_turns = defaultdict(int)
-    
+                    Q.define(state, a, env.size)
+
+            profiler.enter(PHASE_Q_LOOKUP)
+            action = epsilon_greedy(Q, state, env.action_spaces, eps)
+            done = False
+        
+            while not done:
+                profiler.enter(PHASE_ENV_STEP)
+                next_state, info = env.step(action)
+                profiler.enter(PHASE_OTHER)
+                turn += 1
+                reward = info.get("reward")
+                done = info.get("done")
+                rw += reward
+                episode_rw += reward
+
+                if done:
+                    next_state = None
+                    won += info.get("player_1_points") > info.get("player_2_points")
+
+                else:
+                    profiler.enter(PHASE_Q_LOOKUP)
+                    if not Q.contains(next_state):
+                        profiler.enter(PHASE_Q_UPDATE)
+                        for a in env.action_spaces:
+                            Q.define(next_state, a, env.size)
+                profiler.enter(PHASE_Q_LOOKUP)
+                next_action = epsilon_greedy(Q, next_state, env.action_spaces, eps)
+
+                eps = max(epsmin, eps * eps_decay)
+
+                profiler.enter(PHASE_Q_UPDATE)
+                if replay is not None:
+                    board, symmetry = Q.canonical(state)
+                    next_board = Q.canonical(next_state)[0] if next_state is not None else None
+                    _action = Q.canonical_action(symmetry, action)
+                    next_player_points = info.get("player_1_points")
+                    replay.add(Transition(board, state.player_points, _action, reward, next_board, next_player_points))
+                    if len(replay) >= batch_size:
+                        replay.replay(Q, batch_size, alpha, gamma, env.size)
+                else:
+                    profiler.enter(PHASE_Q_LOOKUP)
+                    old_q_value = Q.get(state, action)
+                    next_expected_value = 0
+                    if next_state is not None:
+                        next_expected_value = float(Q.get_all(next_state, env.action_spaces).max())
+                    profiler.enter(PHASE_Q_UPDATE)
+                    new_q_value = old_q_value + alpha * (reward + gamma * next_expected_value - old_q_value)
+                    Q.define(state, action, new_q_value)
+
+                profiler.enter(PHASE_OTHER)
+                state = next_state
+                action = next_action
+            if metrics is not None:
+                player_1_points, player_2_points = info.get("player_1_points"), info.get("player_2_points")
+                metrics.record(
+                    EpisodeMetrics(
+                        e,
+                        episode_outcome(player_1_points, player_2_points),
+                        turn,
+                        episode_rw,
+                        player_1_points,
+                        player_2_points,
+                        len(Q.boards),
+                        eps,
+                    )
+                )
+            if e % 100 == 0:
+                avg_won = won / 100
+                if metrics is None:
+                    logging.info("episode: %d, reward rate: %s, epsilon: %s, avg_won: %s", e, rw / 100, eps, avg_won)
+                rw = 0
+                won = 0
+                if avg_won > 0.65:
+                    logging.info("Update q value function: episode: %d, avg_won: %s", e, avg_won)
+                    env.update_q_value_function(q_value_function=Q)
+                    if checkpoints is not None:
+                        profiler.enter(PHASE_PERSISTENCE)
+                        with metrics.paused() if metrics is not None else contextlib.nullcontext():
+                            checkpoints.save(Q)
+                        profiler.enter(PHASE_OTHER)
+                if profiler.enabled:
+                    window = profiler.window(100 if e else 1)
+                    logging.info(
+                        f"episode: {e}, profile: "
+                        + ", ".join(f"{phase} {share:.1%}" for phase, share in sorted(window.shares().items())),
+                        extra={"profile": window._asdict()},
+                    )
+
+        if profiler.enabled and num_episodes and e % 100:
+            profiler.window(e % 100)
+    finally:
+        if profiler.enabled:
+            env.profiler = DISABLED
+        if canonicalizer is not None:
+            del canonicalizer.canonical
+    if metrics is not None:
+        metrics.flush()
     return Q
 
 
@@ -134,26 +219,87 @@ def play_against_player(board_size, q_value_function):
 
 
 def save_q(q_file, q_value_function: BoardSaver):
-    with open(q_file, "wb") as handle:
-        pickle.dump(q_value_function, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    write_qtable(q_file, q_value_function)
 
 
 def load_q(q_file) -> BoardSaver:
-    with open(q_file, "rb") as handle:
-        training_q_value_function = pickle.load(handle)
-    return training_q_value_function
+    return read_qtable(q_file)
 
 
-def train(board_size, q_file, q_value_function):
-    for e in range(100):
+def train(
+    board_size,
+    q_file,
+    q_value_function,
+    checkpoints: CheckpointManager = None,
+    metrics: MetricsRecorder = None,
+    rounds=100,
+    episodes=2_000,
+):
+    """
+    rounds of q_learning, episodes each, against the table as the previous round left it. Every round starts with a
+    full base checkpoint of the table, by default into q_file's directory keeping the last 3, and the opponent plays
+    a memory map of it, so the table is never copied; checkpoints within a round are deltas of the states changed
+    since. q_file and a last base are written at the end.
+    Episodes are recorded to metrics, by default a `LoggingSink` logging every 100 of them. The recorder is paused
+    around every checkpoint, so with the default snapshot the checkpoint is forked rather than copied. A round only
+    waits for its base to be written, as the opponent maps it.
+    """
+    if checkpoints is None:
+        checkpoints = CheckpointManager(
+            os.path.dirname(q_file) or ".", prefix=os.path.splitext(os.path.basename(q_file))[0], compact_every=10
+        )
+    own_metrics = metrics is None
+    if own_metrics:
+        metrics = MetricsRecorder(LoggingSink())
+    for e in range(rounds):
         logging.info(e)
-        training_q_value_function = load_q(q_file)
-
-        env = DotsAndBoxes(board_size, DotsAndBoxesMixerPolicy(training_q_value_function))
+        with metrics.paused():
+            checkpoints.save(q_value_function, block=True, base=True)
+        checkpoints.wait()
+
+        env = DotsAndBoxes(
+            board_size,
+            DotsAndBoxesMixerPolicy(open_mapped_qtable(checkpoints.latest())),
+            engine=DotsAndBoxes.ENGINE_BITBOARD,
+            observation=DotsAndBoxes.OBSERVATION_MASK,
+        )
         q_value_function = q_learning(
-            env, 2_000, alpha=0.05, gamma=0.95, eps=0.1, epsmin=0.01, eps_decay=0.999995, Q=q_value_function
+            env,
+            episodes,
+            alpha=0.05,
+            gamma=0.95,
+            eps=0.1,
+            epsmin=0.01,
+            eps_decay=0.999995,
+            Q=q_value_function,
+            metrics=metrics,
+            checkpoints=checkpoints,
+        )
+    with metrics.paused():
+        checkpoints.save(q_value_function, block=True, base=True)
+    if own_metrics:
+        metrics.close()
+    checkpoints.wait()
+    save_q(q_file, q_value_function)
+    return q_value_function
+
+
+def train_parallel(board_size, q_file, q_value_function, workers=os.cpu_count(), snapshot_interval=1_000, seed=0):
+    for e in range(100):
+        logging.info(e)
+        q_value_function = parallel_q_learning(
+            board_size,
+            2_000,
+            alpha=0.05,
+            gamma=0.95,
+            eps=0.1,
+            epsmin=0.01,
+            eps_decay=0.999995,
+            Q=q_value_function,
+            workers=workers,
+            snapshot_interval=snapshot_interval,
+            seed=seed + e,
         )
-        del training_q_value_function
         save_q(q_file, q_value_function)
     return q_value_function
 
@@ -167,15 +313,20 @@ if __name__ == "__main__":
     )
 
     board_size = 3
-    q_file = f"q_value_function_{board_size}x{board_size}.pickle"
+    q_file = f"q_value_function_{board_size}x{board_size}.qtable"
+    legacy_q_file = f"q_value_function_{board_size}x{board_size}.pickle"
 
     if not os.path.exists(q_file):
-        with open(q_file, "wb") as handle:
-            pickle.dump(BoardSaver(board_size), handle, protocol=pickle.HIGHEST_PROTOCOL)
-
-    q_value_function = load_q(q_file)
+        if os.path.exists(legacy_q_file):
+            convert_pickle(legacy_q_file, q_file)
+        else:
+            save_q(q_file, BoardSaver(board_size, storage=BoardSaver.STORAGE_DENSE))
+
+    # Resume from the last checkpoint of an interrupted run
+    checkpoints = CheckpointManager(".", prefix=os.path.splitext(q_file)[0], compact_every=10)
+    q_value_function = checkpoints.load() if checkpoints.latest() else load_q(q_file)
     logging.info(len(q_value_function.boards))
 
-    train(board_size, q_file, q_value_function)
+    train(board_size, q_file, q_value_function, checkpoints)
 
     # play_against_player(board_size, q_value_function)
@@ -0,0 +1,259 @@
+import math
+import multiprocessing
+import random
+import time
+from typing import NamedTuple
+
+from .bitboard import board_tables, closed_boxes, free_positions, inverse_symmetry_permutations, state_mask
+from .dots_boxes import DotsAndBoxes, DotsAndBoxesPolicy
+from .learning_player import Canonicalizer
+from .solver import Solver
+
+
+class ActionStats(NamedTuple):
+    visits: int
+    value: float
+
+
+class MCTSNode:
+    """
+    Statistics of a canonical board for the player to move: visits of the node, and visits and total net boxes of
+    each canonical edge position tried from it, and the positions not tried yet.
+    """
+
+    __slots__ = ("visits", "untried", "action_visits", "action_totals")
+
+    def __init__(self, untried):
+        self.visits = 0
+        self.untried = untried
+        self.action_visits = {}
+        self.action_totals = {}
+
+
+class MCTS:
+    """
+    UCT search over edge masks. Nodes are keyed by the `Canonicalizer` mask and the search walks canonical boards
+    (every symmetry keeps which boxes an edge closes), so symmetric positions share statistics. The node table is
+    kept between searches, which reuses the subtree of the previous move; nodes with fewer edges than the current
+    root can no longer be reached and are dropped. Moves are the `Solver.ordered_moves` of a board, so a capture
+    that cannot be part of a double-dealing decision is always taken, as a greedy player would. Leaves are valued by
+    a greedy rollout: close a box if possible, otherwise play a random edge. Values are net boxes for the player to
+    move, scaled by the number of boxes in the UCT score.
+    Rollouts are played one at a time on a mask. Batching the leaves of many selections on the boards of a
+    `VectorDotsAndBoxes` with `DotsAndBoxesCloseBoxesPolicy.next_actions` is no faster up to 5x5 boards, even 256
+    at a time: the games are too short to pay for the per-move NumPy calls, and the batched selections share stale
+    statistics.
+    """
+
+    def __init__(self, size, exploration=1.4, max_nodes=2**20, seed=None):
+        self.size = size
+        self.tables = board_tables(size)
+        self.exploration = exploration
+        self.max_nodes = max_nodes
+        self.rng = random.Random(seed)
+        self.canonicalizer = Canonicalizer(size)
+        self._moves = Solver(size, table_size=0)
+        self.nodes = {}
+        self._root_edges = 0
+
+    def _new_node(self, mask):
+        # Popped from the end: captures first, then safe edges, then the rest; forced captures are the only move
+        return MCTSNode([position for position, _ in reversed(self._moves.ordered_moves(mask))])
+
+    def _select(self, node: MCTSNode):
+        if node.untried:
+            return node.untried.pop()
+        scale = len(self.tables.box_masks)
+        log_visits = math.log(node.visits)
+
+        def uct(position):
+            visits = node.action_visits[position]
+            return node.action_totals[position] / visits / scale + self.exploration * math.sqrt(log_visits / visits)
+
+        return max(node.action_visits, key=uct)
+
+    def rollout(self, mask):
+        """
+        Net boxes the player to move on mask gets when both players play greedily to the end.
+        """
+        box_sides = [(mask & box_mask).bit_count() for box_mask in self.tables.box_masks]
+        capturable = [box for box, sides in enumerate(box_sides) if sides == 3]
+        order = free_positions(self.size, mask)
+        self.rng.shuffle(order)
+
+        net, sign = 0, 1
+        for _ in range(len(order)):
+            position = None
+            while capturable and position is None:
+                box = capturable.pop()
+                position = next((p for p in self.tables.box_edges[box] if not mask >> p & 1), None)
+            while position is None:
+                candidate = order.pop()
+                position = None if mask >> candidate & 1 else candidate
+
+            mask |= 1 << position
+            closed = 0
+            for box in self.tables.edge_boxes[position]:
+                box_sides[box] += 1
+                if box_sides[box] == 3:
+                    capturable.append(box)
+                closed += box_sides[box] == 4
+            net += sign * closed
+            if not closed:
+                sign = -sign
+        return net
+
+    def _simulate(self, root):
+        """
+        One selection, expansion, rollout and backpropagation from the canonical root mask.
+        """
+        path = []
+        mask, sign, net = root, 1, 0
+        while mask != self.tables.full_mask:
+            canonical = self.canonicalizer.canonical(mask)[0]
+            node = self.nodes.get(canonical)
+            expand = node is None
+            if expand:
+                node = self.nodes[canonical] = self._new_node(canonical)
+
+            position = self._select(node)
+            path.append((node, position, sign, net))
+            closed = closed_boxes(self.tables, canonical, position)
+            mask = canonical | 1 << position
+            net += sign * closed
+            if not closed:
+                sign = -sign
+            if expand:
+                break
+
+        net += sign * self.rollout(mask)
+        for node, position, _sign, _net in path:
+            node.visits += 1
+            node.action_visits[position] = node.action_visits.get(position, 0) + 1
+            node.action_totals[position] = node.action_totals.get(position, 0) + _sign * (net - _net)
+
+    def _prune(self, root):
+        root_edges = root.bit_count()
+        if root_edges > self._root_edges:
+            self.nodes = {mask: node for mask, node in self.nodes.items() if mask.bit_count() >= root_edges}
+        if len(self.nodes) > self.max_nodes:
+            self.nodes = {}
+        self._root_edges = root_edges
+
+    def search(self, mask, simulations=1000, time_limit=None):
+        """
+        Run simulations from mask, stopping early after time_limit seconds. Returns the `ActionStats` of each
+        edge position of the canonical board of mask, and the symmetry that maps mask to it.
+        """
+        root, symmetry = self.canonicalizer.canonical(mask)
+        self._prune(root)
+        started = time.monotonic()
+        for _ in range(simulations):
+            if time_limit is not None and time.monotonic() - started > time_limit:
+                break
+            self._simulate(root)
+
+        node = self.nodes[root] if root in self.nodes else self._new_node(root)
+        return {
+            position: ActionStats(visits, node.action_totals[position] / visits)
+            for position, visits in node.action_visits.items()
+        }, symmetry
+
+
+def real_position(size, symmetry, canonical_position):
+    """
+    Edge position of the board searched that moves to canonical_position under symmetry.
+    """
+    return inverse_symmetry_permutations(size)[symmetry][canonical_position]
+
+
+_searches = {}
+
+
+def _worker_search(task):
+    """
+    Search in a pool worker. Each worker keeps its own tree per configuration, so it also reuses subtrees.
+    """
+    size, exploration, max_nodes, mask, simulations, time_limit, seed = task
+    key = (size, exploration, max_nodes)
+    if key not in _searches:
+        _searches[key] = MCTS(size, exploration, max_nodes)
+    _searches[key].rng.seed(seed)
+    return _searches[key].search(mask, simulations, time_limit)[0]
+
+
+class DotsAndBoxesMCTSPolicy(DotsAndBoxesPolicy):
+    """
+    Plays the most visited edge of an `MCTS` search run with a budget of simulations and/or time_limit seconds per
+    move. With workers > 0 the budget is split over a process pool, each worker searching its own tree from the
+    same root, and their root statistics are summed (root parallelism). Call close to stop the pool.
+    """
+
+    def __init__(
+        self,
+        q_value_function=None,
+        simulations=1000,
+        time_limit=None,
+        exploration=1.4,
+        workers=0,
+        max_nodes=2**20,
+        seed=None,
+    ):
+        super().__init__(q_value_function)
+        self.simulations = simulations
+        self.time_limit = time_limit
+        self.exploration = exploration
+        self.workers = workers
+        self.max_nodes = max_nodes
+        self.rng = random.Random(seed)
+        self._searches = {}
+        self._pool = None
+
+    def _board(self, state, action_space):
+        if self._attached(action_space) and self._env.engine == DotsAndBoxes.ENGINE_BITBOARD:
+            return self._env.size, self._env.edges
+        size = self._board_size(state, action_space)
+        return size, state_mask(size, state.state)
+
+    def search(self, size, mask):
+        """
+        Summed root `ActionStats` by canonical edge position, and the symmetry of the canonical board.
+        """
+        if self.workers <= 0:
+            if size not in self._searches:
+                self._searches[size] = MCTS(size, self.exploration, self.max_nodes, self.rng.getrandbits(64))
+            return self._searches[size].search(mask, self.simulations, self.time_limit)
+
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.workers)
+        simulations = -(-self.simulations // self.workers)
+        tasks = [
+            (size, self.exploration, self.max_nodes, mask, simulations, self.time_limit, self.rng.getrandbits(64))
+            for _ in range(self.workers)
+        ]
+        visits, totals = {}, {}
+        for stats in self._pool.map(_worker_search, tasks):
+            for position, (_visits, _value) in stats.items():
+                visits[position] = visits.get(position, 0) + _visits
+                totals[position] = totals.get(position, 0) + _visits * _value
+        stats = {position: ActionStats(visits[position], totals[position] / visits[position]) for position in visits}
+        return stats, Canonicalizer(size, cache_size=0).canonical(mask)[1]
+
+    def next_action(self, state, action_space):
+        size, mask = self._board(state, action_space)
+        stats, symmetry = self.search(size, mask)
+        if not stats:
+            return self.rng.choice(sorted(action_space))
+        position = max(sorted(stats), key=lambda p: (stats[p].visits, stats[p].value))
+        return board_tables(size).edges[real_position(size, symmetry, position)]
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_pool"] = None
+        return state
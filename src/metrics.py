@@ -0,0 +1,231 @@
+import contextlib
+import csv
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from typing import NamedTuple
+
+OUTCOME_WON = 1
+OUTCOME_DRAW = 0
+OUTCOME_LOST = -1
+
+
+class EpisodeMetrics(NamedTuple):
+    """
+    Outcome of one training episode, for player 1. q_states is the number of (board, player points) states in the
+    Q table at its end.
+    """
+
+    episode: int
+    outcome: int
+    turns: int
+    reward: float
+    player_1_points: int
+    player_2_points: int
+    q_states: int
+    epsilon: float
+
+
+def episode_outcome(player_1_points, player_2_points):
+    if player_1_points == player_2_points:
+        return OUTCOME_DRAW
+    return OUTCOME_WON if player_1_points > player_2_points else OUTCOME_LOST
+
+
+class RingBufferSink:
+    """
+    Keeps the last capacity records in memory.
+    """
+
+    def __init__(self, capacity=2**16):
+        self._records = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+
+    def write(self, records):
+        with self._lock:
+            self._records.extend(records)
+
+    def records(self):
+        with self._lock:
+            return list(self._records)
+
+    def close(self):
+        pass
+
+
+class CSVSink:
+    """
+    Appends records to a CSV file, writing the header when the file is new.
+    """
+
+    def __init__(self, path, fields=EpisodeMetrics._fields):
+        self.path = path
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, "a", newline="")
+        self._writer = csv.writer(self._file)
+        if new:
+            self._writer.writerow(fields)
+            self._file.flush()
+
+    def write(self, records):
+        self._writer.writerows(records)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class JSONLinesSink:
+    """
+    Appends records to a file as one JSON object per line.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "a")
+
+    def write(self, records):
+        self._file.writelines(json.dumps(record._asdict()) + "\n" for record in records)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class LoggingSink:
+    """
+    Logs a summary of every window records: the last episode, mean reward, share of episodes won, mean turns, Q
+    states and epsilon. A partial window is logged on close.
+    """
+
+    def __init__(self, window=100, logger=None, level=logging.INFO):
+        self.window = window
+        self.logger = logger or logging.getLogger(__name__)
+        self.level = level
+        self._pending = []
+
+    def write(self, records):
+        for record in records:
+            self._pending.append(record)
+            if len(self._pending) == self.window:
+                self._log()
+
+    def _log(self):
+        records, self._pending = self._pending, []
+        self.logger.log(
+            self.level,
+            "episode: %d, reward rate: %.3f, won: %.3f, turns: %.1f, q states: %d, epsilon: %.4f",
+            records[-1].episode,
+            sum(record.reward for record in records) / len(records),
+            sum(record.outcome == OUTCOME_WON for record in records) / len(records),
+            sum(record.turns for record in records) / len(records),
+            records[-1].q_states,
+            records[-1].epsilon,
+        )
+
+    def close(self):
+        if self._pending:
+            self._log()
+
+
+def read_csv_metrics(path):
+    """
+    `EpisodeMetrics` written by a `CSVSink`.
+    """
+    _types = [EpisodeMetrics.__annotations__[field] for field in EpisodeMetrics._fields]
+    with open(path, newline="") as f:
+        rows = csv.reader(f)
+        next(rows)
+        return [EpisodeMetrics(*(_type(value) for _type, value in zip(_types, row))) for row in rows]
+
+
+def read_json_lines_metrics(path):
+    """
+    `EpisodeMetrics` written by a `JSONLinesSink`.
+    """
+    with open(path) as f:
+        return [EpisodeMetrics(**json.loads(line)) for line in f if line.strip()]
+
+
+class MetricsRecorder:
+    """
+    Collects records in batches of batch_size and hands full batches, or the pending one at the first record after
+    flush_interval seconds, to a background thread that writes them to sink. record only appends to a list, so the
+    training loop never waits on I/O. flush blocks until everything recorded is written, close also stops the
+    thread and closes the sink. An error raised by the sink is raised again by the next record, flush or close.
+    Within paused the thread is stopped, everything recorded before written, so the process can fork without a
+    child inheriting the writer's locks; records made meanwhile are written once it resumes.
+    """
+
+    def __init__(self, sink, batch_size=256, flush_interval=1.0):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._batch = []
+        self._handed = time.monotonic()
+        self._queue = queue.Queue()
+        self._error = None
+        self._start()
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._write_batches, name="metrics-writer", daemon=True)
+        self._thread.start()
+
+    def _stop(self):
+        if self._thread.is_alive():
+            self._hand_batch()
+            self._queue.put(None)
+            self._thread.join()
+
+    def _write_batches(self):
+        while True:
+            batch = self._queue.get()
+            try:
+                if batch is None:
+                    return
+                if self._error is None:
+                    self.sink.write(batch)
+            except Exception as error:
+                self._error = error
+            finally:
+                self._queue.task_done()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _hand_batch(self):
+        if self._batch:
+            self._queue.put(self._batch)
+            self._batch = []
+        self._handed = time.monotonic()
+
+    def record(self, record):
+        self._batch.append(record)
+        if len(self._batch) >= self.batch_size or time.monotonic() - self._handed > self.flush_interval:
+            self._raise_error()
+            self._hand_batch()
+
+    def flush(self):
+        self._hand_batch()
+        self._queue.join()
+        self._raise_error()
+
+    @contextlib.contextmanager
+    def paused(self):
+        self._stop()
+        try:
+            self._raise_error()
+            yield self
+        finally:
+            self._start()
+
+    def close(self):
+        self._stop()
+        self.sink.close()
+        self._raise_error()
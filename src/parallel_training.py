@@ -0,0 +1,161 @@
+import logging
+import multiprocessing
+import os
+import pickle
+import random
+import tempfile
+from typing import NamedTuple
+
+import numpy as np
+
+from .bitboard import free_positions
+from .dots_boxes import DotsAndBoxes, DotsAndBoxesMixerPolicy
+from .learning_player import BoardSaver, define_unknown
+from .replay_buffer import Transition
+
+
+class Rollout(NamedTuple):
+    transitions: list
+    won: int
+
+
+def _action_values(Q: BoardSaver, state, actions, init_value):
+    if Q.contains(state):
+        return Q.get_all(state, actions)
+    return np.full(len(actions), init_value, dtype=np.float64)
+
+
+_snapshot = (None, None)
+
+
+def _load_snapshot(snapshot_file):
+    """
+    Each worker unpickles a snapshot once, then reuses it for every task of the same round.
+    """
+    global _snapshot
+    if _snapshot[0] != snapshot_file:
+        with open(snapshot_file, "rb") as handle:
+            _snapshot = (snapshot_file, pickle.load(handle))
+    return _snapshot[1]
+
+
+def _play_episodes(task):
+    """
+    Play episodes against a frozen snapshot of the Q-table and return the agent transitions in canonical form.
+    The snapshot is never modified: unknown states are valued at init_value, as q_learning would define them.
+    """
+    snapshot_file, episodes, eps, init_value, seed = task
+    snapshot = _load_snapshot(snapshot_file)
+    random.seed(seed)
+
+    env = DotsAndBoxes(
+        snapshot.size,
+        DotsAndBoxesMixerPolicy(snapshot),
+        engine=DotsAndBoxes.ENGINE_BITBOARD,
+        observation=DotsAndBoxes.OBSERVATION_MASK,
+    )
+    transitions = []
+    won = 0
+    for _ in range(episodes):
+        state = env.reset()
+        done = False
+        while not done:
+            actions = list(env.action_spaces)
+            if random.random() < eps:
+                action = random.choice(actions)
+            else:
+                action = actions[int(np.argmax(_action_values(snapshot, state, actions, init_value)))]
+
+            board, symmetry = snapshot.canonical(state)
+            _action = snapshot.canonical_action(symmetry, action)
+            next_state, info = env.step(action)
+            done = info.get("done")
+
+            next_board = None if done else snapshot.canonical(next_state)[0]
+            reward = info.get("reward")
+            transitions.append(
+                Transition(board, state.player_points, _action, reward, next_board, next_state.player_points)
+            )
+            state = next_state
+        won += info.get("player_1_points") > info.get("player_2_points")
+    return Rollout(transitions, won)
+
+
+def apply_transitions(Q: BoardSaver, transitions, alpha, gamma, init_value):
+    """
+    Apply the q_learning update for each canonical transition, in order.
+    """
+    for t in transitions:
+        define_unknown(Q, t.board, t.player_points, init_value)
+        next_expected_value = 0
+        if t.next_board is not None:
+            define_unknown(Q, t.next_board, t.next_player_points, init_value)
+            _next_values = Q.boards.action_values(
+                t.next_board, t.next_player_points, free_positions(Q.size, t.next_board)
+            )
+            next_expected_value = float(_next_values.max())
+
+        old_q_value = Q.boards.value(t.board, t.player_points, t.action)
+        new_q_value = old_q_value + alpha * (t.reward + gamma * next_expected_value - old_q_value)
+        Q.boards.set_value(t.board, t.player_points, t.action, new_q_value)
+
+
+def parallel_q_learning(
+    size: int,
+    num_episodes: int,
+    alpha: float,
+    gamma: float = 1.0,
+    eps: float = 1.0,
+    eps_decay: float = 0.9999,
+    epsmin: float = 0.01,
+    Q: BoardSaver = None,
+    workers: int = 4,
+    snapshot_interval: int = 1000,
+    task_episodes: int = 50,
+    seed: int = 0,
+):
+    """
+    Q-learning where a pool of worker processes plays episodes against a snapshot of Q and a single learner applies
+    their transitions. Every snapshot_interval episodes the learner publishes a new snapshot and splits the next
+    round in tasks of task_episodes episodes. Tasks are seeded from seed and their results applied in task order, so
+    the outcome depends on seed but not on the number of workers or on scheduling. workers=0 plays every episode in
+    the calling process.
+    """
+    if Q is None:
+        Q = BoardSaver(size, storage=BoardSaver.STORAGE_DENSE)
+    init_value = size
+    seeds = random.Random(seed)
+
+    pool = multiprocessing.Pool(workers) if workers > 0 else None
+    try:
+        with tempfile.TemporaryDirectory() as snapshot_directory:
+            played = 0
+            while played < num_episodes:
+                round_episodes = min(snapshot_interval, num_episodes - played)
+                snapshot_file = os.path.join(snapshot_directory, f"snapshot_{played}.pickle")
+                with open(snapshot_file, "wb") as handle:
+                    pickle.dump(Q, handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+                tasks = [
+                    (snapshot_file, min(task_episodes, round_episodes - start), eps, init_value, seeds.getrandbits(64))
+                    for start in range(0, round_episodes, task_episodes)
+                ]
+                rollouts = pool.imap(_play_episodes, tasks) if pool is not None else map(_play_episodes, tasks)
+
+                steps = 0
+                won = 0
+                for rollout in rollouts:
+                    apply_transitions(Q, rollout.transitions, alpha, gamma, init_value)
+                    steps += len(rollout.transitions)
+                    won += rollout.won
+                eps = max(epsmin, eps * eps_decay**steps)
+                played += round_episodes
+                logging.info(
+                    f"episode: {played}, won: {won / round_episodes}, states: {len(Q.boards)}, epsilon: {eps}"
+                )
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return Q
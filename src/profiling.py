@@ -0,0 +1,127 @@
+import time
+from collections import defaultdict, deque
+from typing import NamedTuple
+
+PHASE_ENV_STEP = "env_step"
+PHASE_OPPONENT = "opponent"
+PHASE_CANONICALIZE = "canonicalize"
+PHASE_Q_LOOKUP = "q_lookup"
+PHASE_Q_UPDATE = "q_update"
+PHASE_PERSISTENCE = "persistence"
+PHASE_OTHER = "other"
+
+
+class ProfileWindow(NamedTuple):
+    """
+    Seconds spent and times entered per phase over a reporting window of episodes.
+    """
+
+    episodes: int
+    seconds: float
+    totals: dict
+    counts: dict
+
+    def shares(self):
+        """
+        Fraction of the window time spent in each phase.
+        """
+        return {phase: total / self.seconds for phase, total in self.totals.items()} if self.seconds else {}
+
+
+class PhaseProfiler:
+    """
+    Time split over phases. enter charges the time since the previous switch to the current phase and makes phase
+    the current one, so nested phases are exclusive: an opponent move inside a step is not env_step time. One clock
+    read per switch. When not enabled every method is a no-op, enter included, so it can stay in hot loops.
+    window closes a reporting window: its `ProfileWindow` is returned and kept in windows, the last max_windows.
+    """
+
+    def __init__(self, enabled=True, max_windows=1024, clock=time.perf_counter):
+        self.enabled = enabled
+        self.clock = clock
+        self.windows = deque(maxlen=max_windows)
+        self.totals = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.episodes = 0
+        self._window_totals = defaultdict(float)
+        self._window_counts = defaultdict(int)
+        self._window_started = clock()
+        self._phase = PHASE_OTHER
+        self._started = self._window_started
+        if not enabled:
+            self.start = self.enter = self.resume = self.window = _noop
+
+    def start(self):
+        """
+        Drop the time of the current window, which starts now in the "other" phase.
+        """
+        self._window_totals = defaultdict(float)
+        self._window_counts = defaultdict(int)
+        self._phase = PHASE_OTHER
+        self._window_started = self._started = self.clock()
+
+    def enter(self, phase):
+        """
+        Make phase the current one and return the previous, to be given back to resume.
+        """
+        now = self.clock()
+        previous = self._phase
+        self._window_totals[previous] += now - self._started
+        self._window_counts[phase] += 1
+        self._phase, self._started = phase, now
+        return previous
+
+    def resume(self, phase):
+        """
+        As enter, without counting an entry, to return to the phase interrupted by a nested one.
+        """
+        now = self.clock()
+        self._window_totals[self._phase] += now - self._started
+        self._phase, self._started = phase, now
+
+    def timed(self, phase, function):
+        """
+        function charged to phase on every call.
+        """
+
+        def _timed(*args, **kwargs):
+            previous = self.enter(phase)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.resume(previous)
+
+        return _timed
+
+    def window(self, episodes):
+        """
+        Close the current window, of episodes episodes, add it to the running totals and return it.
+        """
+        self.resume(self._phase)
+        now = self._started
+        seconds = now - self._window_started
+        window = ProfileWindow(episodes, seconds, dict(self._window_totals), dict(self._window_counts))
+        for phase, total in window.totals.items():
+            self.totals[phase] += total
+        for phase, count in window.counts.items():
+            self.counts[phase] += count
+        self.episodes += episodes
+        self.windows.append(window)
+        self._window_totals = defaultdict(float)
+        self._window_counts = defaultdict(int)
+        self._window_started = now
+        return window
+
+    def stats(self):
+        """
+        Totals and entries of every phase since the profiler was created, closed windows only.
+        """
+        return ProfileWindow(self.episodes, sum(self.totals.values()), dict(self.totals), dict(self.counts))
+
+
+def _noop(*args):
+    return None
+
+
+# Shared by whoever is not profiling
+DISABLED = PhaseProfiler(enabled=False)
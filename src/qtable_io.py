@@ -0,0 +1,302 @@
+"""
+Binary persistence for `BoardSaver` Q-tables.
+
+A file is a fixed header followed by three arrays, one entry per stored (canonical board, player points) state,
+sorted by board and then by player points:
+
+    header   32 bytes: magic b"DBQT", version, board size, key width in bytes, columns, rows (little-endian)
+    values   rows x columns float64, one column per edge in bit position order (`edge_columns`), NaN where the
+             action was never defined
+    points   rows uint16, player points of the state
+    keys     rows x key width bytes, the canonical board mask as a big-endian unsigned integer
+"""
+import os
+import pickle
+import struct
+import sys
+from typing import NamedTuple
+
+import numpy as np
+
+from .bitboard import board_tables, edge_columns
+from .learning_player import BoardSaver, DenseStorage, split_state_key, state_key
+
+MAGIC = b"DBQT"
+VERSION = 1
+HEADER = struct.Struct("<4sHHHHQ")
+HEADER_SIZE = 32
+
+
+class QTableHeader(NamedTuple):
+    version: int
+    size: int
+    key_bytes: int
+    columns: int
+    rows: int
+
+    @property
+    def values_offset(self):
+        return HEADER_SIZE
+
+    @property
+    def points_offset(self):
+        return self.values_offset + self.rows * self.columns * 8
+
+    @property
+    def keys_offset(self):
+        return self.points_offset + self.rows * 2
+
+
+def key_bytes(size):
+    """
+    Width of the stored board keys, a whole number of 64 bit words.
+    """
+    return 8 * -(-board_tables(size).slots // 64)
+
+
+def pack_header(magic, version, size, width, columns, rows):
+    """
+    HEADER_SIZE bytes of a header, shared by Q-table and tablebase files.
+    """
+    return HEADER.pack(magic, version, size, width, columns, rows).ljust(HEADER_SIZE, b"\0")
+
+
+def unpack_header(handle, magic, expected_version, kind):
+    """
+    Version, size, key width, columns and rows of a header written by `pack_header`, checking its magic and version.
+    """
+    _magic, version, size, _key_bytes, columns, rows = HEADER.unpack(handle.read(HEADER.size))
+    if _magic != magic:
+        raise Exception("Not a {} file, magic is {}".format(kind, _magic))
+    if version != expected_version:
+        raise Exception("Unsupported {} version {}".format(kind, version))
+    return version, size, _key_bytes, columns, rows
+
+
+def read_header(handle):
+    return QTableHeader(*unpack_header(handle, MAGIC, VERSION, "Q-table"))
+
+
+def sorted_states(saver: BoardSaver, keys=None):
+    """
+    Boards, player points and value rows of every stored state, sorted by board and player points. With keys, as
+    `BoardSaver.take_changes` returns them, only those states.
+    """
+    storage = saver.boards
+    if isinstance(storage, DenseStorage):
+        keys = sorted(storage.rows if keys is None else keys)
+        order = np.fromiter((storage.rows[k] for k in keys), dtype=np.intp, count=len(keys))
+        boards, points = zip(*map(split_state_key, keys)) if keys else ((), ())
+        return list(boards), list(points), storage.values[order].astype(np.float64)
+
+    if keys is None:
+        states = sorted(storage.items_by_state(), key=lambda x: (x[0], x[1]))
+    else:
+        states = [(b, p, storage[b][p]) for b, p in map(split_state_key, sorted(keys))]
+    columns = edge_columns(saver.size)
+    values = np.full((len(states), len(board_tables(saver.size).positions)), np.nan)
+    for _row, (_board, _player_points, _values) in enumerate(states):
+        values[_row, columns[list(_values)]] = list(_values.values())
+    return [s[0] for s in states], [s[1] for s in states], values
+
+
+def encode_keys(boards, width):
+    return np.frombuffer(b"".join(b.to_bytes(width, "big") for b in boards), dtype=np.uint8).reshape(-1, width)
+
+
+def decode_keys(keys):
+    """
+    Boards back from a rows x width uint8 key matrix.
+    """
+    if keys.shape[1] == 8:
+        return keys.view(">u8").ravel().tolist()
+    return [int.from_bytes(k.tobytes(), "big") for k in keys]
+
+
+def key_rows(keys, key):
+    """
+    First and past-the-end rows holding key in sorted fixed-width byte string keys.
+    """
+    return int(np.searchsorted(keys, key, side="left")), int(np.searchsorted(keys, key, side="right"))
+
+
+def write_qtable(path, saver: BoardSaver, keys=None):
+    """
+    Write saver to path. The file is written next to path and renamed over it, so readers, including memory maps of
+    the previous file, never see a partial table. With keys only those states are written, see `apply_qtable`.
+    """
+    write_states(path, saver.size, *sorted_states(saver, keys))
+
+
+def write_states(path, size, boards, points, values):
+    """
+    write_qtable of the sorted states boards, points and values.
+    """
+    width = key_bytes(size)
+    temporary_path = "{}.tmp".format(path)
+    with open(temporary_path, "wb") as handle:
+        handle.write(pack_header(MAGIC, VERSION, size, width, values.shape[1], len(boards)))
+        handle.write(np.ascontiguousarray(values, dtype="<f8").tobytes())
+        handle.write(np.asarray(points, dtype="<u2").tobytes())
+        handle.write(encode_keys(boards, width).tobytes())
+    os.replace(temporary_path, path)
+
+
+def read_arrays(path, mmap=False):
+    """
+    Header, values, points and keys of a Q-table file. With mmap the arrays are read-only views of the file.
+    """
+    with open(path, "rb") as handle:
+        header = read_header(handle)
+
+    def array(dtype, offset, shape):
+        if mmap:
+            if not np.prod(shape):
+                return np.empty(shape, dtype=dtype)
+            return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape)
+        with open(path, "rb") as handle:
+            handle.seek(offset)
+            return np.fromfile(handle, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+    values = array("<f8", header.values_offset, (header.rows, header.columns))
+    points = array("<u2", header.points_offset, (header.rows,))
+    keys = array(np.uint8, header.keys_offset, (header.rows, header.key_bytes))
+    return header, values, points, keys
+
+
+def read_qtable(path, cache_size=2**16) -> BoardSaver:
+    """
+    Load a Q-table file into a `BoardSaver` with dense storage.
+    """
+    header, values, points, keys = read_arrays(path)
+
+    saver = BoardSaver(header.size, cache_size, storage=BoardSaver.STORAGE_DENSE)
+    storage = DenseStorage(header.size, capacity=0)
+    storage.values = values
+    storage.rows = {state_key(b, p): _row for _row, (b, p) in enumerate(zip(decode_keys(keys), points.tolist()))}
+    saver.boards = storage
+    return saver
+
+
+def apply_qtable(path, saver: BoardSaver):
+    """
+    Overwrite the states of saver, dense storage, with those of a Q-table file, typically a delta of changed states.
+    """
+    _, values, points, keys = read_arrays(path)
+    for _board, _player_points, _values in zip(decode_keys(keys), points.tolist(), values):
+        saver.boards.set_row(_board, _player_points, _values)
+
+
+class MappedStorage:
+    """
+    Read-only storage over a memory-mapped Q-table file. States are found by binary search over the sorted keys, so
+    opening costs nothing and only the pages of visited states become resident. Processes mapping the same file
+    share those pages.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.header, self.values, self.points, self.raw_keys = read_arrays(path, mmap=True)
+        # Fixed-width byte strings compare as the big-endian integers they hold
+        self.keys = self.raw_keys.view("S{}".format(self.header.key_bytes)).ravel()
+        self.columns = edge_columns(self.header.size)
+        self.positions = board_tables(self.header.size).positions
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+    def __len__(self):
+        return self.header.rows
+
+    def _row(self, board, player_points):
+        _first, _last = key_rows(self.keys, board.to_bytes(self.header.key_bytes, "big"))
+        _row = _first + int(np.searchsorted(self.points[_first:_last], player_points))
+        if _row < _last and self.points[_row] == player_points:
+            return _row
+        return None
+
+    def contains(self, board, player_points):
+        return self._row(board, player_points) is not None
+
+    def _values(self, board, player_points, actions):
+        _row = self._row(board, player_points)
+        if _row is None:
+            raise KeyError((board, player_points))
+        _values = self.values[_row, self.columns[actions]]
+        if np.isnan(_values).any():
+            raise KeyError(actions)
+        return _values
+
+    def value(self, board, player_points, action):
+        return float(self._values(board, player_points, action))
+
+    def action_values(self, board, player_points, actions):
+        return np.array(self._values(board, player_points, actions), dtype=np.float64)
+
+    def set_value(self, board, player_points, action, value):
+        raise Exception("Memory-mapped Q-table {} is read-only".format(self.path))
+
+    def set_action_values(self, board, player_points, actions, values):
+        raise Exception("Memory-mapped Q-table {} is read-only".format(self.path))
+
+    def items_by_state(self):
+        for _row, (_board, _player_points) in enumerate(zip(decode_keys(self.raw_keys), self.points.tolist())):
+            _defined = np.flatnonzero(~np.isnan(self.values[_row]))
+            yield _board, _player_points, {int(self.positions[c]): float(self.values[_row, c]) for c in _defined}
+
+    def copy(self):
+        return self
+
+
+def open_mapped_qtable(path, cache_size=2**16) -> BoardSaver:
+    """
+    Open a Q-table file as a read-only `BoardSaver` backed by `MappedStorage`, without loading it.
+    """
+    storage = MappedStorage(path)
+    saver = BoardSaver(storage.header.size, cache_size)
+    saver.storage = "mapped"
+    saver.boards = storage
+    return saver
+
+
+class _LegacyUnpickler(pickle.Unpickler):
+    """
+    Pickles written by src/main.py reference the modules by their top level name.
+    """
+
+    def find_class(self, module, name):
+        if module in ("learning_player", "dots_boxes"):
+            module = "{}.{}".format(__package__, module)
+            __import__(module)
+            return getattr(sys.modules[module], name)
+        return super().find_class(module, name)
+
+
+def convert_pickle(pickle_path, qtable_path):
+    """
+    Convert a pickled `BoardSaver` into the binary format. Tables from before integer keys, whose boards and actions
+    are `Board` and `Action` objects, are re-keyed on the way.
+    """
+    with open(pickle_path, "rb") as handle:
+        old_saver = _LegacyUnpickler(handle).load()
+
+    saver = BoardSaver(old_saver.size, storage=BoardSaver.STORAGE_DENSE)
+    edge_index = board_tables(old_saver.size).edge_index
+    if hasattr(old_saver.boards, "items_by_state"):
+        states = old_saver.boards.items_by_state()
+    else:
+        states = (
+            (_board.__hash__(), _player_points, {edge_index[_action.edge]: v for _action, v in _values.items()})
+            for _board, _by_points in old_saver.boards.items()
+            for _player_points, _values in _by_points.items()
+        )
+
+    for _board, _player_points, _values in states:
+        for _action, _value in _values.items():
+            saver.boards.set_value(_board, _player_points, _action, _value)
+
+    write_qtable(qtable_path, saver)
+    return saver
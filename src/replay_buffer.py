@@ -0,0 +1,212 @@
+from collections import defaultdict
+from typing import NamedTuple
+
+import numpy as np
+
+from .bitboard import board_tables, free_positions
+from .learning_player import BoardSaver, define_unknown
+
+
+class Transition(NamedTuple):
+    """
+    One agent move in canonical form. next_board is None when the move ended the episode.
+    """
+
+    board: int
+    player_points: int
+    action: int
+    reward: float
+    next_board: int | None
+    next_player_points: int
+
+
+class ReplayBatch(NamedTuple):
+    indexes: np.ndarray
+    weights: np.ndarray
+
+
+class _ReplayRing:
+    """
+    Ring bookkeeping and sampling shared by the replay buffers: rows of capacity transitions, each new one
+    overwriting the oldest once full, and their priorities.
+    With prioritized, transitions are sampled proportionally to (|TD error| + epsilon) ** priority_exponent and
+    weighted by (capacity used * probability) ** -importance_exponent, normalized to a maximum of 1. New transitions
+    get the largest priority seen so far, so they are replayed at least once soon.
+    """
+
+    def __init__(self, size, capacity, prioritized, priority_exponent, importance_exponent, epsilon, seed):
+        self.size = size
+        self.capacity = capacity
+        self.prioritized = prioritized
+        self.priority_exponent = priority_exponent
+        self.importance_exponent = importance_exponent
+        self.epsilon = epsilon
+        self.rng = np.random.default_rng(seed)
+        self.priorities = np.zeros(capacity, dtype=np.float64)
+        self._next = 0
+        self._length = 0
+        self._max_priority = 1.0
+
+    def __len__(self):
+        return self._length
+
+    def _new_rows(self, count):
+        """
+        Rows for the next count transitions, oldest overwritten first.
+        """
+        rows = (self._next + np.arange(count)) % self.capacity
+        self.priorities[rows] = self._max_priority
+        self._next = (self._next + count) % self.capacity
+        self._length = min(self._length + count, self.capacity)
+        return rows
+
+    def sample(self, batch_size) -> ReplayBatch:
+        if not self.prioritized:
+            indexes = self.rng.integers(0, self._length, size=batch_size)
+            return ReplayBatch(indexes, np.ones(batch_size))
+
+        probabilities = self.priorities[: self._length] ** self.priority_exponent
+        probabilities /= probabilities.sum()
+        indexes = self.rng.choice(self._length, size=batch_size, p=probabilities)
+        weights = (self._length * probabilities[indexes]) ** -self.importance_exponent
+        return ReplayBatch(indexes, weights / weights.max())
+
+    def update_priorities(self, indexes, td_errors):
+        priorities = np.abs(td_errors) + self.epsilon
+        self.priorities[indexes] = priorities
+        self._max_priority = max(self._max_priority, float(priorities.max()))
+
+
+class ReplayBuffer(_ReplayRing):
+    """
+    Ring buffer of canonical `Transition`s in NumPy arrays, one array per field, sampled as a `_ReplayRing`.
+    """
+
+    def __init__(
+        self,
+        size,
+        capacity=2**16,
+        prioritized=False,
+        priority_exponent=0.6,
+        importance_exponent=0.4,
+        epsilon=1e-3,
+        seed=None,
+    ):
+        super().__init__(size, capacity, prioritized, priority_exponent, importance_exponent, epsilon, seed)
+        # Boards of boards larger than 4x4 do not fit in 64 bits
+        board_dtype = np.uint64 if board_tables(size).slots <= 64 else object
+        self.boards = np.zeros(capacity, dtype=board_dtype)
+        self.player_points = np.zeros(capacity, dtype=np.uint16)
+        self.actions = np.zeros(capacity, dtype=np.intp)
+        self.rewards = np.zeros(capacity, dtype=np.float64)
+        self.next_boards = np.zeros(capacity, dtype=board_dtype)
+        self.next_player_points = np.zeros(capacity, dtype=np.uint16)
+        self.done = np.zeros(capacity, dtype=bool)
+
+    def add(self, transition: Transition):
+        _ith = self._new_rows(1)[0]
+        self.boards[_ith] = transition.board
+        self.player_points[_ith] = transition.player_points
+        self.actions[_ith] = transition.action
+        self.rewards[_ith] = transition.reward
+        self.done[_ith] = transition.next_board is None
+        self.next_boards[_ith] = 0 if transition.next_board is None else transition.next_board
+        self.next_player_points[_ith] = transition.next_player_points
+
+    def extend(self, transitions):
+        for transition in transitions:
+            self.add(transition)
+
+    def transition(self, index):
+        return Transition(
+            int(self.boards[index]),
+            int(self.player_points[index]),
+            int(self.actions[index]),
+            float(self.rewards[index]),
+            None if self.done[index] else int(self.next_boards[index]),
+            int(self.next_player_points[index]),
+        )
+
+    def replay(self, Q: BoardSaver, batch_size, alpha, gamma, init_value):
+        """
+        Sample a minibatch, apply it to Q and update the sampled priorities. Returns the TD errors.
+        """
+        batch = self.sample(batch_size)
+        td_errors = apply_batch(Q, self, batch.indexes, alpha, gamma, init_value, batch.weights)
+        if self.prioritized:
+            self.update_priorities(batch.indexes, td_errors)
+        return td_errors
+
+
+class EdgeReplayBuffer(_ReplayRing):
+    """
+    Ring buffer of `VectorDotsAndBoxes` transitions, boards as rows of edge bits indexed by position, added one step
+    of every board at a time, sampled as a `_ReplayRing`.
+    """
+
+    def __init__(
+        self,
+        size,
+        capacity=2**16,
+        prioritized=False,
+        priority_exponent=0.6,
+        importance_exponent=0.4,
+        epsilon=1e-3,
+        seed=None,
+    ):
+        super().__init__(size, capacity, prioritized, priority_exponent, importance_exponent, epsilon, seed)
+        slots = board_tables(size).slots
+        self.edges = np.zeros((capacity, slots), dtype=bool)
+        self.player_points = np.zeros(capacity, dtype=np.int32)
+        self.actions = np.zeros(capacity, dtype=np.intp)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.next_edges = np.zeros((capacity, slots), dtype=bool)
+        self.next_player_points = np.zeros(capacity, dtype=np.int32)
+        self.done = np.zeros(capacity, dtype=bool)
+
+    def add_batch(self, edges, player_points, actions, rewards, next_edges, next_player_points, done):
+        rows = self._new_rows(len(actions))
+        self.edges[rows] = edges
+        self.player_points[rows] = player_points
+        self.actions[rows] = actions
+        self.rewards[rows] = rewards
+        self.next_edges[rows] = next_edges
+        self.next_player_points[rows] = next_player_points
+        self.done[rows] = done
+
+
+def apply_batch(Q: BoardSaver, buffer: ReplayBuffer, indexes, alpha, gamma, init_value, weights=None):
+    """
+    Q-learning update for the transitions of buffer at indexes, all computed from the values before the batch.
+    Transitions are grouped per canonical state, so each state is looked up and written once with vectorized
+    values; duplicates of a (state, action) pair move it by the mean of their TD errors times their weights, so
+    importance weights still scale the step of a pair sampled once. Returns the TD errors.
+    """
+    weights = np.ones(len(indexes)) if weights is None else weights
+    actions = buffer.actions[indexes]
+    done = buffer.done[indexes]
+
+    next_values = np.zeros(len(indexes))
+    next_states = defaultdict(list)
+    _next_states = zip(buffer.next_boards[indexes].tolist(), buffer.next_player_points[indexes].tolist())
+    for _ith, _state in enumerate(_next_states):
+        if not done[_ith]:
+            next_states[_state].append(_ith)
+    for (_board, _player_points), _rows in next_states.items():
+        define_unknown(Q, _board, _player_points, init_value)
+        next_values[_rows] = Q.boards.action_values(_board, _player_points, free_positions(Q.size, _board)).max()
+    targets = buffer.rewards[indexes] + gamma * next_values
+
+    td_errors = np.empty(len(indexes))
+    states = defaultdict(list)
+    for _ith, _state in enumerate(zip(buffer.boards[indexes].tolist(), buffer.player_points[indexes].tolist())):
+        states[_state].append(_ith)
+    for (_board, _player_points), _rows in states.items():
+        define_unknown(Q, _board, _player_points, init_value)
+        _actions, _inverse = np.unique(actions[_rows], return_inverse=True)
+        _old = Q.boards.action_values(_board, _player_points, _actions)
+        _errors = targets[_rows] - _old[_inverse]
+        td_errors[_rows] = _errors
+        _steps = np.bincount(_inverse, weights=_errors * weights[_rows]) / np.bincount(_inverse)
+        Q.boards.set_action_values(_board, _player_points, _actions, _old + alpha * _steps)
+    return td_errors
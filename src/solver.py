@@ -0,0 +1,236 @@
+import time
+from typing import NamedTuple
+
+import numpy as np
+
+from .bitboard import board_tables, closed_boxes, free_positions, inverse_symmetry_permutations, state_mask
+from .dots_boxes import DotsAndBoxesState
+from .learning_player import BoardSaver, Canonicalizer
+
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+
+class TableEntry(NamedTuple):
+    value: int
+    flag: int
+    depth: int
+    move: int
+
+
+class SolveResult(NamedTuple):
+    value: int
+    exact: bool
+    depth: int
+    nodes: int
+
+
+class Solver:
+    """
+    Negamax with alpha-beta pruning over edge masks. The value of a mask is the net number of boxes the player to
+    move gets out of the boxes still open, with best play from both sides; closing a box keeps the turn.
+    Positions are stored in a transposition table of at most table_size entries keyed by the `Canonicalizer` mask,
+    so the 8 symmetric positions share one entry. Once full, the oldest entries are dropped first.
+    """
+
+    def __init__(self, size, table_size=2**22):
+        self.size = size
+        self.tables = board_tables(size)
+        self.table_size = table_size
+        self.table = {}
+        self.nodes = 0
+        self.canonicalizer = Canonicalizer(size, cache_size=0)
+        self._inverse = inverse_symmetry_permutations(size)
+
+    def _sides(self, mask, box):
+        return (mask & self.tables.box_masks[box]).bit_count()
+
+    def _open_boxes(self, mask):
+        return sum(1 for box_mask in self.tables.box_masks if mask & box_mask != box_mask)
+
+    def ordered_moves(self, mask, hint=None):
+        """
+        (position, boxes closed) for every free edge, best candidates first: the hint, captures, edges that give no
+        box a third side, then the rest.
+        A capture whose box does not lead into another 2-sided box is returned alone: taking such a box is never
+        worse than any alternative, as it cannot be part of a double-dealing decision.
+        """
+        captures, safe, unsafe = [], [], []
+        for position in self.tables.positions:
+            if mask >> position & 1:
+                continue
+            closed = closed_boxes(self.tables, mask, position)
+            if closed:
+                if all(self._sides(mask, box) != 2 for box in self.tables.edge_boxes[position]):
+                    return [(position, closed)]
+                captures.append((position, closed))
+            elif any(self._sides(mask, box) == 2 for box in self.tables.edge_boxes[position]):
+                unsafe.append((position, 0))
+            else:
+                safe.append((position, 0))
+
+        moves = captures + safe + unsafe
+        if hint is not None:
+            for _ith, move in enumerate(moves):
+                if move[0] == hint:
+                    moves.insert(0, moves.pop(_ith))
+                    break
+        return moves
+
+    def _store(self, canonical, entry):
+        if canonical not in self.table and len(self.table) >= self.table_size:
+            del self.table[next(iter(self.table))]
+        self.table[canonical] = entry
+
+    def _search(self, mask, alpha, beta, depth):
+        self.nodes += 1
+        free = self.tables.full_mask & ~mask
+        if not free or depth == 0:
+            return 0
+        depth = min(depth, free.bit_count())
+
+        canonical, symmetry = self.canonicalizer.canonical(mask)
+        entry = self.table.get(canonical)
+        hint = None
+        if entry is not None:
+            if entry.depth >= depth:
+                if entry.flag == EXACT:
+                    return entry.value
+                if entry.flag == LOWER:
+                    alpha = max(alpha, entry.value)
+                else:
+                    beta = min(beta, entry.value)
+                if alpha >= beta:
+                    return entry.value
+            hint = self._inverse[symmetry][entry.move]
+
+        open_boxes = self._open_boxes(mask)
+        if open_boxes <= alpha:
+            return open_boxes
+        if -open_boxes >= beta:
+            return -open_boxes
+
+        original_alpha = alpha
+        best, best_move = -open_boxes - 1, None
+        for position, closed in self.ordered_moves(mask, hint):
+            child = mask | 1 << position
+            if closed:
+                value = closed + self._search(child, alpha - closed, beta - closed, depth - 1)
+            else:
+                value = -self._search(child, -beta, -alpha, depth - 1)
+            if value > best:
+                best, best_move = value, position
+            alpha = max(alpha, value)
+            if alpha >= beta:
+                break
+
+        flag = UPPER if best <= original_alpha else LOWER if best >= beta else EXACT
+        canonical_move = self.canonicalizer.transform_position(symmetry, best_move)
+        self._store(canonical, TableEntry(best, flag, depth, canonical_move))
+        return best
+
+    def solve(self, mask=0, max_depth=None, time_limit=None, depth_step=6):
+        """
+        Search up to max_depth moves (the whole game by default). With a time_limit it deepens iteratively by
+        depth_step moves and returns the last iteration that finished in time; shallower iterations count open boxes
+        after the horizon as even, and fill the table with good move orderings for the next one. Without a limit
+        the table alone is faster, so it searches max_depth directly.
+        """
+        remaining = (self.tables.full_mask & ~mask).bit_count()
+        max_depth = remaining if max_depth is None else min(max_depth, remaining)
+        started = time.monotonic()
+        self.nodes = 0
+        result = SolveResult(0, remaining == 0, 0, 0)
+        depths = [max_depth]
+        if time_limit is not None:
+            depths = list(range(depth_step, max_depth, depth_step)) + depths
+        for depth in depths if max_depth > 0 else []:
+            value = self._search(mask, -self._open_boxes(mask), self._open_boxes(mask), depth)
+            result = SolveResult(value, depth == remaining, depth, self.nodes)
+            if time_limit is not None and time.monotonic() - started > time_limit:
+                break
+        return result
+
+    def action_values(self, mask):
+        """
+        Exact value of every free edge for the player to move: boxes it closes plus the value of the position after
+        it, negated when the turn passes. Keyed by edge position.
+        """
+        values = {}
+        open_boxes = self._open_boxes(mask)
+        for position in self.tables.positions:
+            if mask >> position & 1:
+                continue
+            closed = closed_boxes(self.tables, mask, position)
+            child = mask | 1 << position
+            child_value = self._search(child, -open_boxes, open_boxes, self.tables.slots)
+            values[position] = closed + child_value if closed else -child_value
+        return values
+
+    def best_action(self, mask):
+        values = self.action_values(mask)
+        return max(values, key=values.get)
+
+
+def playout_return(size, mask, player_points, position, best_action, gamma=1.0):
+    """
+    Return q_learning sees for taking position on mask, the player to move having player_points, when both players
+    follow best_action(mask) afterwards: the rewards `DotsAndBoxes.step` pays, discounted by gamma per step, until the
+    episode ends once a player holds a majority of the boxes. None if best_action has no move on the way.
+    """
+    tables = board_tables(size)
+    total_boxes = len(tables.box_masks)
+    points = [player_points, sum(1 for box_mask in tables.box_masks if mask & box_mask == box_mask) - player_points]
+    _return, discount = 0.0, 1.0
+    while True:
+        closed = closed_boxes(tables, mask, position)
+        mask |= 1 << position
+        points[0] += closed
+        reward = closed
+        # The opponent keeps the turn while it closes boxes, all within the same step
+        opponent_closed = not closed
+        while opponent_closed and mask != tables.full_mask:
+            _position = best_action(mask)
+            if _position is None:
+                return None
+            opponent_closed = closed_boxes(tables, mask, _position)
+            mask |= 1 << _position
+            points[1] += opponent_closed
+            reward -= opponent_closed
+
+        done = max(points) > total_boxes // 2 or sum(points) == total_boxes
+        if done:
+            reward += total_boxes * np.sign(points[0] - points[1])
+        _return += discount * reward
+        if done:
+            return _return
+        discount *= gamma
+        position = best_action(mask)
+        if position is None:
+            return None
+
+
+def reward_values(size, mask, player_points, positions, best_action, gamma=1.0):
+    """
+    `playout_return` of each of positions, None if any of them has none.
+    """
+    values = [playout_return(size, mask, player_points, p, best_action, gamma) for p in positions]
+    return None if None in values else np.array(values, dtype=np.float64)
+
+
+def seed_q_table(saver: BoardSaver, states, solver: Solver | None = None, gamma=1.0):
+    """
+    Define every legal action of each `DotsAndBoxesState` in states with its return when both players follow the
+    solver afterwards, see `reward_values`. With the gamma q_learning uses these are its targets against an opponent
+    playing the solver moves.
+    """
+    solver = solver if solver is not None else Solver(saver.size)
+    tables = board_tables(saver.size)
+    for state in states:
+        mask = state_mask(saver.size, state.state)
+        positions = free_positions(saver.size, mask)
+        values = reward_values(saver.size, mask, state.player_points, positions, solver.best_action, gamma)
+        for position, value in zip(positions, values.tolist()):
+            saver.define(state, tables.edges[position], value)
+    return saver
@@ -0,0 +1,288 @@
+"""
+Endgame tablebase: the exact value of every position with at most max_free free edges.
+
+Values are computed by retrograde analysis, one layer of free edges at a time: a position with k free edges only
+leads to positions with k - 1, whose values are known from the previous layer. Positions are stored once per
+symmetry class, keyed by their `Canonicalizer` mask, in a file laid out as
+
+    header   32 bytes: magic b"DBTB", version, board size, key width in bytes, max free edges, rows (little-endian)
+    values   rows int8, net boxes the player to move gets out of the open boxes with best play
+    keys     rows x key width bytes, the canonical board mask as a big-endian unsigned integer, sorted
+"""
+import multiprocessing
+import os
+import tempfile
+from typing import NamedTuple
+
+import numpy as np
+
+from .bitboard import board_tables, closed_boxes, free_positions, mask_from_edges, state_mask
+from .dots_boxes import DotsAndBoxes, DotsAndBoxesPolicy, DotsAndBoxesState
+from .learning_player import BoardSaver, Canonicalizer
+from .qtable_io import HEADER_SIZE, decode_keys, encode_keys, key_bytes, key_rows, pack_header, unpack_header
+from .solver import reward_values
+
+MAGIC = b"DBTB"
+VERSION = 1
+
+
+class TablebaseHeader(NamedTuple):
+    version: int
+    size: int
+    key_bytes: int
+    max_free: int
+    rows: int
+
+    @property
+    def values_offset(self):
+        return HEADER_SIZE
+
+    @property
+    def keys_offset(self):
+        return self.values_offset + self.rows
+
+
+def read_header(handle):
+    return TablebaseHeader(*unpack_header(handle, MAGIC, VERSION, "tablebase"))
+
+
+_layer = (None, None)
+
+
+def _load_layer(layer_file):
+    """
+    Each worker reads the previous layer once, then reuses it for every task of the same layer.
+    """
+    global _layer
+    if _layer[0] != layer_file:
+        with np.load(layer_file) as arrays:
+            _layer = (layer_file, dict(zip(decode_keys(arrays["keys"]), arrays["values"].tolist())))
+    return _layer[1]
+
+
+def _solve_masks(task):
+    """
+    Values of the canonical masks of a layer from the previous layer, and the canonical masks of the next one.
+    """
+    size, layer_file, masks = task
+    tables = board_tables(size)
+    canonicalizer = Canonicalizer(size, cache_size=0)
+    previous = _load_layer(layer_file)
+
+    values = []
+    parents = set()
+    for mask in masks:
+        best = None
+        for position in free_positions(size, mask):
+            child = mask | 1 << position
+            closed = closed_boxes(tables, mask, position)
+            _value = previous[canonicalizer.canonical(child)[0]]
+            _value = closed + _value if closed else -_value
+            best = _value if best is None else max(best, _value)
+        values.append(best)
+
+        taken = mask
+        while taken:
+            _bit = taken & -taken
+            parents.add(canonicalizer.canonical(mask ^ _bit)[0])
+            taken ^= _bit
+    return values, parents
+
+
+def write_tablebase(path, size, max_free, keys, values):
+    """
+    Write sorted keys and their values to path, through a temporary file renamed over it.
+    """
+    temporary_path = "{}.tmp".format(path)
+    with open(temporary_path, "wb") as handle:
+        handle.write(pack_header(MAGIC, VERSION, size, key_bytes(size), max_free, len(keys)))
+        handle.write(np.asarray(values, dtype=np.int8).tobytes())
+        handle.write(encode_keys(keys, key_bytes(size)).tobytes())
+    os.replace(temporary_path, path)
+
+
+def build_tablebase(path, size, max_free, workers=4, chunk_size=4096):
+    """
+    Solve every canonical position of a size board with at most max_free free edges and write them to path.
+    Each layer is split in chunks of chunk_size masks solved by a pool of workers; workers=0 solves them in the
+    calling process.
+    """
+    tables = board_tables(size)
+    max_free = min(max_free, len(tables.positions))
+    keys = [tables.full_mask]
+    values = [0]
+
+    pool = multiprocessing.Pool(workers) if workers > 0 else None
+    try:
+        with tempfile.TemporaryDirectory() as layer_directory:
+            layer = [tables.full_mask]
+            layer_values = [0]
+            canonicalizer = Canonicalizer(size, cache_size=0)
+            parents = {canonicalizer.canonical(tables.full_mask ^ 1 << p)[0] for p in tables.positions}
+            for free in range(1, max_free + 1):
+                layer_file = os.path.join(layer_directory, f"layer_{free - 1}.npz")
+                np.savez(layer_file, keys=encode_keys(layer, key_bytes(size)), values=np.array(layer_values, np.int8))
+
+                layer = sorted(parents)
+                tasks = [
+                    (size, layer_file, layer[start : start + chunk_size]) for start in range(0, len(layer), chunk_size)
+                ]
+                results = pool.imap(_solve_masks, tasks) if pool is not None else map(_solve_masks, tasks)
+
+                layer_values = []
+                parents = set()
+                for _values, _parents in results:
+                    layer_values.extend(_values)
+                    parents.update(_parents)
+                keys.extend(layer)
+                values.extend(layer_values)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    write_tablebase(path, size, max_free, [keys[i] for i in order], [values[i] for i in order])
+
+
+class Tablebase:
+    """
+    Read-only view of a tablebase file. The file is memory-mapped and positions are found by binary search over the
+    sorted keys, so opening costs nothing and worker processes share its pages.
+    """
+
+    def __init__(self, path, cache_size=2**16):
+        self.path = path
+        with open(path, "rb") as handle:
+            self.header = read_header(handle)
+        self.size = self.header.size
+        self.max_free = self.header.max_free
+        self.tables = board_tables(self.size)
+        self.canonicalizer = Canonicalizer(self.size, cache_size)
+        rows, width = self.header.rows, self.header.key_bytes
+        self.values = np.memmap(path, dtype=np.int8, mode="r", offset=self.header.values_offset, shape=(rows,))
+        raw_keys = np.memmap(path, dtype=np.uint8, mode="r", offset=self.header.keys_offset, shape=(rows, width))
+        # Fixed-width byte strings compare as the big-endian integers they hold
+        self.keys = raw_keys.view("S{}".format(self.header.key_bytes)).ravel()
+
+    def __getstate__(self):
+        return {"path": self.path, "cache_size": self.canonicalizer.cache_size}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"], state["cache_size"])
+
+    def __len__(self):
+        return self.header.rows
+
+    def covers(self, mask):
+        return (self.tables.full_mask & ~mask).bit_count() <= self.max_free
+
+    def value(self, mask):
+        """
+        Net boxes the player to move on mask gets with best play, None if mask has too many free edges or is not in
+        the file.
+        """
+        if not self.covers(mask):
+            return None
+        _row, _last = key_rows(self.keys, self.canonicalizer.canonical(mask)[0].to_bytes(self.header.key_bytes, "big"))
+        return int(self.values[_row]) if _row < _last else None
+
+    def action_values(self, mask):
+        """
+        Exact value of every free edge position of mask for the player to move, None if mask is not covered.
+        """
+        if not self.covers(mask):
+            return None
+        values = {}
+        for position in free_positions(self.size, mask):
+            closed = closed_boxes(self.tables, mask, position)
+            _value = self.value(mask | 1 << position)
+            if _value is None:
+                return None
+            values[position] = closed + _value if closed else -_value
+        return values
+
+    def best_action(self, mask):
+        values = self.action_values(mask)
+        return None if values is None else max(values, key=values.get)
+
+
+class DotsAndBoxesTablebasePolicy(DotsAndBoxesPolicy):
+    """
+    Plays the tablebase move once the board is covered by it, and defers to policy before that.
+    """
+
+    def __init__(self, tablebase: Tablebase, policy: DotsAndBoxesPolicy):
+        super().__init__(policy._q_value_function)
+        self.tablebase = tablebase
+        self.policy = policy
+
+    def attach(self, env):
+        super().attach(env)
+        self.policy.attach(env)
+
+    def update_q_value_function(self, q_value_function):
+        self._q_value_function = q_value_function
+        self.policy._q_value_function = q_value_function
+
+    def next_action(self, state, action_space):
+        if self._attached(action_space) and self._env.engine == DotsAndBoxes.ENGINE_BITBOARD:
+            mask = self._env.edges
+        else:
+            mask = self.tablebase.tables.full_mask & ~mask_from_edges(self.tablebase.size, action_space)
+
+        position = self.tablebase.best_action(mask) if self.tablebase.covers(mask) else None
+        if position is None:
+            return self.policy.next_action(state, action_space)
+        return self.tablebase.tables.edges[position]
+
+
+class TablebaseBoardSaver:
+    """
+    `BoardSaver` that answers endgame states from a tablebase and every other state from saver. Endgame values are
+    the returns q_learning with gamma sees when both players follow the tablebase, see `reward_values`.
+    Definitions of endgame states are dropped, so learning only has to cover the rest of the game.
+    """
+
+    def __init__(self, saver: BoardSaver, tablebase: Tablebase, gamma=1.0):
+        assert saver.size == tablebase.size, "Tablebase is for size {}".format(tablebase.size)
+        self.saver = saver
+        self.tablebase = tablebase
+        self.gamma = gamma
+
+    def __getattr__(self, name):
+        if name in ("saver", "tablebase", "gamma"):
+            raise AttributeError(name)
+        return getattr(self.saver, name)
+
+    def _endgame_values(self, state: DotsAndBoxesState, actions):
+        mask = state_mask(self.saver.size, state.state)
+        if not self.tablebase.covers(mask):
+            return None
+        edge_index = self.tablebase.tables.edge_index
+        positions = [edge_index[a] for a in actions]
+        return reward_values(
+            self.saver.size, mask, state.player_points, positions, self.tablebase.best_action, self.gamma
+        )
+
+    def copy(self):
+        return TablebaseBoardSaver(self.saver.copy(), self.tablebase, self.gamma)
+
+    def contains(self, state: DotsAndBoxesState):
+        return self.tablebase.covers(state_mask(self.saver.size, state.state)) or self.saver.contains(state)
+
+    def get(self, state: DotsAndBoxesState, action):
+        _values = self._endgame_values(state, [action])
+        return self.saver.get(state, action) if _values is None else float(_values[0])
+
+    def get_all(self, state: DotsAndBoxesState, actions):
+        _values = self._endgame_values(state, actions)
+        return self.saver.get_all(state, actions) if _values is None else _values
+
+    def argmax(self, state: DotsAndBoxesState, actions):
+        actions = list(actions)
+        return actions[int(np.argmax(self.get_all(state, actions)))]
+
+    def define(self, state: DotsAndBoxesState, action, value):
+        if not self.tablebase.covers(state_mask(self.saver.size, state.state)):
+            self.saver.define(state, action, value)
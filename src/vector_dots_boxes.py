@@ -0,0 +1,141 @@
+from typing import NamedTuple
+
+import numpy as np
+
+from .bitboard import board_tables
+from .dots_boxes import DotsAndBoxesPolicy, DotsAndBoxesState
+
+
+class VectorObservation(NamedTuple):
+    edges: np.ndarray
+    player_points: np.ndarray
+
+
+class VectorDotsAndBoxes:
+    """
+    N independent `DotsAndBoxes` games stepped together. Boards are rows of a boolean matrix indexed by edge position
+    (see `board_tables`) plus a matrix of side counts per box. Actions are edge positions, one per board.
+    Boards whose episode ends are reset inside `step`; the observation of the finished episode is kept in
+    info["final_observation"].
+    """
+
+    def __init__(self, num_envs, size=3, policy: DotsAndBoxesPolicy | None = None, seed=None):
+        self.num_envs = num_envs
+        self.size = size
+        self.policy = policy
+        self.rng = np.random.default_rng(seed)
+        self.tables = board_tables(size)
+
+        self.valid_edges = np.zeros(self.tables.slots, dtype=bool)
+        self.valid_edges[list(self.tables.positions)] = True
+        self.edge_boxes = np.full((self.tables.slots, 2), -1, dtype=np.intp)
+        for position, boxes in enumerate(self.tables.edge_boxes):
+            self.edge_boxes[position, : len(boxes)] = boxes
+        self.box_edges = np.array(self.tables.box_edges, dtype=np.intp).reshape(-1, 4)
+
+        total_boxes = size * size
+        self.edges = np.zeros((num_envs, self.tables.slots), dtype=bool)
+        self.box_sides = np.zeros((num_envs, total_boxes), dtype=np.int8)
+        self.box_owner = np.zeros((num_envs, total_boxes), dtype=np.int8)
+        self.points = np.zeros((num_envs, 3), dtype=np.int32)
+
+    def legal_actions(self):
+        """
+        Boolean matrix of free edges, one row per board.
+        """
+        return self.valid_edges & ~self.edges
+
+    def state(self, index):
+        """
+        Board index as a `DotsAndBoxes` observation and action space, for policies without a batched implementation.
+        """
+        edges = self.tables.edges
+        taken = [edges[p] for p in self.tables.positions if self.edges[index, p]]
+        free = set(edges[p] for p in self.tables.positions if not self.edges[index, p])
+        return DotsAndBoxesState(state=taken, player_points=int(self.points[index, 1])), free
+
+    def _observation(self):
+        return VectorObservation(edges=self.edges.copy(), player_points=self.points[:, 1].copy())
+
+    def reset(self):
+        self._reset(np.arange(self.num_envs))
+        return self._observation()
+
+    def _reset(self, indexes):
+        self.edges[indexes] = False
+        self.box_sides[indexes] = 0
+        self.box_owner[indexes] = 0
+        self.points[indexes] = 0
+
+        starts = indexes[self.rng.random(len(indexes)) < 0.5]
+        self._player2(starts)
+
+    def _pick(self, indexes, actions, player):
+        """
+        Take one edge on each board of indexes and return which of them closed at least one box.
+        """
+        assert self.valid_edges[actions].all(), "Invalid edge"
+        assert not self.edges[indexes, actions].any(), "The edge already exists"
+        self.edges[indexes, actions] = True
+
+        boxes = self.edge_boxes[actions]
+        touched = boxes >= 0
+        rows = np.broadcast_to(indexes[:, None], boxes.shape)
+        np.add.at(self.box_sides, (rows, boxes), touched.astype(np.int8))
+
+        closed = touched & (self.box_sides[rows, boxes] == 4)
+        self.box_owner[rows[closed], boxes[closed]] = player
+        new_points = closed.sum(axis=1)
+        self.points[indexes, player] += new_points
+        return new_points > 0
+
+    def _player2(self, indexes):
+        pending = indexes
+        while len(pending) > 0:
+            pending = pending[self.legal_actions()[pending].any(axis=1)]
+            if len(pending) == 0:
+                break
+            actions = self.policy.next_actions(self, pending)
+            pending = pending[self._pick(pending, actions, 2)]
+
+    def step(self, actions):
+        """Executes one action on every board
+
+        Args:
+            actions: An array with an edge position per board
+        Returns:
+            observation (VectorObservation): edges and player 1 points of every board, after automatic resets
+            info (dict): the `DotsAndBoxes.step` info entries as arrays, plus "final_observation"
+        """
+        actions = np.asarray(actions, dtype=np.intp)
+        indexes = np.arange(self.num_envs)
+        old_points = self.points.copy()
+
+        closed = self._pick(indexes, actions, 1)
+        self._player2(indexes[~closed])
+
+        player_1_points = self.points[:, 1].copy()
+        player_2_points = self.points[:, 2].copy()
+        new_player_1_points = player_1_points - old_points[:, 1]
+        new_player_2_points = player_2_points - old_points[:, 2]
+
+        total_boxes = self.size * self.size
+        done = (np.maximum(player_1_points, player_2_points) > total_boxes // 2) | (
+            player_1_points + player_2_points == total_boxes
+        )
+
+        reward = new_player_1_points - new_player_2_points
+        reward += np.where(done, np.sign(player_1_points - player_2_points) * total_boxes, 0)
+
+        info = {
+            "player_1_points": player_1_points,
+            "player_2_points": player_2_points,
+            "new_player_1_points": new_player_1_points,
+            "new_player_2_points": new_player_2_points,
+            "reward": reward,
+            "done": done,
+            "final_observation": self._observation(),
+        }
+
+        self._reset(indexes[done])
+        return self._observation(), info
@@ -0,0 +1,56 @@
+import numpy as np
+
+from src.augmentation import RECTANGLE_SYMMETRIES, SymmetryAugmenter
+from src.bitboard import board_tables, permute_mask, symmetry_byte_tables
+from src.learning_player import Canonicalizer
+
+
+def mask(row):
+    return sum(1 << int(p) for p in np.flatnonzero(row))
+
+
+def random_pairs(size, count, seed):
+    tables = board_tables(size)
+    rng = np.random.default_rng(seed)
+    states = np.zeros((count, tables.slots), dtype=bool)
+    for row in states:
+        row[rng.choice(tables.positions, 2 * size, replace=False)] = True
+    actions = np.array([next(p for p in tables.positions if not row[p]) for row in states])
+    return states, actions
+
+
+class TestSymmetryAugmenter:
+    def test_matches_canonicalizer_symmetries(self):
+        size = 3
+        states, actions = random_pairs(size, 5, seed=0)
+        augmented_states, augmented_actions = SymmetryAugmenter(size).augment(states, actions)
+        assert augmented_states.shape == (8 * 5, board_tables(size).slots)
+
+        canonicalizer = Canonicalizer(size)
+        byte_tables = symmetry_byte_tables(size)
+        for symmetry in range(8):
+            for _ith in range(5):
+                row = symmetry * 5 + _ith
+                assert mask(augmented_states[row]) == permute_mask(byte_tables[symmetry], mask(states[_ith]))
+                assert augmented_actions[row] == canonicalizer.transform_position(symmetry, actions[_ith])
+                assert not augmented_states[row, augmented_actions[row]]
+
+    def test_transform_and_subsets(self):
+        size = 4
+        states, actions = random_pairs(size, 6, seed=1)
+        augmenter = SymmetryAugmenter(size, RECTANGLE_SYMMETRIES)
+        augmented_states, augmented_actions = augmenter.augment(states, actions)
+        assert len(augmented_states) == 4 * 6
+
+        symmetries = np.array([0, 1, 2, 3, 2, 1])
+        transformed_states, transformed_actions = augmenter.transform(states, actions, symmetries)
+        rows = symmetries * 6 + np.arange(6)
+        assert (transformed_states == augmented_states[rows]).all()
+        assert (transformed_actions == augmented_actions[rows]).all()
+
+        # A next state moves with the symmetry of its transition, the action it followed played on it
+        next_states = states.copy()
+        next_states[np.arange(6), actions] = True
+        transformed_next_states = augmenter.transform_states(next_states, symmetries)
+        assert transformed_next_states[np.arange(6), transformed_actions].all()
+        assert (transformed_next_states ^ transformed_states).sum() == 6
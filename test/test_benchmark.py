@@ -0,0 +1,29 @@
+from src.benchmark import compare, random_states, run
+
+
+class TestBenchmark:
+    def test_run_covers_every_benchmark(self):
+        report = run(sizes=(2, 3), scale=0.01, repeats=1)
+        names = {(result["benchmark"], result["size"]) for result in report["results"]}
+        for size in (2, 3):
+            for name in (
+                "env_step",
+                "env_reset",
+                "board_saver_contains",
+                "board_saver_define",
+                "board_saver_get",
+                "canonical_rotations",
+                "canonical_canonicalizer",
+                "q_learning",
+                "memory",
+            ):
+                assert (name, size) in names
+        assert all(result["operations"] > 0 for result in report["results"])
+        assert all(result["peak_bytes_per_million"] > 0 for result in report["results"] if "memory" in result.values())
+
+        ratios = compare(report, report)
+        assert len(ratios) == len(report["results"]) and all(ratio == 1 for _, ratio in ratios)
+
+    def test_random_states_are_seeded(self):
+        assert random_states(4, 100, seed=1) == random_states(4, 100, seed=1)
+        assert random_states(4, 100, seed=1) != random_states(4, 100, seed=2)
@@ -0,0 +1,68 @@
+import random
+
+import pytest
+
+from src.bitboard import board_tables
+from src.chain_policy import ChainAnalysis, DotsAndBoxesChainPolicy
+from src.dots_boxes import DotsAndBoxes, DotsAndBoxesCloseBoxesPolicy, DotsAndBoxesState
+
+
+def chain_set(analysis):
+    return {(frozenset(c.boxes), c.loop) for c in analysis.chains()}
+
+
+class TestChainAnalysis:
+    def test_incremental_matches_fresh_analysis(self):
+        rng = random.Random(0)
+        size = 4
+        positions = list(board_tables(size).positions)
+        incremental = ChainAnalysis(size)
+        for _ in range(20):
+            rng.shuffle(positions)
+            incremental.reset()
+            mask = 0
+            for position in positions[: rng.randint(10, len(positions))]:
+                mask |= 1 << position
+                incremental.sync(mask)
+                incremental.chains()
+
+                fresh = ChainAnalysis(size)
+                fresh.sync(mask)
+                assert chain_set(incremental) == chain_set(fresh)
+                assert incremental.safe == fresh.safe
+
+    def test_loop(self):
+        size = 2
+        tables = board_tables(size)
+        # Every border edge taken: the four boxes form a loop through the inner edges
+        border = [p for p in tables.positions if len(tables.edge_boxes[p]) == 1]
+        analysis = ChainAnalysis(size)
+        analysis.sync(sum(1 << p for p in border))
+        assert chain_set(analysis) == {(frozenset(range(4)), True)}
+        assert not analysis.safe
+
+
+class TestDotsAndBoxesChainPolicy:
+    def test_beats_greedy_policy(self):
+        random.seed(0)
+        env = DotsAndBoxes(3, DotsAndBoxesCloseBoxesPolicy(None), engine=DotsAndBoxes.ENGINE_BITBOARD)
+        player = DotsAndBoxesChainPolicy()
+        wins = 0
+        for _ in range(100):
+            state = env.reset()
+            done = False
+            while not done:
+                state, info = env.step(player.next_action(state, set(env.action_spaces)))
+                done = info["done"]
+            wins += info["player_1_points"] > info["player_2_points"]
+        assert wins > 70
+
+    def test_detached_board_size(self):
+        tables = board_tables(2)
+        taken = [tables.edges[p] for p in tables.positions[:3]]
+        free = {tables.edges[p] for p in tables.positions[3:]}
+        player = DotsAndBoxesChainPolicy()
+        assert player.next_action(DotsAndBoxesState(taken, 0), free) in free
+
+        with pytest.raises(AssertionError):
+            player.next_action(DotsAndBoxesState(sum(1 << p for p in tables.positions[:3]), 0), free)
@@ -0,0 +1,163 @@
+import os
+import random
+import threading
+
+import pytest
+
+from src import main
+from src.benchmark import random_states
+from src.checkpoint import SNAPSHOT_COPY, SNAPSHOT_FORK, CheckpointManager
+from src.dots_boxes import DotsAndBoxesState
+from src.learning_player import BoardSaver
+from src.metrics import MetricsRecorder, RingBufferSink
+from src.qtable_io import open_mapped_qtable, read_qtable
+
+
+def saver_with(value, storage=BoardSaver.STORAGE_DICT):
+    saver = BoardSaver(2, storage=storage)
+    saver.define(DotsAndBoxesState([((0, 0), (0, 1))], 0), ((1, 0), (1, 1)), value)
+    return saver
+
+
+def stored_value(path):
+    return read_qtable(path).get(DotsAndBoxesState([((0, 0), (0, 1))], 0), ((1, 0), (1, 1)))
+
+
+def table(saver):
+    return sorted((board, points, sorted(values.items())) for board, points, values in saver.boards.items_by_state())
+
+
+class TestCheckpointManager:
+    @pytest.mark.parametrize("snapshot", [SNAPSHOT_FORK, SNAPSHOT_COPY])
+    def test_keeps_last_checkpoints(self, tmp_path, snapshot):
+        checkpoints = CheckpointManager(str(tmp_path), prefix="q", keep=2, snapshot=snapshot)
+        assert checkpoints.latest() is None
+        for value in range(4):
+            assert checkpoints.save(saver_with(float(value)))
+            checkpoints.wait()
+
+        assert [os.path.basename(p) for p in checkpoints.checkpoints()] == ["q.000002.qtable", "q.000003.qtable"]
+        assert stored_value(checkpoints.latest()) == 3.0
+        assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+        # Numbering goes on from the files of a previous run
+        resumed = CheckpointManager(str(tmp_path), prefix="q", keep=2, snapshot=snapshot)
+        resumed.save(saver_with(4.0))
+        resumed.wait()
+        assert resumed.latest().endswith("q.000004.qtable")
+
+    @pytest.mark.parametrize("snapshot", [SNAPSHOT_FORK, SNAPSHOT_COPY])
+    def test_snapshot_is_taken_at_save(self, tmp_path, snapshot):
+        checkpoints = CheckpointManager(str(tmp_path), snapshot=snapshot)
+        saver = saver_with(1.0, BoardSaver.STORAGE_DENSE)
+        checkpoints.save(saver)
+        saver.define(DotsAndBoxesState([((0, 0), (0, 1))], 0), ((1, 0), (1, 1)), 2.0)
+        checkpoints.wait()
+        assert stored_value(checkpoints.latest()) == 1.0
+
+    def test_no_fork_with_other_threads(self, tmp_path):
+        checkpoints = CheckpointManager(str(tmp_path), snapshot=SNAPSHOT_FORK)
+        stop = threading.Event()
+        thread = threading.Thread(target=stop.wait)
+        thread.start()
+        try:
+            assert checkpoints.save(saver_with(1.0))
+            assert checkpoints._pid is None
+        finally:
+            stop.set()
+            thread.join()
+        checkpoints.wait()
+        assert stored_value(checkpoints.latest()) == 1.0
+
+    def test_fork_with_paused_metrics(self, tmp_path):
+        checkpoints = CheckpointManager(str(tmp_path), snapshot=SNAPSHOT_FORK)
+        sink = RingBufferSink()
+        recorder = MetricsRecorder(sink, batch_size=1)
+        recorder.record(1)
+        with recorder.paused():
+            assert checkpoints.save(saver_with(1.0))
+            assert checkpoints._pid is not None
+            recorder.record(2)
+        recorder.record(3)
+        recorder.close()
+        checkpoints.wait()
+        assert stored_value(checkpoints.latest()) == 1.0
+        assert sink.records() == [1, 2, 3]
+
+    def test_skipped_and_blocking_saves(self, tmp_path, caplog):
+        checkpoints = CheckpointManager(str(tmp_path), snapshot=SNAPSHOT_COPY)
+        checkpoints.busy = lambda: True
+        assert not checkpoints.save(saver_with(1.0))
+        assert "skipping" in caplog.text and checkpoints.latest() is None
+
+        assert checkpoints.save(saver_with(1.0), block=True)
+        assert checkpoints.save(saver_with(2.0), block=True)
+        checkpoints.wait()
+        assert stored_value(checkpoints.latest()) == 2.0
+
+    @pytest.mark.parametrize("snapshot", [SNAPSHOT_FORK, SNAPSHOT_COPY])
+    def test_failed_checkpoint_raises(self, tmp_path, snapshot):
+        checkpoints = CheckpointManager(str(tmp_path), snapshot=snapshot)
+        saver = saver_with(1.0)
+        saver.boards = None
+        if snapshot == SNAPSHOT_COPY:
+            saver.copy = lambda: saver
+        checkpoints.save(saver)
+        with pytest.raises(Exception):
+            checkpoints.wait()
+        assert checkpoints.latest() is None
+
+    @pytest.mark.parametrize("snapshot", [SNAPSHOT_FORK, SNAPSHOT_COPY])
+    @pytest.mark.parametrize("storage", [BoardSaver.STORAGE_DICT, BoardSaver.STORAGE_DENSE])
+    def test_deltas_replay_onto_base(self, tmp_path, snapshot, storage):
+        checkpoints = CheckpointManager(str(tmp_path), prefix="q", keep=1, snapshot=snapshot, compact_every=2)
+        rng = random.Random(0)
+        saver = BoardSaver(3, storage=storage)
+        states = random_states(3, 200, seed=0)
+        for _round in range(5):
+            round_states = rng.sample(states, 20)
+            for state, actions in round_states:
+                saver.define(state, actions[0], rng.random())
+            written = len({(saver.canonical(state)[0], state.player_points) for state, _ in round_states})
+            checkpoints.save(saver)
+            checkpoints.wait()
+            # Every save starts the changes of the next delta afresh
+            assert saver.take_changes() == set()
+
+            assert table(checkpoints.load()) == table(saver)
+            if _round % 3:
+                # A delta holds only the states changed in the round
+                assert len(read_qtable(checkpoints.deltas(_round // 3)[-1]).boards) == written
+
+        # Rounds 0 and 3 wrote bases, the first one went with its deltas
+        names = sorted(os.listdir(tmp_path))
+        assert names == ["q.000001.000001.delta", "q.000001.qtable"]
+
+        checkpoints.compact()
+        assert sorted(os.listdir(tmp_path)) == ["q.000002.qtable"]
+        assert table(read_qtable(checkpoints.latest())) == table(saver)
+
+    def test_train_maps_previous_round(self, tmp_path, monkeypatch):
+        random.seed(0)
+        Q = BoardSaver(2, storage=BoardSaver.STORAGE_DENSE)
+        opponents = []
+
+        def mapped(path, cache_size=2**16):
+            saver = open_mapped_qtable(path, cache_size)
+            opponents.append((len(saver.boards), table(saver) == table(Q)))
+            return saver
+
+        def copy(saver):
+            raise AssertionError("Q-table copied")
+
+        monkeypatch.setattr(main, "open_mapped_qtable", mapped)
+        monkeypatch.setattr(BoardSaver, "copy", copy)
+        checkpoints = CheckpointManager(str(tmp_path), prefix="q", compact_every=10)
+        recorder = MetricsRecorder(RingBufferSink())
+        trained = main.train(2, str(tmp_path / "q.qtable"), Q, checkpoints, recorder, rounds=3, episodes=20)
+        recorder.close()
+
+        assert trained is Q
+        assert [same for _, same in opponents] == [True] * 3
+        assert opponents[0][0] == 0 < opponents[1][0] < opponents[2][0]
+        assert table(read_qtable(checkpoints.latest())) == table(Q)
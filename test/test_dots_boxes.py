@@ -0,0 +1,124 @@
+import random
+
+import pytest
+
+from src.bitboard import mask_from_edges
+from src.dots_boxes import DotsAndBoxes, DotsAndBoxesCloseBoxesPolicy
+from src.learning_player import BoardSaver
+
+
+def play_episodes(engine, size, episodes, seed, observation=DotsAndBoxes.OBSERVATION_EDGES):
+    random.seed(seed)
+    env = DotsAndBoxes(size, DotsAndBoxesCloseBoxesPolicy(None), engine=engine, observation=observation)
+    player = random.Random(seed)
+    history = []
+    for _ in range(episodes):
+        observation = env.reset()
+        history.append((to_mask(size, observation.state), observation.player_points))
+        done = False
+        while not done:
+            action = player.choice(sorted(env.action_spaces))
+            observation, info = env.step(action)
+            done = info["done"]
+            history.append((to_mask(size, observation.state), observation.player_points, info))
+    return history
+
+
+def to_mask(size, state):
+    return state if isinstance(state, int) else mask_from_edges(size, state)
+
+
+class TestDotsAndBoxes:
+    def test_engines_are_equivalent(self):
+        for size in (2, 3, 4):
+            graph = play_episodes(DotsAndBoxes.ENGINE_GRAPH, size, 20, seed=size)
+            bitboard = play_episodes(DotsAndBoxes.ENGINE_BITBOARD, size, 20, seed=size)
+            assert graph == bitboard
+
+    def test_mask_observation(self):
+        for engine in (DotsAndBoxes.ENGINE_GRAPH, DotsAndBoxes.ENGINE_BITBOARD):
+            edges = play_episodes(engine, 3, 10, seed=7)
+            masks = play_episodes(engine, 3, 10, seed=7, observation=DotsAndBoxes.OBSERVATION_MASK)
+            assert edges == masks
+
+        random.seed(0)
+        env = DotsAndBoxes(3, DotsAndBoxesCloseBoxesPolicy(None), observation=DotsAndBoxes.OBSERVATION_MASK)
+        state, _ = env.step(sorted(env.action_spaces)[0])
+        assert isinstance(state.state, int) and len({state, state}) == 1
+        assert [p for p, taken in enumerate(env.edge_array()) if taken] == [
+            p for p in env._tables.positions if state.state >> p & 1
+        ]
+
+        saver = BoardSaver(3)
+        action = sorted(env.action_spaces)[0]
+        saver.define(state, action, 1.5)
+        edges_state = state._replace(state=env._taken_edges())
+        assert saver.contains(edges_state) and saver.get(edges_state, action) == 1.5
+
+    def test_bitboard_reset_clears_board(self):
+        random.seed(0)
+        env = DotsAndBoxes(2, DotsAndBoxesCloseBoxesPolicy(None), engine=DotsAndBoxes.ENGINE_BITBOARD)
+        done = False
+        while not done:
+            _, info = env.step(sorted(env.action_spaces)[0])
+            done = info["done"]
+
+        random.seed(1)
+        env.reset()
+        assert len(env.action_spaces) + bin(env.edges).count("1") == 12
+        taken = [p for p in env._tables.positions if env.edges >> p & 1]
+        assert sum(env.box_sides) == sum(len(env._tables.edge_boxes[p]) for p in taken)
+
+    def test_completed_boxes_match_points(self):
+        for engine in (DotsAndBoxes.ENGINE_GRAPH, DotsAndBoxes.ENGINE_BITBOARD):
+            random.seed(3)
+            env = DotsAndBoxes(3, DotsAndBoxesCloseBoxesPolicy(None), engine=engine)
+            done = False
+            while not done:
+                _, info = env.step(sorted(env.action_spaces)[-1])
+                done = info["done"]
+
+            for player in (1, 2):
+                closed = [position for p, position in env.completed_boxes if p == player]
+                assert len(closed) == info["player_{}_points".format(player)]
+                controllers = dict(env._box_controllers())
+                assert all(controllers[position] == player for position in closed)
+
+    def test_attached_greedy_policy_closes_boxes(self):
+        for engine in (DotsAndBoxes.ENGINE_GRAPH, DotsAndBoxes.ENGINE_BITBOARD):
+            random.seed(5)
+            policy = DotsAndBoxesCloseBoxesPolicy(None)
+            env = DotsAndBoxes(3, policy, engine=engine)
+            closed = 0
+            for _ in range(300):
+                if not env.action_spaces:
+                    env.reset()
+                    continue
+                three_sided = any(env._box_side_count(box) == 3 for box in range(9))
+                action = policy.next_action(None, env.action_spaces)
+                assert env._player_pick(1, action) or not three_sided
+                closed += three_sided
+            assert closed > 0
+
+    def test_index_actions(self):
+        for engine in (DotsAndBoxes.ENGINE_GRAPH, DotsAndBoxes.ENGINE_BITBOARD):
+            random.seed(11)
+            env = DotsAndBoxes(3, DotsAndBoxesCloseBoxesPolicy(None), engine=engine, actions=DotsAndBoxes.ACTIONS_INDEX)
+            assert env.action_space.n == env._tables.slots
+            for invalid in (-1, env._tables.slots, env._tables.slots - 1):
+                with pytest.raises(AssertionError):
+                    env.step(invalid)
+            _, info = env.reset()
+            legal = info["legal_mask"]
+            assert legal == env.legal_mask()
+            assert list(info["action_mask"].nonzero()[0]) == [p for p in range(env._tables.slots) if legal >> p & 1]
+            done = False
+            while not done:
+                action = (legal & -legal).bit_length() - 1
+                assert env.action_space.contains(action) and env._tables.edges[action] in env.action_spaces
+                _, info = env.step(action)
+                done = info["done"]
+                legal = info["legal_mask"]
+                positions = [p for p in range(env._tables.slots) if legal >> p & 1]
+                assert done or set(positions) == {env._tables.edge_index[e] for e in env.action_spaces}
+                assert list(info["action_mask"].nonzero()[0]) == positions
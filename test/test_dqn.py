@@ -0,0 +1,58 @@
+import random
+
+import numpy as np
+
+from src.dots_boxes import DotsAndBoxes, DotsAndBoxesMaxIfKnownPolicy, DotsAndBoxesRandomPolicy
+from src.dqn import MLP, DeepQFunction, DotsAndBoxesDQNPolicy, deep_q_learning
+from src.vector_dots_boxes import VectorDotsAndBoxes
+
+
+class TestMLP:
+    def test_gradient(self):
+        rng = np.random.default_rng(0)
+        network = MLP([5, 7, 3], seed=0)
+        x = rng.standard_normal((4, 5)).astype(np.float32)
+        columns = np.array([0, 2, 1, 2])
+        targets = (rng.standard_normal(4) * 0.1).astype(np.float32)
+
+        def loss(n):
+            return np.mean(0.5 * (n.predict(x)[np.arange(4), columns] - targets) ** 2)
+
+        moved = network.copy()
+        moved.weights[0][1, 2] += 1e-3
+        numeric = (loss(moved) - loss(network)) / 1e-3
+        stepped = network.copy()
+        stepped.sgd_step(x, columns, targets, learning_rate=1e-3, huber_delta=100)
+        # The first Adam step moves every parameter by the learning rate against the sign of its gradient
+        assert np.sign(network.weights[0][1, 2] - stepped.weights[0][1, 2]) == np.sign(numeric)
+
+    def test_fits_targets(self):
+        Q = DeepQFunction(2, hidden=(32,), learning_rate=1e-2, seed=0)
+        edges = np.zeros((2, Q.tables.slots), dtype=bool)
+        edges[:, Q.positions[:3]] = True
+        actions = Q.positions[[5, 7]]
+        for _ in range(300):
+            Q.train_batch(edges, [0, 0], actions, np.array([1.0, -1.0]), edges, [0, 0], np.array([True, True]), 0.9)
+        assert np.allclose(Q.q_values(edges[:1], [0])[0, actions], [1.0, -1.0], atol=0.05)
+
+
+class TestDeepQFunction:
+    def test_plugs_into_policies(self):
+        random.seed(0)
+        Q = deep_q_learning(2, 20, num_envs=8, batch_size=16, target_interval=10)
+        env = DotsAndBoxes(2, DotsAndBoxesMaxIfKnownPolicy(Q))
+        state = env.reset()
+        action = Q.argmax(state, env.action_spaces)
+        assert action in env.action_spaces
+        assert Q.get(state, action) == max(Q.get_all(state, env.action_spaces))
+
+        done = False
+        while not done:
+            _, info = env.step(DotsAndBoxesRandomPolicy(None).next_action(None, env.action_spaces))
+            done = info["done"]
+
+        vector_env = VectorDotsAndBoxes(16, 2, DotsAndBoxesDQNPolicy(Q), seed=0)
+        vector_env.reset()
+        for _ in range(10):
+            legal = vector_env.legal_actions()
+            vector_env.step(np.argmax(legal, axis=1))
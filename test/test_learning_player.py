@@ -1,4 +1,10 @@
-from src.learning_player import BoardSaver, Rotator, Board
+import pickle
+import random
+
+import pytest
+
+from src.bitboard import board_tables, mask_from_edges
+from src.learning_player import BoardSaver, Rotator, Board, Canonicalizer
 from src.dots_boxes import DotsAndBoxesState
 
 
@@ -50,6 +56,50 @@ class TestBoardSaver:
             assert bs.contains(DotsAndBoxesState(s, 0))
             assert bs.get(DotsAndBoxesState(s, 0), a) == 1
 
+    def test_dense_storage(self):
+        size = 2
+        tables = board_tables(size)
+        edges = [tables.edges[p] for p in tables.positions]
+        rng = random.Random(1)
+        dict_saver = BoardSaver(size)
+        dense_saver = BoardSaver(size, storage=BoardSaver.STORAGE_DENSE)
+        for _ in range(3000):
+            state = DotsAndBoxesState(rng.sample(edges, rng.randint(0, 4)), rng.randint(0, 1))
+            action = rng.choice(edges)
+            value = rng.random()
+            dict_saver.define(state, action, value)
+            dense_saver.define(state, action, value)
+
+        dense_saver = pickle.loads(pickle.dumps(dense_saver)).copy()
+        assert len(dense_saver.boards) == sum(len(by_points) for by_points in dict_saver.boards.values())
+        assert len(dict_saver.boards) == len(dense_saver.boards)
+        assert len(pickle.loads(pickle.dumps(dict_saver)).copy().boards) == len(dense_saver.boards)
+        for board, player_points, values in dict_saver.boards.items_by_state():
+            for action, value in values.items():
+                assert dense_saver.boards.value(board, player_points, action) == value
+
+        with pytest.raises(KeyError):
+            dense_saver.get(DotsAndBoxesState([], 5), edges[0])
+
+    def test_get_all_and_argmax(self):
+        size = 2
+        tables = board_tables(size)
+        edges = [tables.edges[p] for p in tables.positions]
+        state = DotsAndBoxesState([((0, 1), (1, 1)), ((2, 1), (2, 2))], 0)
+        rotated_state = DotsAndBoxesState([((1, 0), (2, 0)), ((1, 1), (1, 2))], 0)
+        actions = [e for e in edges if e not in state.state]
+        rotated_actions = [e for e in edges if e not in rotated_state.state]
+
+        for storage in (BoardSaver.STORAGE_DICT, BoardSaver.STORAGE_DENSE):
+            bs = BoardSaver(size, storage=storage)
+            for i, action in enumerate(actions):
+                bs.define(state, action, i % 3)
+
+            expected = [bs.get(rotated_state, a) for a in rotated_actions]
+            assert list(bs.get_all(rotated_state, rotated_actions)) == expected
+            best = max(rotated_actions, key=lambda a: bs.get(rotated_state, a))
+            assert bs.argmax(rotated_state, rotated_actions) == best
+
 
 class TestRotator:
     def test_action_rotation(self):
@@ -86,3 +136,29 @@ class TestRotator:
 
         for e, r in cases:
             assert rotator.reflect_edge(e) == r
+
+
+class TestCanonicalizer:
+    def test_matches_board_rotations(self):
+        rng = random.Random(0)
+        for size in (2, 3, 5):
+            rotator = Rotator(size)
+            canonicalizer = Canonicalizer(size)
+            tables = board_tables(size)
+            edges = [tables.edges[p] for p in tables.positions]
+            for _ in range(50):
+                state = rng.sample(edges, rng.randint(0, len(edges)))
+                rotations = [b.__hash__() for b in Board(rotator, size, state).rotations()]
+
+                canonical, symmetry = canonicalizer.canonical(mask_from_edges(size, state))
+                assert canonical == min(rotations)
+                assert symmetry == rotations.index(canonical)
+
+    def test_lru_cache(self):
+        canonicalizer = Canonicalizer(2, cache_size=2)
+        for mask in (1, 2, 1, 4, 2):
+            canonicalizer.canonical(mask)
+
+        info = canonicalizer.cache_info()
+        assert (info.hits, info.misses, info.currsize) == (1, 4, 2)
+        assert canonicalizer.canonical(1) == canonicalizer._canonical(1)
@@ -0,0 +1,58 @@
+import random
+
+from src.bitboard import board_tables
+from src.dots_boxes import DotsAndBoxes, DotsAndBoxesCloseBoxesPolicy
+from src.mcts_policy import MCTS, DotsAndBoxesMCTSPolicy, real_position
+from src.solver import Solver
+
+
+class TestMCTS:
+    def test_finds_solver_move(self):
+        size = 2
+        tables = board_tables(size)
+        solver = Solver(size)
+        rng = random.Random(0)
+        for _ in range(10):
+            positions = list(tables.positions)
+            rng.shuffle(positions)
+            mask = sum(1 << p for p in positions[:6])
+            values = solver.action_values(mask)
+
+            mcts = MCTS(size, seed=0)
+            stats, symmetry = mcts.search(mask, simulations=2000)
+            best = max(stats, key=lambda p: stats[p].visits)
+            assert values[real_position(size, symmetry, best)] == max(values.values())
+
+    def test_reuses_tree_between_moves(self):
+        mcts = MCTS(3, seed=0)
+        mcts.search(0, simulations=200)
+        nodes = len(mcts.nodes)
+        stats, symmetry = mcts.search(1 << board_tables(3).positions[0], simulations=0)
+        assert len(mcts.nodes) < nodes and sum(s.visits for s in stats.values()) > 0
+
+    def test_plays_full_games(self):
+        random.seed(0)
+        for workers in (0, 2):
+            policy = DotsAndBoxesMCTSPolicy(simulations=50, workers=workers, seed=0)
+            env = DotsAndBoxes(3, policy, engine=DotsAndBoxes.ENGINE_BITBOARD)
+            player = DotsAndBoxesCloseBoxesPolicy(None)
+            moves = []
+            search_action = policy.next_action
+
+            def next_action(state, action_space):
+                action = search_action(state, action_space)
+                assert action in action_space
+                moves.append(action)
+                return action
+
+            policy.next_action = next_action
+            env.reset()
+            done = False
+            while not done:
+                _, info = env.step(player.next_action(None, env.action_spaces))
+                done = info["done"]
+            policy.close()
+
+            assert moves and len(set(moves)) == len(moves)
+            points = info["player_1_points"], info["player_2_points"]
+            assert max(points) > 9 // 2 or sum(points) == 9
@@ -0,0 +1,94 @@
+import random
+
+import pytest
+
+from src.dots_boxes import DotsAndBoxes, DotsAndBoxesCloseBoxesPolicy
+from src.main import q_learning
+from src.metrics import (
+    OUTCOME_LOST,
+    OUTCOME_WON,
+    CSVSink,
+    EpisodeMetrics,
+    JSONLinesSink,
+    LoggingSink,
+    MetricsRecorder,
+    RingBufferSink,
+    read_csv_metrics,
+    read_json_lines_metrics,
+)
+
+
+def train(size, episodes, metrics):
+    random.seed(0)
+    env = DotsAndBoxes(
+        size,
+        DotsAndBoxesCloseBoxesPolicy(None),
+        engine=DotsAndBoxes.ENGINE_BITBOARD,
+        observation=DotsAndBoxes.OBSERVATION_MASK,
+    )
+    return q_learning(env, episodes, alpha=0.05, gamma=0.95, eps=1.0, eps_decay=1.0, metrics=metrics)
+
+
+class FailingSink(RingBufferSink):
+    def write(self, records):
+        raise IOError("disk full")
+
+
+class TestMetrics:
+    def test_q_learning_records_every_episode(self):
+        sink = RingBufferSink()
+        recorder = MetricsRecorder(sink, batch_size=16)
+        Q = train(3, 50, recorder)
+        records = sink.records()
+        recorder.close()
+
+        assert [record.episode for record in records] == list(range(50))
+        assert records[-1].q_states == len(Q.boards)
+        assert all(record.turns > 0 for record in records)
+        for record in records:
+            assert (record.outcome == OUTCOME_WON) == (record.player_1_points > record.player_2_points)
+            assert (record.outcome == OUTCOME_LOST) == (record.player_1_points < record.player_2_points)
+
+    def test_file_sinks_round_trip(self, tmp_path):
+        records = [EpisodeMetrics(e, 1, 5 + e, 10.5, 3, 1, 7 * e, 0.5) for e in range(10)]
+        for sink_class, read in ((CSVSink, read_csv_metrics), (JSONLinesSink, read_json_lines_metrics)):
+            path = str(tmp_path / sink_class.__name__)
+            for _records in (records[:4], records[4:]):
+                recorder = MetricsRecorder(sink_class(path), batch_size=3)
+                for record in _records:
+                    recorder.record(record)
+                recorder.close()
+            assert read(path) == records
+
+    def test_logging_sink_summarizes_windows(self, caplog):
+        records = [
+            EpisodeMetrics(e, OUTCOME_WON if e % 2 else OUTCOME_LOST, 4, 2.0 * e, 3, 1, e, 0.5) for e in range(5)
+        ]
+        recorder = MetricsRecorder(LoggingSink(window=2), batch_size=1)
+        with caplog.at_level("INFO"):
+            for record in records:
+                recorder.record(record)
+            recorder.close()
+        assert [r.getMessage() for r in caplog.records] == [
+            "episode: 1, reward rate: 1.000, won: 0.500, turns: 4.0, q states: 1, epsilon: 0.5000",
+            "episode: 3, reward rate: 5.000, won: 0.500, turns: 4.0, q states: 3, epsilon: 0.5000",
+            "episode: 4, reward rate: 8.000, won: 0.000, turns: 4.0, q states: 4, epsilon: 0.5000",
+        ]
+
+    def test_q_learning_logs_without_recorder(self, caplog):
+        with caplog.at_level("INFO"):
+            train(2, 201, None)
+        messages = [r.getMessage() for r in caplog.records if r.getMessage().startswith("episode: ")]
+        assert [m.split(",")[0] for m in messages] == ["episode: 0", "episode: 100", "episode: 200"]
+
+    def test_ring_buffer_keeps_last_records(self):
+        sink = RingBufferSink(capacity=3)
+        sink.write(list(range(5)))
+        assert sink.records() == [2, 3, 4]
+
+    def test_sink_errors_are_raised(self):
+        recorder = MetricsRecorder(FailingSink(), batch_size=1)
+        recorder.record(EpisodeMetrics(0, 1, 5, 10.5, 3, 1, 7, 0.5))
+        with pytest.raises(IOError):
+            recorder.flush()
+        recorder.close()
@@ -0,0 +1,15 @@
+import numpy as np
+
+from src.parallel_training import parallel_q_learning
+
+
+class TestParallelQLearning:
+    def test_seeded_runs_do_not_depend_on_workers(self):
+        tables = [
+            parallel_q_learning(2, 60, 0.1, 0.9, eps=0.2, workers=w, snapshot_interval=20, task_episodes=7, seed=3)
+            for w in (0, 2)
+        ]
+
+        assert tables[0].boards.rows == tables[1].boards.rows
+        values = [t.boards.values[: len(t.boards)] for t in tables]
+        assert np.array_equal(values[0], values[1], equal_nan=True)
@@ -0,0 +1,60 @@
+import random
+
+import pytest
+
+from src.dots_boxes import DotsAndBoxes, DotsAndBoxesCloseBoxesPolicy
+from src.learning_player import BoardSaver
+from src.main import q_learning
+from src.profiling import DISABLED, PHASE_OTHER, PhaseProfiler
+
+
+class TestPhaseProfiler:
+    def test_nested_phases_are_exclusive(self):
+        ticks = iter([0, 1, 2, 5, 6, 7])
+        profiler = PhaseProfiler(clock=lambda: next(ticks))
+        profiler.enter("step")
+        previous = profiler.enter("opponent")
+        profiler.resume(previous)
+        profiler.enter(PHASE_OTHER)
+        window = profiler.window(1)
+
+        assert previous == "step"
+        assert window.totals == {PHASE_OTHER: 2, "step": 2, "opponent": 3}
+        assert window.counts == {"step": 1, "opponent": 1, PHASE_OTHER: 1}
+        assert window.seconds == 7 and sum(window.shares().values()) == 1
+        assert profiler.stats() == window
+
+    def test_disabled_profiler_records_nothing(self):
+        assert DISABLED.enter("step") is None
+        DISABLED.resume("step")
+        assert DISABLED.window(1) is None and not DISABLED.totals and not DISABLED.windows
+
+    def test_q_learning_windows(self):
+        random.seed(0)
+        env = DotsAndBoxes(
+            2,
+            DotsAndBoxesCloseBoxesPolicy(None),
+            engine=DotsAndBoxes.ENGINE_BITBOARD,
+            observation=DotsAndBoxes.OBSERVATION_MASK,
+        )
+        profiler = PhaseProfiler()
+        Q = q_learning(env, 250, alpha=0.05, gamma=0.95, eps=1.0, eps_decay=1.0, profiler=profiler)
+
+        assert [window.episodes for window in profiler.windows] == [1, 100, 100, 49]
+        stats = profiler.stats()
+        assert stats.episodes == 250
+        assert {"env_step", "opponent", "canonicalize", "q_lookup", "q_update"} <= set(stats.totals)
+        assert abs(sum(stats.totals.values()) - sum(window.seconds for window in profiler.windows)) < 1e-9
+        assert env.profiler is DISABLED and "canonical" not in vars(Q.canonicalizer)
+
+    def test_q_learning_restores_on_error(self):
+        env = DotsAndBoxes(2, DotsAndBoxesCloseBoxesPolicy(None), engine=DotsAndBoxes.ENGINE_BITBOARD)
+        Q = BoardSaver(2)
+
+        def define(state, action, value):
+            raise Exception("define failed")
+
+        Q.define = define
+        with pytest.raises(Exception, match="define failed"):
+            q_learning(env, 10, alpha=0.05, Q=Q, profiler=PhaseProfiler())
+        assert env.profiler is DISABLED and "canonical" not in vars(Q.canonicalizer)
@@ -0,0 +1,91 @@
+import pickle
+import random
+
+import numpy as np
+
+from src.bitboard import board_tables
+from src.dots_boxes import DotsAndBoxes, DotsAndBoxesMixerPolicy, DotsAndBoxesState
+from src.learning_player import Action, Board, BoardSaver, Rotator
+from src.qtable_io import convert_pickle, open_mapped_qtable, read_qtable, write_qtable
+
+
+def random_saver(size, storage, seed, states=300):
+    rng = random.Random(seed)
+    tables = board_tables(size)
+    edges = [tables.edges[p] for p in tables.positions]
+    saver = BoardSaver(size, storage=storage)
+    for _ in range(states):
+        state = DotsAndBoxesState(rng.sample(edges, rng.randint(0, len(edges) - 1)), rng.randint(0, 2))
+        saver.define(state, rng.choice([e for e in edges if e not in state.state]), rng.random())
+    return saver
+
+
+def stored(saver):
+    return {(b, p): v for b, p, v in saver.boards.items_by_state()}
+
+
+class TestQTableIO:
+    def test_round_trip(self, tmp_path):
+        for size in (2, 3, 5):
+            for storage in (BoardSaver.STORAGE_DICT, BoardSaver.STORAGE_DENSE):
+                saver = random_saver(size, storage, seed=size)
+                write_qtable(tmp_path / "q.qtable", saver)
+                loaded = read_qtable(tmp_path / "q.qtable")
+                assert stored(loaded) == stored(saver)
+
+    def test_mapped_qtable(self, tmp_path):
+        for size in (2, 5):
+            saver = random_saver(size, BoardSaver.STORAGE_DENSE, seed=size)
+            write_qtable(tmp_path / "q.qtable", saver)
+            mapped = open_mapped_qtable(tmp_path / "q.qtable")
+
+            assert stored(mapped) == stored(saver)
+            for board, player_points, values in saver.boards.items_by_state():
+                assert mapped.boards.contains(board, player_points)
+                assert not mapped.boards.contains(board, player_points + 3)
+                actions = list(values)
+                assert list(mapped.boards.action_values(board, player_points, actions)) == list(values.values())
+
+    def test_copy_mapped_qtable(self, tmp_path):
+        saver = random_saver(3, BoardSaver.STORAGE_DENSE, seed=3)
+        write_qtable(tmp_path / "q.qtable", saver)
+        mapped = open_mapped_qtable(tmp_path / "q.qtable")
+
+        copied = mapped.copy()
+        assert copied.storage == mapped.storage
+        assert copied.boards is mapped.boards
+        assert stored(copied) == stored(saver)
+
+        env = DotsAndBoxes(3, DotsAndBoxesMixerPolicy(mapped))
+        env.update_q_value_function(q_value_function=mapped)
+
+    def test_edge_columns_and_wide_points(self, tmp_path):
+        size = 2
+        saver = BoardSaver(size, storage=BoardSaver.STORAGE_DENSE)
+        saver.boards.set_value(5, 300, 3, 1.5)
+        saver.boards.set_value(5, 44, 3, -1.5)
+        assert saver.boards.values.shape[1] == len(board_tables(size).positions)
+        assert stored(saver) == {(5, 300): {3: 1.5}, (5, 44): {3: -1.5}}
+
+        write_qtable(tmp_path / "q.qtable", saver)
+        assert stored(read_qtable(tmp_path / "q.qtable")) == stored(saver)
+        assert stored(open_mapped_qtable(tmp_path / "q.qtable")) == stored(saver)
+
+    def test_convert_legacy_pickle(self, tmp_path):
+        size = 2
+        rotator = Rotator(size)
+        state = [((0, 1), (1, 1)), ((2, 1), (2, 2))]
+        action = ((0, 0), (1, 0))
+        board, canonical_action = min(
+            zip(Board(rotator, size, state).rotations(), Action(rotator, action).rotations()),
+            key=lambda x: x[0].__hash__(),
+        )
+        legacy = BoardSaver.__new__(BoardSaver)
+        legacy.__dict__.update(size=size, rotator=rotator, boards={board: {0: {canonical_action: 1.5}}})
+        with open(tmp_path / "q.pickle", "wb") as handle:
+            pickle.dump(legacy, handle)
+
+        convert_pickle(tmp_path / "q.pickle", tmp_path / "q.qtable")
+        loaded = read_qtable(tmp_path / "q.qtable")
+        assert loaded.get(DotsAndBoxesState(state, 0), action) == 1.5
+        assert np.isnan(loaded.boards.values).sum() == loaded.boards.values.size - 1
@@ -0,0 +1,77 @@
+import random
+
+import numpy as np
+
+from src.bitboard import board_tables, free_positions
+from src.learning_player import BoardSaver
+from src.parallel_training import apply_transitions
+from src.replay_buffer import EdgeReplayBuffer, ReplayBuffer, Transition, apply_batch
+
+
+def random_transitions(size, count, seed):
+    rng = random.Random(seed)
+    tables = board_tables(size)
+    transitions = []
+    for _ in range(count):
+        board = sum(1 << p for p in tables.positions if rng.random() < 0.4)
+        action = rng.choice(free_positions(size, board))
+        next_board = board | 1 << action
+        done = next_board == tables.full_mask or rng.random() < 0.2
+        transitions.append(Transition(board, 0, action, rng.choice([-1.0, 0.0, 1.0]), None if done else next_board, 0))
+    return transitions
+
+
+class TestReplayBuffer:
+    def test_ring_buffer(self):
+        transitions = random_transitions(2, 10, seed=0)
+        buffer = ReplayBuffer(2, capacity=4)
+        buffer.extend(transitions)
+        assert len(buffer) == 4
+        assert {buffer.transition(i) for i in range(4)} == set(transitions[-4:])
+
+    def test_batch_matches_sequential_updates(self):
+        transitions = random_transitions(3, 20, seed=1)
+        # Distinct states and next states do not see each other's updates in either order
+        boards = {t.board for t in transitions}
+        transitions = [t for t in transitions if t.next_board not in boards]
+        transitions = list({(t.board, t.action): t for t in transitions}.values())
+
+        buffer = ReplayBuffer(3)
+        buffer.extend(transitions)
+        batched = BoardSaver(3, storage=BoardSaver.STORAGE_DENSE)
+        apply_batch(batched, buffer, np.arange(len(transitions)), 0.5, 0.9, 3)
+
+        sequential = BoardSaver(3, storage=BoardSaver.STORAGE_DENSE)
+        apply_transitions(sequential, transitions, 0.5, 0.9, 3)
+        for t in transitions:
+            assert batched.boards.value(t.board, 0, t.action) == sequential.boards.value(t.board, 0, t.action)
+
+    def test_duplicates_move_by_mean_error(self):
+        transition = Transition(0, 0, 0, 0.0, None, 0)
+        buffer = ReplayBuffer(2)
+        buffer.extend([transition, transition._replace(reward=2.0)])
+        Q = BoardSaver(2)
+        td_errors = apply_batch(Q, buffer, np.array([0, 1]), 0.5, 1.0, 0.0)
+        assert list(td_errors) == [0.0, 2.0]
+        assert Q.boards.value(0, 0, 0) == 0.5
+
+    def test_prioritized_sampling(self):
+        buffer = ReplayBuffer(2, prioritized=True, seed=0)
+        buffer.extend(random_transitions(2, 10, seed=2))
+        buffer.update_priorities(np.arange(10), np.array([0.0] * 9 + [100.0]))
+        batch = buffer.sample(1000)
+        assert (batch.indexes == 9).mean() > 0.8
+        assert batch.weights.max() == 1.0 and batch.weights[batch.indexes == 9].min() < 1.0
+
+    def test_edge_ring_buffer(self):
+        size = 2
+        slots = board_tables(size).slots
+        buffer = EdgeReplayBuffer(size, capacity=5, seed=0)
+        for step in range(3):
+            edges = np.zeros((2, slots), dtype=bool)
+            edges[:, step] = True
+            buffer.add_batch(edges, [step, step], [step, step], [1.0, -1.0], edges, [0, 0], [False, True])
+        assert len(buffer) == 5
+        assert list(buffer.actions) == [2, 0, 1, 1, 2]
+        assert buffer.edges[0, 2] and not buffer.edges[0, 0]
+        assert set(buffer.sample(20).indexes) <= set(range(5))
@@ -0,0 +1,114 @@
+import copy
+import functools
+import random
+
+from src.bitboard import board_tables, free_positions
+from src.dots_boxes import DotsAndBoxes, DotsAndBoxesPolicy, DotsAndBoxesState
+from src.learning_player import BoardSaver
+from src.solver import Solver, playout_return, seed_q_table
+
+
+def closed_boxes(tables, mask, position):
+    return sum(1 for box in tables.edge_boxes[position] if mask & tables.box_masks[box] == tables.box_masks[box])
+
+
+class SolverPolicy(DotsAndBoxesPolicy):
+    """
+    Plays the solver moves once at most max_free edges are free, random ones before.
+    """
+
+    def __init__(self, solver, max_free, rng):
+        super().__init__(None)
+        self.solver = solver
+        self.max_free = max_free
+        self.rng = rng
+
+    def next_action(self, state, action_space):
+        if len(action_space) > self.max_free:
+            return self.rng.choice(sorted(action_space))
+        return self.solver.tables.edges[self.solver.best_action(state.state)]
+
+
+def minimax(size):
+    tables = board_tables(size)
+
+    @functools.lru_cache(maxsize=None)
+    def value(mask):
+        if mask == tables.full_mask:
+            return 0
+        best = None
+        for position in tables.positions:
+            if mask >> position & 1:
+                continue
+            child = mask | 1 << position
+            closed = closed_boxes(tables, child, position)
+            _value = closed + value(child) if closed else -value(child)
+            best = _value if best is None else max(best, _value)
+        return best
+
+    return value
+
+
+class TestSolver:
+    def test_matches_minimax(self):
+        value = minimax(2)
+        solver = Solver(2)
+        assert solver.solve().value == value(0) == 2
+
+        tables = board_tables(2)
+        rng = random.Random(0)
+        for _ in range(50):
+            mask = sum(1 << p for p in tables.positions if rng.random() < 0.5)
+            result = solver.solve(mask)
+            assert result.exact and result.value == value(mask)
+
+    def test_action_values(self):
+        value = minimax(2)
+        solver = Solver(2, table_size=64)
+        tables = board_tables(2)
+        mask = sum(1 << p for p in tables.positions[::3])
+        for position, _value in solver.action_values(mask).items():
+            child = mask | 1 << position
+            closed = closed_boxes(tables, child, position)
+            assert _value == (closed + value(child) if closed else -value(child))
+        assert len(solver.table) <= 64
+
+    def test_seed_q_table(self):
+        saver = BoardSaver(1)
+        tables = board_tables(1)
+        state = DotsAndBoxesState([tables.edges[tables.positions[0]]], 0)
+        seed_q_table(saver, [state])
+        values = saver.get_all(state, [tables.edges[p] for p in tables.positions[1:]])
+        # One net box still to come, and the win it leads to
+        assert list(values) == [2, 2, 2]
+        assert saver.get(state, tables.edges[tables.positions[1]]) == 2
+
+    def test_playout_return_matches_env(self):
+        size, gamma = 3, 0.95
+        solver = Solver(size)
+        rng = random.Random(0)
+        for _ in range(3):
+            env = DotsAndBoxes(
+                size,
+                SolverPolicy(solver, 12, rng),
+                engine=DotsAndBoxes.ENGINE_BITBOARD,
+                observation=DotsAndBoxes.OBSERVATION_MASK,
+                actions=DotsAndBoxes.ACTIONS_INDEX,
+            )
+            state, info = env.reset()
+            while len(env.action_spaces) > 12:
+                state, info = env.step(rng.choice(free_positions(size, state.state)))
+                assert not info["done"]
+
+            for position in free_positions(size, state.state):
+                # The rewards q_learning sees when playing position and then the solver moves, discounted by gamma
+                played = copy.deepcopy(env)
+                _return, discount, action, done = 0.0, 1.0, position, False
+                while not done:
+                    next_state, info = played.step(action)
+                    _return += discount * info["reward"]
+                    discount *= gamma
+                    done = info["done"]
+                    action = None if done else solver.best_action(next_state.state)
+                expected = playout_return(size, state.state, state.player_points, position, solver.best_action, gamma)
+                assert abs(expected - _return) < 1e-9
@@ -0,0 +1,75 @@
+import random
+
+from src.bitboard import board_tables, edges_from_mask
+from src.dots_boxes import DotsAndBoxes, DotsAndBoxesCloseBoxesPolicy, DotsAndBoxesRandomPolicy, DotsAndBoxesState
+from src.learning_player import BoardSaver
+from src.solver import Solver, seed_q_table
+from src.tablebase import DotsAndBoxesTablebasePolicy, Tablebase, TablebaseBoardSaver, build_tablebase, write_tablebase
+
+
+class TestTablebase:
+    def test_matches_solver(self, tmp_path):
+        build_tablebase(tmp_path / "serial", 2, 8, workers=0, chunk_size=16)
+        build_tablebase(tmp_path / "parallel", 2, 8, workers=2, chunk_size=16)
+        assert (tmp_path / "serial").read_bytes() == (tmp_path / "parallel").read_bytes()
+
+        tablebase = Tablebase(tmp_path / "serial")
+        solver = Solver(2)
+        tables = board_tables(2)
+        rng = random.Random(0)
+        for _ in range(100):
+            positions = list(tables.positions)
+            rng.shuffle(positions)
+            mask = sum(1 << p for p in positions[rng.randint(0, 10) :])
+            if not tablebase.covers(mask):
+                assert tablebase.value(mask) is None
+                continue
+            assert tablebase.value(mask) == solver.solve(mask).value
+            assert tablebase.action_values(mask) == solver.action_values(mask)
+
+    def test_missing_key(self, tmp_path):
+        tables = board_tables(2)
+        # Only the full board: every other covered position misses, including those sorting past the last key
+        write_tablebase(tmp_path / "tablebase", 2, 2, [tables.full_mask], [0])
+        tablebase = Tablebase(tmp_path / "tablebase")
+        assert tablebase.value(tables.full_mask) == 0
+        for position in tables.positions:
+            assert tablebase.value(tables.full_mask ^ 1 << position) is None
+        assert tablebase.action_values(tables.full_mask ^ 3) is None
+
+    def test_policy_and_board_saver(self, tmp_path):
+        build_tablebase(tmp_path / "tablebase", 2, 6, workers=0)
+        tablebase = Tablebase(tmp_path / "tablebase")
+        tables = board_tables(2)
+
+        policy = DotsAndBoxesTablebasePolicy(tablebase, DotsAndBoxesRandomPolicy(None))
+        env = DotsAndBoxes(2, policy, engine=DotsAndBoxes.ENGINE_BITBOARD)
+        for _ in range(20):
+            env.reset()
+            done = False
+            while not done:
+                if tablebase.covers(env.edges):
+                    action = policy.next_action(None, env.action_spaces)
+                    assert env._tables.edge_index[action] == tablebase.best_action(env.edges)
+                _, info = env.step(DotsAndBoxesCloseBoxesPolicy(None).next_action(None, env.action_spaces))
+                done = info["done"]
+
+        saver = TablebaseBoardSaver(BoardSaver(2), tablebase)
+        mask = sum(1 << p for p in tables.positions[:7])
+        state = DotsAndBoxesState(edges_from_mask(2, mask), 0)
+        actions = [tables.edges[p] for p in tables.positions[7:]]
+        assert saver.contains(state)
+        saver.define(state, actions[0], 100.0)
+        assert len(saver.boards) == 0
+        best = tablebase.best_action(mask)
+        assert tables.edge_index[saver.argmax(state, actions)] == best
+        assert saver.get(state, tables.edges[best]) == max(saver.get_all(state, actions))
+
+        opening = DotsAndBoxesState([], 0)
+        assert not saver.contains(opening)
+        saver.define(opening, tables.edges[tables.positions[0]], 1.0)
+        assert saver.contains(opening) and saver.get(opening, tables.edges[tables.positions[0]]) == 1.0
+
+        # Seeding from the solver stores the same reward units the tablebase answers with
+        seeded = seed_q_table(BoardSaver(2), [state])
+        assert list(seeded.get_all(state, actions)) == list(saver.get_all(state, actions))
@@ -0,0 +1,50 @@
+import random
+
+import numpy as np
+
+from src.dots_boxes import DotsAndBoxes, DotsAndBoxesCloseBoxesPolicy, DotsAndBoxesPolicy, DotsAndBoxesRandomPolicy
+from src.vector_dots_boxes import VectorDotsAndBoxes
+
+
+class FirstEdgePolicy(DotsAndBoxesPolicy):
+    def next_action(self, state, action_space):
+        return min(action_space)
+
+
+class TestVectorDotsAndBoxes:
+    def test_matches_single_environment(self):
+        size = 3
+        env = DotsAndBoxes(size, FirstEdgePolicy(None), engine=DotsAndBoxes.ENGINE_BITBOARD)
+        seed = next(s for s in range(100) if not random.Random(s).choice([True, False]))
+        random.seed(seed)
+        env.reset()
+
+        vector_env = next(
+            e for e in (VectorDotsAndBoxes(1, size, FirstEdgePolicy(None), seed=s) for s in range(100))
+            if not e.reset().edges.any()
+        )
+
+        done = False
+        while not done:
+            action = max(env.action_spaces)
+            _, info = env.step(action)
+            _, vector_info = vector_env.step([env._tables.edge_index[action]])
+            for key, value in info.items():
+                assert vector_info[key][0] == value
+            done = info["done"]
+
+    def test_batched_policies(self):
+        for policy in (DotsAndBoxesRandomPolicy(None), DotsAndBoxesCloseBoxesPolicy(None)):
+            env = VectorDotsAndBoxes(64, 3, policy, seed=0)
+            observation = env.reset()
+            episodes = 0
+            for _ in range(200):
+                legal = env.legal_actions()
+                actions = np.argmax(legal, axis=1)
+                observation, info = env.step(actions)
+                episodes += info["done"].sum()
+
+                taken_boxes = (env.box_sides == 4).sum(axis=1)
+                assert (taken_boxes == env.points[:, 1] + env.points[:, 2]).all()
+                assert (observation.player_points == env.points[:, 1]).all()
+            assert episodes > 0